@@ -0,0 +1,212 @@
+"""
+\file       batch_decoder.py
+\author     Ladislav Stefka
+\brief      Columnar decoding of captured radio frames for analytics
+            - many raw payloads or one concatenated buffer with frame offsets
+            - frames grouped by packet class (CMD, DATA_TYPE), fixed fields decoded per group at once
+              into NumPy structured array (or column dict of lists without NumPy)
+            - field layouts are taken from radio_packet classes (LAYOUT), FFT bins and StatusInfo peaks as 2D columns
+\copyright
+"""
+
+from struct import Struct
+
+import radio_packet as rp
+import tools
+
+np = tools.np
+
+
+#packet class -> (column, typecode, count) of fixed size arrays following fixed fields
+TAIL_COLUMNS = {
+    rp.FFTChunkData: [("bins", rp.PAT_FLOAT, rp.FFTChunkData.FFT_BINS)],
+}
+
+#StatusInfo peaks columns are padded to MAX_FFT_PEAKS (count in fft_peaks_num)
+MAX_FFT_PEAKS = 10
+
+
+def packet_dtype(packet_class):
+    """NumPy structured dtype of fixed fields of packet class, packed as SCHEMA"""
+    return np.dtype([(field, tools.LE_DTYPES[fmt]) for field, fmt in packet_class.LAYOUT])
+
+
+class Batch:
+    """Decoded frames of one packet class
+
+    index - positions of frames in input, records - structured array (dict of column lists without NumPy),
+    tails - extra 2D columns (FFT bins, peaks), truncated - positions of frames shorter than fixed fields
+    """
+
+    def __init__(self, packet_class, index, records, tails, truncated):
+        self.packet_class = packet_class
+        self.index = index
+        self.records = records
+        self.tails = tails
+        self.truncated = truncated
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, column):
+        return self.columns()[column]
+
+    def columns(self):
+        if np is not None:
+            columns = {field: self.records[field] for field in self.records.dtype.names}
+        else:
+            columns = dict(self.records)
+        columns.update(self.tails)
+        return columns
+
+    def __str__(self):
+        return "{}: {} frames, {} truncated".format(self.packet_class.__name__, len(self), len(self.truncated))
+
+
+def concat(frames):
+    """Concatenated buffer and start offsets of frames"""
+    offsets = []
+    position = 0
+    for frame in frames:
+        offsets.append(position)
+        position += len(frame)
+    return b"".join(bytes(frame) for frame in frames), offsets
+
+
+def decode_frames(frames):
+    return decode_buffer(*concat(frames))
+
+
+def decode_buffer(buffer, offsets):
+    """Decodes frames in buffer starting at offsets (frame ends at next offset or at the end of buffer)
+
+    Returns dict packet class -> Batch, unknown frames (no packet class) are under key None as list of positions.
+    """
+    if np is None:
+        return _decode_buffer_lists(buffer, offsets)
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    starts = np.asarray(offsets, dtype=np.int64)
+    ends = np.append(starts[1:], len(data))
+    lengths = ends - starts
+    nonempty = lengths > 0
+    commands = np.full(len(starts), -1, dtype=np.int64)
+    commands[nonempty] = data[starts[nonempty]]
+    has_type = lengths > 2
+    data_types = np.full(len(starts), -1, dtype=np.int64)
+    data_types[has_type] = data[starts[has_type] + 2]
+
+    batches = {}
+    unknown = [np.flatnonzero(~nonempty)]
+    for command in np.unique(commands[nonempty]):
+        selected = commands == command
+        packet_class = rp.RadioPacket.registry.get((int(command), None))
+        if packet_class is None:
+            unknown.append(np.flatnonzero(selected))
+            continue
+        if not packet_class.DATA_TYPE_DISPATCH:
+            batches[packet_class] = _decode_group(packet_class, data, starts, lengths, np.flatnonzero(selected))
+            continue
+        for data_type in np.unique(data_types[selected]):
+            typed = selected & (data_types == data_type)
+            sub_class = rp.RadioPacket.registry.get((int(command), int(data_type)))
+            if sub_class is None:
+                unknown.append(np.flatnonzero(typed))
+            else:
+                batches[sub_class] = _decode_group(sub_class, data, starts, lengths, np.flatnonzero(typed))
+    batches[None] = np.sort(np.concatenate(unknown)).tolist()
+    return batches
+
+
+def _gather(data, starts, size):
+    """(len(starts), size) bytes of frames, one fancy indexing for all of them"""
+    return data[starts[:, None] + np.arange(size)]
+
+
+def _decode_group(packet_class, data, starts, lengths, index):
+    size = packet_class.SCHEMA.size
+    complete = lengths[index] >= size
+    truncated = index[~complete].tolist()
+    index = index[complete]
+    group_starts = starts[index]
+    records = _gather(data, group_starts, size).view(packet_dtype(packet_class)).reshape(-1)
+
+    tails = {}
+    offset = size
+    for column, typecode, count in TAIL_COLUMNS.get(packet_class, ()):
+        dtype = np.dtype(tools.LE_DTYPES[typecode])
+        nbytes = count * dtype.itemsize
+        fits = lengths[index] >= offset + nbytes
+        values = np.zeros((len(index), count), dtype=dtype)
+        values[fits] = _gather(data, group_starts[fits] + offset, nbytes).view(dtype)
+        tails[column] = values
+        offset += nbytes
+
+    if packet_class is rp.StatusInfo:
+        tails.update(_decode_peaks(data, group_starts, lengths[index], records["fft_peaks_num"], size))
+
+    return Batch(packet_class, index, records, tails, truncated)
+
+
+def _decode_peaks(data, starts, lengths, peaks_num, size):
+    """Peaks padded to MAX_FFT_PEAKS columns, indexes 0 and values NaN where there is no peak"""
+    peaks_num = np.minimum(peaks_num.astype(np.int64), MAX_FFT_PEAKS)
+    peaks_num = np.where(lengths >= size + peaks_num * 6, peaks_num, 0)
+    slots = np.arange(MAX_FFT_PEAKS)
+    valid = slots[None, :] < peaks_num[:, None]
+    indexes = np.zeros((len(starts), MAX_FFT_PEAKS), dtype=np.uint16)
+    values = np.full((len(starts), MAX_FFT_PEAKS), np.nan, dtype=np.float32)
+    rows, cols = np.nonzero(valid)
+    if len(rows):
+        index_pos = starts[rows] + size + cols * 2
+        value_pos = starts[rows] + size + peaks_num[rows] * 2 + cols * 4
+        indexes[rows, cols] = _gather(data, index_pos, 2).view("<u2").reshape(-1)
+        values[rows, cols] = _gather(data, value_pos, 4).view("<f4").reshape(-1)
+    return {"peaks_indexes": indexes, "peaks_values": values}
+
+
+def _decode_buffer_lists(buffer, offsets):
+    """Column dict of lists variant of decode_buffer (NumPy is not available)"""
+    groups = {}
+    unknown = []
+    ends = list(offsets[1:]) + [len(buffer)]
+    classes = {}
+    for position, (start, end) in enumerate(zip(offsets, ends)):
+        key = buffer[start:min(end, start + 3)]
+        packet_class = classes.get(key)
+        if packet_class is None and end > start:
+            packet_class = classes[key] = rp.packet_class_for(key)
+        if packet_class is None:
+            unknown.append(position)
+        else:
+            groups.setdefault(packet_class, []).append((position, start, end))
+
+    batches = {None: unknown}
+    for packet_class, frames in groups.items():
+        schema = packet_class.SCHEMA
+        index, rows, truncated = [], [], []
+        for position, start, end in frames:
+            if end - start < schema.size:
+                truncated.append(position)
+                continue
+            index.append(position)
+            rows.append(schema.unpack_from(buffer, start))
+        columns = dict(zip(packet_class.FIELD_NAMES, (list(column) for column in zip(*rows))))
+        complete = [(start, end) for position, start, end in frames if end - start >= schema.size]
+        tails = {}
+        offset = schema.size
+        for column, typecode, count in TAIL_COLUMNS.get(packet_class, ()):
+            tail = Struct("<{}{}".format(count, typecode))
+            tails[column] = [list(tail.unpack_from(buffer, start + offset)) if end - start >= offset + tail.size
+                             else [0] * count for start, end in complete]
+            offset += tail.size
+        if packet_class is rp.StatusInfo:
+            tails["peaks_indexes"], tails["peaks_values"] = [], []
+            peak_structs = [Struct("<{0}H{0}f".format(num)) for num in range(MAX_FFT_PEAKS + 1)]
+            for (start, end), num in zip(complete, columns.get("fft_peaks_num", [])):
+                num = min(num, MAX_FFT_PEAKS) if end - start >= schema.size + num * 6 else 0
+                peaks = peak_structs[num].unpack_from(buffer, start + schema.size)
+                tails["peaks_indexes"].append(list(peaks[:num]) + [0] * (MAX_FFT_PEAKS - num))
+                tails["peaks_values"].append(list(peaks[num:]) + [float("nan")] * (MAX_FFT_PEAKS - num))
+        batches[packet_class] = Batch(packet_class, index, columns, tails, truncated)
+    return batches
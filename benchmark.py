@@ -0,0 +1,807 @@
+"""
+\file       benchmark.py
+\author     Ladislav Stefka
+\brief      Benchmarks of gateway hot paths
+            - SPI transactions per received frame (RX done handler)
+            - end-to-end gateway RX load on simulated module (sx127x_sim)
+            - uplinks received during downlinks, single radio vs multi-radio gateway
+            - radio packet decode cost per frame, StatusInfo field access
+            - FFT chunk bins and StatusInfo peaks decoding
+            - columnar batch decoding of captured frames vs RadioPacket objects
+            - FFT spectrum reassembly over lossy link (loss, duplicates, reordering)
+            - threads and memory per node of node workers on shared worker pool
+            - concurrent joins through shared Node-RED UDP endpoint, replies routed by correlation id
+            - idle CPU and re-arm cost of node liveness timers on timer wheel vs per node polling
+            - bounded queues under stalled consumer, drop policies and kept high priority items
+            - gateway restart to first forwarded uplink, cold (rejoin) vs warm (restored sessions)
+            - joins with slow Node-RED, cache miss vs cached and prefetched node info
+            - status info posts to Node-RED, datagram per post vs batches
+            - HTTP posts to slow Node-RED, blocking requests.post vs pooled client with futures
+            - status info posts during Node-RED restart, lost records without spool vs disk spool and replay
+\copyright
+"""
+
+import sys
+import time
+import struct
+import threading
+
+import lora_module as lm
+import rpi_board as rb
+import sx127x_sim
+import packet_forwarder as pf
+import lora_node_worker as lnw
+import tools
+import radio_packet
+import batch_decoder
+import fft_reassembly
+import random
+import logging
+import tracemalloc
+import worker_pool
+import udp_endpoint
+import uplink_spool
+import nodered_cache
+import http_client
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bounded_queue
+from queue import Queue
+import datetime
+import os
+import shutil
+import tempfile
+import json
+import socket
+
+from lora_module import REG_LORA
+
+
+def legacy_rx_read(m):
+    """RX done register sequence as done by on_rx_done before SX127X_harvest_rx (one register per transaction)"""
+    board = m.rpi_board
+    irq = board.SPI_read_register(REG_LORA.IRQ_FLAGS)[1]
+    board.SPI_write_register(REG_LORA.IRQ_FLAGS, board.SPI_read_register(REG_LORA.IRQ_FLAGS)[1] | 0x40)
+    if irq >> 5 & 0x01:
+        return None
+    current_addr = board.SPI_read_register(REG_LORA.FIFO_RX_CURR_ADDR)[1]
+    received_bytes = board.SPI_read_register(REG_LORA.RX_NB_BYTES)[1]
+    board.SPI_write_register(REG_LORA.FIFO_ADDR_PTR, current_addr)
+    payload = board.SPI_read_buffer(REG_LORA.FIFO, received_bytes)[1:received_bytes + 1]
+    board.SPI_read_register(REG_LORA.PKT_SNR_VALUE)
+    board.SPI_read_register(REG_LORA.PKT_RSSI_VALUE)
+    board.SPI_read_register(REG_LORA.RSSI_VALUE)
+    return payload
+
+
+def bench_rx_transactions(m, frames=100):
+    """Count SPI transactions and time per received frame for legacy and harvest RX read"""
+    results = {}
+    for name, read in (("legacy", legacy_rx_read), ("harvest", lm.SX127X_Module.SX127X_harvest_rx)):
+        start_transactions = m.rpi_board.SPI_transactions
+        start = time.perf_counter()
+        for _ in range(frames):
+            read(m)
+        elapsed = time.perf_counter() - start
+        results[name] = dict(
+            transactions_per_frame=(m.rpi_board.SPI_transactions - start_transactions) / frames,
+            us_per_frame=elapsed / frames * 1e6,
+        )
+    return results
+
+
+def statusinfo_frame(sessionid, temperature=2500):
+    """Raw StatusInfo radio frame without FFT peaks"""
+    return struct.pack("<BBBHHHfBHHB", 0x30, sessionid, 200, temperature, 100, 300, 3.0, 5, 10, 20, 0)
+
+
+def legacy_decode(data):
+    """Radio packet class lookup as done by RadioPacket.__init__ before class registry (__subclasses__ scan)"""
+    command = data[0]
+    for x in radio_packet.RadioPacket.__subclasses__():
+        if x.CMD == command:
+            if command == radio_packet.SensorDataReply.CMD:
+                for sensor_dt in radio_packet.SensorDataReply.__subclasses__():
+                    if data[2] == sensor_dt.DATA_TYPE:
+                        x = sensor_dt
+                        break
+                else:
+                    raise NameError("Sensor class not found for data_type", data[2])
+            rp = object.__new__(x)
+            rp._load(data)
+            return rp
+    raise NameError("Packet class not found for command ", command)
+
+
+def legacy_statusinfo_fields(rawdata):
+    """StatusInfo fields as read by log line in NodeWorker.worker and prepare_from_statusinfo_radio_packet
+        before packet schemas (slice and struct.unpack per property access)"""
+    fields = []
+    for _ in range(2):
+        fields += [rawdata[2], struct.unpack("H", rawdata[3:5])[0], struct.unpack("H", rawdata[5:7])[0],
+                   struct.unpack("H", rawdata[7:9])[0], struct.unpack("f", rawdata[9:13])[0], rawdata[13],
+                   struct.unpack("H", rawdata[14:16])[0], struct.unpack("H", rawdata[16:18])[0], rawdata[18]]
+    return fields
+
+
+def statusinfo_fields(rawdata):
+    rp = radio_packet.decode(rawdata)
+    fields = []
+    for _ in range(2):
+        fields += [rp.battery, rp.temperature, rp.rms, rp.vpp, rp.kurtosis_ratio, rp.ringdown_counts,
+                   rp.rise_time, rp.threshold_duration, rp.fft_peaks_num]
+    return fields
+
+
+def bench_decode(frames=100000):
+    """Decode time per frame, uplink mix of StatusInfo, FFT chunk and temperature data frames"""
+    mix = [
+        statusinfo_frame(0x01),
+        bytes([radio_packet.FFTChunkData.CMD, 0x01, 0x01, 0x00, 0x10]) + bytes(132),
+        bytes([radio_packet.SensorDataReply.CMD, 0x01, radio_packet.TemperatureData.DATA_TYPE, 0x00, 0x01]) + bytes(6),
+    ]
+    results = {}
+    for name, decode in (("legacy", legacy_decode), ("registry", radio_packet.decode)):
+        start = time.perf_counter()
+        for i in range(frames):
+            decode(mix[i % len(mix)])
+        results[name] = dict(us_per_frame=(time.perf_counter() - start) / frames * 1e6)
+    return results
+
+
+def bench_statusinfo_fields(frames=100000):
+    """Time per StatusInfo frame to read its fields twice (worker log line, JSON post request)"""
+    frame = statusinfo_frame(0x01)
+    results = {}
+    for name, read in (("legacy", legacy_statusinfo_fields), ("schema", statusinfo_fields)):
+        start = time.perf_counter()
+        for _ in range(frames):
+            read(frame)
+        results[name] = dict(us_per_frame=(time.perf_counter() - start) / frames * 1e6)
+    return results
+
+
+def fft_chunk_frame(sessionid, seqnum):
+    """Raw FFT chunk radio frame with 32 float32 bins"""
+    return (struct.pack("<BBBBBI", radio_packet.FFTChunkData.CMD, sessionid, radio_packet.FFTChunkData.DATA_TYPE,
+                        seqnum, 32, 0) + struct.pack("<32f", *[float(seqnum * 32 + i) for i in range(32)]))
+
+
+def legacy_fft_bins(rawdata):
+    """FFTChunkData.get_FFT_bins before typed arrays (per-element unpack)"""
+    fft_bins = []
+    for i in range(128 // 4):
+        fft_bins.append(struct.unpack("f", rawdata[9 + i * 4: 9 + i * 4 + 4])[0])
+    return fft_bins
+
+
+def legacy_fft_peaks(rawdata):
+    """StatusInfo.get_fft_peaks before typed arrays"""
+    n = rawdata[18]
+    indexes = [struct.unpack("H", rawdata[19 + i * 2: 21 + i * 2])[0] for i in range(n)]
+    values = [struct.unpack("f", rawdata[19 + n * 2 + i * 4: 23 + n * 2 + i * 4])[0] for i in range(n)]
+    return sorted((indexes[i], values[i]) for i in range(n))
+
+
+def bench_fft_decode(frames=20000, peaks=10):
+    """Time per frame of FFT chunk bins and StatusInfo peaks decoding, legacy vs typed arrays"""
+    chunk = radio_packet.decode(fft_chunk_frame(0x01, 3))
+    status = radio_packet.decode(statusinfo_frame(0x01)[:-1] + struct.pack(
+        "<B{0}H{0}f".format(peaks), peaks, *(list(range(peaks, 0, -1)) + [float(i) for i in range(peaks)])))
+    assert legacy_fft_bins(chunk.rawdata) == list(chunk.get_FFT_bins())
+    assert legacy_fft_peaks(status.rawdata) == status.get_fft_peaks()
+    results = {}
+    for name, bins, fft_peaks in (("legacy", lambda: legacy_fft_bins(chunk.rawdata), lambda: legacy_fft_peaks(status.rawdata)),
+                                  ("typed", chunk.get_FFT_bins, status.get_fft_peaks)):
+        start = time.perf_counter()
+        for _ in range(frames):
+            bins()
+        bins_us = (time.perf_counter() - start) / frames * 1e6
+        start = time.perf_counter()
+        for _ in range(frames):
+            fft_peaks()
+        results[name] = dict(bins_us_per_frame=bins_us, peaks_us_per_frame=(time.perf_counter() - start) / frames * 1e6)
+    return results
+
+
+def bench_batch_decode(frames=200000):
+    """Time per frame to get StatusInfo temperature column of captured frames (mix with FFT chunks)"""
+    captured = [fft_chunk_frame(0x01, i % 32) if i % 10 == 9 else statusinfo_frame(0x01, temperature=i % 4096)
+                for i in range(frames)]
+    buffer, offsets = batch_decoder.concat(captured)
+    results = {}
+
+    start = time.perf_counter()
+    temperatures = [p.temperature for p in map(radio_packet.decode, captured) if isinstance(p, radio_packet.StatusInfo)]
+    results["objects"] = dict(us_per_frame=(time.perf_counter() - start) / frames * 1e6)
+
+    start = time.perf_counter()
+    batches = batch_decoder.decode_buffer(buffer, offsets)
+    results["batch"] = dict(us_per_frame=(time.perf_counter() - start) / frames * 1e6)
+    assert list(batches[radio_packet.StatusInfo]["temperature"]) == temperatures
+    return results
+
+
+def bench_fft_reassembly(spectra=100, n_samples=2048, loss=0.1, duplicates=0.05, chunk_time=0.5, seed=1):
+    """Spectra sent as shuffled chunks over link with loss and duplicates, missing chunks re-requested on timeout
+        (simulated clock, chunk_time seconds per chunk)"""
+    rnd = random.Random(seed)
+    fft_reassembly.FFTReassembler.latency = tools.LatencyStat()
+    fft_reassembly.FFTReassembler.retries = fft_reassembly.FFTReassembler.failed = 0
+    chunks = [radio_packet.decode(fft_chunk_frame(0x01, seqnum)) for seqnum in range(n_samples // 64)]
+    complete = 0
+    for _ in range(spectra):
+        now = 0.0
+        fft = fft_reassembly.FFTReassembler(n_samples)
+        fft.start(now)
+        requested = list(range(fft.nchunks))
+        while requested is not None:
+            rnd.shuffle(requested)
+            for seqnum in requested:
+                now += chunk_time
+                if rnd.random() >= loss:
+                    fft.add(chunks[seqnum], now)
+                if rnd.random() < duplicates:
+                    fft.add(chunks[seqnum], now)
+            if fft.complete:
+                complete += 1
+                assert list(fft.spectrum()) == [float(i) for i in range(n_samples // 2)]
+                break
+            requested = fft.on_timeout(now + fft.timeout)
+            now += fft.timeout
+    return dict(spectra=spectra, complete=complete, failed=fft_reassembly.FFTReassembler.failed,
+                retries=fft_reassembly.FFTReassembler.retries, latency=str(fft_reassembly.FFTReassembler.latency))
+
+
+def join_request_frame(uid):
+    return struct.pack("<BBIIBB", radio_packet.JoinRequest.CMD, 0x00, uid, 0, 0, 1)
+
+
+def bench_worker_pool(node_counts=(10, 100, 500)):
+    """Threads and memory per node with node workers on worker pool, every node processes its join request"""
+    results = []
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    for count in node_counts:
+        pool = worker_pool.WorkerPool()
+        tx_queue = pf.TxQueue()
+        threads_before = threading.active_count()
+        endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0))
+        tracemalloc.start()
+        nodes = [lnw.NodeWorker(tx_queue, {}, pool, endpoint) for _ in range(count)]
+        for i, node in enumerate(nodes):
+            node.put(radio_packet.decode(join_request_frame(i)))
+            node.start()
+        wait_for(lambda: pool.processed >= count)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append(dict(nodes=count, processed=pool.processed,
+                            threads=threading.active_count() - threads_before, legacy_threads=3 * count,
+                            kib_per_node=memory / count / 1024))
+        for node in nodes:
+            node.stop()
+        endpoint.close()
+        pool.stop()
+    logging.getLogger().setLevel(level)
+    return results
+
+
+def bench_timers(node_counts=(10, 1000, 5000), idle=1.0, rearms=100000):
+    """Process CPU of idle gateway with armed node liveness timers, legacy polled datetime.now() every 100 ms per node"""
+    next_timeout = datetime.datetime.now() + datetime.timedelta(seconds=1000)
+    start = time.perf_counter()
+    for _ in range(rearms):
+        datetime.datetime.now() > next_timeout
+    legacy_check = (time.perf_counter() - start) / rearms
+
+    results = []
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    for count in node_counts:
+        pool = worker_pool.WorkerPool()
+        pool.start()
+        endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0))
+        nodes = [lnw.NodeWorker(pf.TxQueue(), {}, pool, endpoint) for _ in range(count)]
+        for node in nodes:
+            node.start()
+        time.sleep(0.1)
+        cpu = time.process_time()
+        time.sleep(idle)
+        cpu = time.process_time() - cpu
+
+        start = time.perf_counter()
+        for i in range(rearms):
+            nodes[i % count].extendTimeout()
+        rearm = time.perf_counter() - start
+
+        results.append(dict(nodes=count, timers=len(pool.timers), idle_cpu_percent=100 * cpu / idle,
+                            legacy_idle_cpu_percent=100 * count * 10 * legacy_check,
+                            rearm_us=rearm / rearms * 1e6))
+        for node in nodes:
+            node.stop()
+        endpoint.close()
+        pool.stop()
+    logging.getLogger().setLevel(level)
+    return results
+
+
+def bench_bounded_queues(items=20000, capacity=64, control_every=10):
+    """Producer fills queue of stalled consumer, every control_every-th item is JoinReply, others FFT requests"""
+    frames = []
+    for i in range(items):
+        frames.append(radio_packet.JoinReply() if i % control_every == 0 else radio_packet.FFTChunkRequest())
+
+    results = {}
+    unbounded = Queue()
+    tracemalloc.start()
+    for frame in frames:
+        unbounded.put(frame)
+    results["unbounded"] = dict(depth=unbounded.qsize(), kib=tracemalloc.get_traced_memory()[0] / 1024)
+    tracemalloc.stop()
+
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    for policy in (bounded_queue.DROP_OLDEST, bounded_queue.DROP_NEWEST, bounded_queue.BLOCK, bounded_queue.PRIORITY):
+        queue = bounded_queue.BoundedQueue(capacity, policy, timeout=0.0, priority=pf.tx_priority, name=policy)
+        tracemalloc.start()
+        start = time.perf_counter()
+        for frame in frames:
+            queue.put(frame)
+        elapsed = time.perf_counter() - start
+        kib = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+        kept = []
+        while not queue.empty():
+            kept.append(queue.get_nowait())
+        results[policy] = dict(depth=len(kept), kib=kib, put_us=elapsed / items * 1e6, dropped=queue.dropped,
+                               high_water=queue.high_water,
+                               join_replies_kept=sum(isinstance(f, radio_packet.JoinReply) for f in kept))
+    logging.getLogger().setLevel(level)
+    return results
+
+
+NODE_SETTINGS = [
+    ("statusinfo_interval", "int", "60"), ("statusinfo_listen_interval", "int", "5"),
+    ("temperature_averaging_num", "int", "4"), ("fft_adc_sampling_time", "text", "1CYCLE5"),
+    ("fft_adc_divider", "text", "ASYNC_DIV1"), ("fft_samples_num", "text", "N_64"), ("fft_peaks_num", "int", "5"),
+    ("fft_peaks_delta", "int", "3"), ("dsp_threshold_voltage", "float", "1.0"),
+    ("dsp_kurtosis_trimmed_samples", "int", "10"), ("dsp_rms_ac", "bool", "1"), ("dsp_rms_averaging_num", "int", "4"),
+    ("adc_resolution", "int", "4096"), ("temperature_calibration_const", "float", "0.01"),
+]
+
+
+def fake_nodered(sock, loss, seed=1, forwarded=None, delay=0.0, received=None):
+    """Answers node info, config and status info requests echoing corrid, first attempts are lost with probability loss
+
+    Arrival times of status info requests are appended to forwarded, every reply takes delay seconds (DB lookup).
+    Idloranode of batched status records is added to received set.
+    """
+    rnd = random.Random(seed)
+    answered = set()
+    while True:
+        try:
+            data, address = sock.recvfrom(65535)
+        except OSError:
+            return
+        request = json.loads(data.decode())
+        if request["corrid"] not in answered and rnd.random() < loss:
+            answered.add(request["corrid"])
+            continue
+        if request["cmd"] == 0x10:
+            uid = int(request["address"], 16)
+            reply = {"cmd": 0x01, "data": {"address": request["address"], "sessionid": "0x{:02X}".format(uid & 0xFF),
+                                           "idloranode": uid, "name": "node{}".format(uid), "fwver": 1}}
+        elif request["cmd"] == 0x20:
+            reply = {"cmd": 0x02, "data": [dict(code="loranode.settings." + code, datatype=datatype, value=value)
+                                           for code, datatype, value in NODE_SETTINGS]}
+        elif request["cmd"] == 0x31:
+            if forwarded is not None:
+                forwarded.extend([time.monotonic()] * len(request["records"]))
+            if received is not None:
+                received.update(record["idloranode"] for record in request["records"])
+            reply = {"cmd": 0x06, "data": {"records": len(request["records"])}}
+        else:
+            if forwarded is not None:
+                forwarded.append(time.monotonic())
+            reply = {"cmd": 0x03, "data": {"idloranode": request["idloranode"]}}
+        reply["corrid"] = request["corrid"]
+        time.sleep(delay)
+        try:
+            sock.sendto(json.dumps(reply).encode("ascii"), address)
+        except OSError:
+            return
+
+
+def bench_nodered_endpoint(nodes=200, loss=0.1, timeout=0.2):
+    """Nodes join at once, Node-RED requests share one UDP socket, lost requests are re-sent after timeout"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    threading.Thread(target=fake_nodered, args=(server, loss), daemon=True).start()
+
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    pool = worker_pool.WorkerPool()
+    endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0), server=server.getsockname(), timeout=timeout)
+    tx_queue = pf.TxQueue()
+    workers = [lnw.NodeWorker(tx_queue, {}, pool, endpoint) for _ in range(nodes)]
+    start = time.perf_counter()
+    for i, node in enumerate(workers):
+        node.put(radio_packet.decode(join_request_frame(i + 1)))
+        node.start()
+    wait_for(lambda: all(node.state == lnw.States.JOINED for node in workers))
+    elapsed = time.perf_counter() - start
+
+    misrouted = sum(node.params.address != "0x{:08X}".format(i + 1) for i, node in enumerate(workers))
+    joined = sum(node.state == lnw.States.JOINED for node in workers)
+    for node in workers:
+        node.stop()
+    endpoint.close()
+    pool.stop()
+    server.close()
+    logging.getLogger().setLevel(level)
+    return dict(nodes=nodes, joined=joined, misrouted=misrouted, seconds=elapsed,
+                sockets=1, **endpoint.report())
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+def bench_nodered_cache(nodes=50, delay=0.02):
+    """Nodes join through Node-RED answering in delay seconds - cold cache, cached replies, prefetched cache"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    threading.Thread(target=fake_nodered, args=(server, 0.0, 1, None, delay), daemon=True).start()
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    pool = worker_pool.WorkerPool()
+    endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0), server=server.getsockname())
+    tx_queue = pf.TxQueue(capacity=2 * nodes)
+    addresses = ["0x{:08X}".format(i + 1) for i in range(nodes)]
+
+    results = {}
+    for run in ("miss", "cached", "prefetched"):
+        if run == "prefetched":
+            endpoint.cache = nodered_cache.NodeRedCache()
+            endpoint.prefetch(addresses)
+            wait_for(lambda: len(endpoint.cache) == nodes, timeout=nodes * delay * 2)
+        sent = endpoint.stats['sent']
+        workers = [lnw.NodeWorker(tx_queue, {}, pool, endpoint) for _ in range(nodes)]
+        start = time.perf_counter()
+        for i, node in enumerate(workers):
+            node.put(radio_packet.decode(join_request_frame(i + 1)))
+            node.start()
+        wait_for(lambda: all(node.state == lnw.States.JOINED for node in workers), timeout=nodes * delay * 2)
+        results[run] = dict(seconds=time.perf_counter() - start, nodered_requests=endpoint.stats['sent'] - sent,
+                            joined=sum(node.state == lnw.States.JOINED for node in workers), **endpoint.cache.report())
+        for node in workers:
+            node.stop()
+    endpoint.close()
+    pool.stop()
+    server.close()
+    logging.getLogger().setLevel(level)
+    return results
+
+
+def bench_uplink_batching(posts=1000, interval=0.001):
+    """Status info posts of many nodes at posts/s rate, datagrams to Node-RED without and with batching"""
+    results = {}
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    for batch in (False, True):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        forwarded = []
+        threading.Thread(target=fake_nodered, args=(server, 0.0, 1, forwarded), daemon=True).start()
+        pool = worker_pool.WorkerPool()
+        endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0), server=server.getsockname(), batch=batch)
+        cpu = time.process_time()
+        for i in range(posts):
+            endpoint.send(None, lnw.jp.StatusinfoPostRequest(i))
+            time.sleep(interval)
+        wait_for(lambda: len(forwarded) >= posts)
+        results["batched" if batch else "per post"] = dict(
+            posts=len(forwarded), datagrams=endpoint.stats['sent'], acks=endpoint.stats['replies'],
+            cpu_ms=(time.process_time() - cpu) * 1e3,
+            **(endpoint.batcher.report() if batch else {}))
+        endpoint.close()
+        pool.stop()
+        server.close()
+    logging.getLogger().setLevel(level)
+    return results
+
+
+def bench_store_and_forward(posts=900, interval=0.002, outage=1.0):
+    """Status info posts while Node-RED is restarted (down for outage seconds in middle third of posts)"""
+    results = {}
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+    for spooled in (False, True):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        address = server.getsockname()
+        forwarded, received = [], set()
+        threading.Thread(target=fake_nodered, args=(server, 0.0, 1, forwarded, 0.0, received), daemon=True).start()
+        directory = tempfile.mkdtemp()
+        spool = uplink_spool.UplinkSpool(directory) if spooled else None
+        pool = worker_pool.WorkerPool()
+        endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0), server=address, timeout=0.1, retries=1,
+                                                batch=True, spool=spool)
+        for i in range(posts):
+            if i == posts // 3:
+                server.close()
+                down = time.monotonic()
+            if i == 2 * posts // 3:
+                time.sleep(max(0.0, outage - (time.monotonic() - down)))
+                server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                server.bind(address)
+                threading.Thread(target=fake_nodered, args=(server, 0.0, 1, forwarded, 0.0, received),
+                                 daemon=True).start()
+                up = time.monotonic()
+            endpoint.send(None, lnw.jp.StatusinfoPostRequest(i))
+            time.sleep(interval)
+        wait_for(lambda: len(received) >= posts, timeout=10.0)
+        results["spool" if spooled else "no spool"] = dict(
+            posts=posts, delivered=len(received), lost=posts - len(received), duplicates=len(forwarded) - len(received),
+            recovered_s=(forwarded[-1] - up) if forwarded else None,
+            **{k: v for k, v in endpoint.batcher.report().items() if k in ("acked", "failed", "spooled", "replayed", "spool")})
+        endpoint.close()
+        pool.stop()
+        server.close()
+        if spool is not None:
+            spool.close()
+        shutil.rmtree(directory)
+    logging.getLogger().setLevel(level)
+    return results
+
+
+class SlowNodeRedHandler(BaseHTTPRequestHandler):
+    """Keep-alive HTTP handler answering after server.delay seconds, counts TCP connections"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_http_client(posts=200, delay=0.01):
+    """Posts of status records, caller blocked time, total time and TCP connections"""
+    results = {}
+    for name in ("requests.post", "pooled"):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), SlowNodeRedHandler)
+        server.delay = delay
+        server.connections = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/lora_nodered/statusinfo".format(server.server_address[1])
+        record = {"idloranode": 1, "temperature": 25.0}
+
+        client = http_client.HttpClient(max_queued=posts)
+        blocked = 0.0
+        start = time.perf_counter()
+        futures = []
+        for _ in range(posts):
+            call = time.perf_counter()
+            if name == "pooled":
+                futures.append(client.post(url, json=record))
+            else:
+                requests.post(url=url, data=record)
+            blocked += time.perf_counter() - call
+        for future in futures:
+            future.result()
+        results[name] = dict(posts=posts, seconds=time.perf_counter() - start, caller_blocked_us=blocked / posts * 1e6,
+                             connections=server.connections, **client.report())
+        client.close()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def bench_warm_restart(type):
+    """Gateway is restarted twice with the same session journal, node sends StatusInfo right after restart
+
+    Cold - no stored session, node rejoins (JoinRequest, node info and config round trips, two SF12 downlinks).
+    Warm - session restored from journal, StatusInfo is forwarded at once.
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    forwarded = []
+    threading.Thread(target=fake_nodered, args=(server, 0.0, 1, forwarded), daemon=True).start()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "sessions.journal")
+    pf.Gateway.endpoint = udp_endpoint.NodeRedEndpoint(worker_pool.shared_pool(), bind=("127.0.0.1", 0),
+                                                       server=server.getsockname())
+    level = logging.getLogger().level
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    results = {}
+    for run in ("cold", "warm"):
+        #restarted gateway process has empty tables
+        pf.Gateway.nodes = {}
+        pf.Gateway.nat = {}
+        del forwarded[:]
+        transport = sx127x_sim.SimulatedSX127X(type)
+        start = time.monotonic()
+        pf.setup(type, rb.RPI_BOARD(transport), sessions=path)
+        transport.tx_airtime = pf.Gateway.default_profile.time_on_air(len(radio_packet.JoinReply()))
+        loop_thread = threading.Thread(target=pf.loop, daemon=True)
+        loop_thread.start()
+        wait_for(lambda: pf.Gateway.radios[0].state == pf.States.RX_RUNNING)
+        restored = len(pf.Gateway.nodes)
+
+        if not restored:
+            #node sends next uplink when gateway downlink is done and radio listens again
+            for downlinks, frame in enumerate((join_request_frame(1),
+                                               struct.pack("<BB", radio_packet.ConfigRequest.CMD, 0x01)), 1):
+                transport.inject_frame(frame)
+                wait_for(lambda: len(transport.transmitted) >= downlinks, timeout=10)
+                wait_for(lambda: pf.Gateway.radios[0].state == pf.States.RX_RUNNING)
+        transport.inject_frame(statusinfo_frame(0x01))
+        wait_for(lambda: forwarded, timeout=10)
+        results[run] = dict(restored=restored, downlinks=len(transport.transmitted),
+                            seconds=forwarded[0] - start if forwarded else None)
+
+        pf.stop()
+        loop_thread.join()
+        for node in pf.Gateway.nodes.values():
+            node.stop()
+        pf.Gateway.sessions.close()
+        transport.cleanup()
+
+    results["journal_bytes"] = os.path.getsize(path)
+    pf.Gateway.endpoint.close()
+    pf.Gateway.endpoint = None
+    pf.Gateway.nodes = {}
+    pf.Gateway.nat = {}
+    server.close()
+    shutil.rmtree(directory)
+    logging.getLogger().setLevel(level)
+    return results
+
+
+def bench_gateway_rx(type, frames=200, interval=0.01, airtime=0.0):
+    """Inject StatusInfo frames of one joined node into simulated gateway, count delivered to node worker"""
+    transport = sx127x_sim.SimulatedSX127X(type)
+    pf.setup(type, rb.RPI_BOARD(transport))
+    node = lnw.NodeWorker(pf.Gateway.tx_queue, pf.Gateway.nat)
+    pf.Gateway.nat[0x01] = "0x00000001"
+    pf.Gateway.nodes["0x00000001"] = node
+
+    loop_thread = threading.Thread(target=pf.loop, daemon=True)
+    loop_thread.start()
+    wait_for(lambda: pf.Gateway.radios[0].state == pf.States.RX_RUNNING)
+
+    start = time.perf_counter()
+    for i in range(frames):
+        transport.inject_frame(statusinfo_frame(0x01, temperature=i), airtime=airtime)
+        time.sleep(interval)
+    wait_for(lambda: len(node.inbox) + transport.lost_frames >= frames)
+    elapsed = time.perf_counter() - start
+
+    pf.stop()
+    loop_thread.join()
+    transport.cleanup()
+    return dict(
+        injected=frames,
+        delivered=len(node.inbox),
+        lost=transport.lost_frames,
+        seconds=elapsed,
+        irq_latency=str(pf.Gateway.irq_latency),
+    )
+
+
+def bench_multi_radio(type, radios=2, downlinks=5, uplinks=50, tx_airtime=0.2, interval=0.04):
+    """Downlinks with tx_airtime keep one radio busy, uplinks are injected meanwhile
+
+    All radios listen on the same channel and SF, every uplink reaches all of them (duplicates are dropped
+    by gateway). Uplinks not delivered arrived while the (only) radio was transmitting.
+    """
+    transports = []
+    radio_list = []
+    for i in range(radios):
+        pins = rb.RadioPins(NSS=25 - i, DIO0=4 + 10 * i, DIO1=27 - i, DIO3=22 - i, RST=17 - i)
+        transports.append(sx127x_sim.SimulatedSX127X(type, tx_airtime=tx_airtime, pins=pins))
+        radio_list.append(dict(name="radio{}".format(i), board=rb.RPI_BOARD(transports[-1], pins)))
+    pf.setup(type, radios=radio_list)
+    node = lnw.NodeWorker(pf.Gateway.tx_queue, pf.Gateway.nat)
+    pf.Gateway.nat[0x01] = "0x00000001"
+    pf.Gateway.nodes["0x00000001"] = node
+
+    loop_thread = threading.Thread(target=pf.loop, daemon=True)
+    loop_thread.start()
+    wait_for(lambda: all(r.state == pf.States.RX_RUNNING for r in pf.Gateway.radios))
+
+    for _ in range(downlinks):
+        packet = radio_packet.Restart()
+        packet.sessionid = 0x01
+        pf.Gateway.tx_queue.put(packet)
+    for i in range(uplinks):
+        for t in transports:
+            t.inject_frame(statusinfo_frame(0x01, temperature=i))
+        time.sleep(interval)
+    wait_for(lambda: sum(len(t.transmitted) for t in transports) >= downlinks, timeout=downlinks * tx_airtime * 4)
+    wait_for(lambda: sum(t.received_frames + t.lost_frames for t in transports) >= uplinks * radios)
+
+    pf.stop()
+    loop_thread.join()
+    for t in transports:
+        t.cleanup()
+    return dict(
+        radios=radios,
+        downlinks_sent=sum(len(t.transmitted) for t in transports),
+        uplinks_delivered=len(node.inbox),
+        uplinks_lost=uplinks - len(node.inbox),
+        duplicates=pf.Gateway.duplicates,
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("SX1272", "SX1276"):
+        print("Usage: benchmark.py SX1272|SX1276 [sim]")
+        sys.exit(1)
+    type = sys.argv[1]
+    simulated = len(sys.argv) > 2 and sys.argv[2] == "sim"
+
+    if simulated:
+        transport = sx127x_sim.SimulatedSX127X(type)
+        module = lm.SX127X_Module(rb.RPI_BOARD(transport), type)
+        module.SX127X_module_setup(pf.config)
+        module.set_rx_continuous(lambda irq_flags: None)
+        transport.inject_frame(statusinfo_frame(0x01))
+        wait_for(lambda: transport.received_frames == 1)
+    else:
+        module = lm.SX127X_Module(rb.RPI_BOARD(), type)
+
+    for name, r in bench_rx_transactions(module).items():
+        print("{:8s} {:5.1f} SPI transactions/frame {:8.1f} us/frame".format(
+            name, r['transactions_per_frame'], r['us_per_frame']))
+
+    for name, r in bench_decode().items():
+        print("{:8s} decode {:8.2f} us/frame".format(name, r['us_per_frame']))
+    for name, r in bench_statusinfo_fields().items():
+        print("{:8s} StatusInfo fields {:8.2f} us/frame".format(name, r['us_per_frame']))
+
+    for name, r in bench_fft_decode().items():
+        print("{:8s} FFT bins {:8.2f} us/frame, peaks {:8.2f} us/frame".format(
+            name, r['bins_us_per_frame'], r['peaks_us_per_frame']))
+
+    for name, r in bench_batch_decode().items():
+        print("{:8s} batch decode {:8.3f} us/frame".format(name, r['us_per_frame']))
+
+    print("FFT reassembly: {}".format(bench_fft_reassembly()))
+    for r in bench_worker_pool():
+        print("worker pool: {}".format(r))
+    print("Node-RED endpoint: {}".format(bench_nodered_endpoint()))
+    for r in bench_timers():
+        print("node timers: {}".format(r))
+    for name, r in bench_bounded_queues().items():
+        print("queue {:12s} {}".format(name, r))
+    for name, r in bench_nodered_cache().items():
+        print("join with Node-RED cache {:10s} {}".format(name, r))
+    for name, r in bench_uplink_batching().items():
+        print("status info posts {:8s} {}".format(name, r))
+    for name, r in bench_http_client().items():
+        print("HTTP {:13s} {}".format(name, r))
+    for name, r in bench_store_and_forward().items():
+        print("Node-RED restart {:8s} {}".format(name, r))
+
+    if simulated:
+        transport.cleanup()
+        print("gateway rx: {}".format(bench_gateway_rx(type)))
+        for radios in (1, 2):
+            print("uplinks during downlinks: {}".format(bench_multi_radio(type, radios)))
+        print("restart to first forwarded uplink: {}".format(bench_warm_restart(type)))
@@ -0,0 +1,179 @@
+"""
+\file       bounded_queue.py
+\author     Ladislav Stefka
+\brief      Bounded FIFO queue with overflow policy and depth metrics
+            - queue.Queue like interface (put, get, get_nowait, empty, qsize), get raises queue.Empty
+            - take(accept) removes first item accepted by caller (highest priority first with priority policy)
+            - policies when full: drop oldest, drop newest, block up to timeout (then drop newest),
+              priority shedding (oldest item of lowest priority is dropped, or new item if its priority is lowest)
+            - counters: high-water mark, enqueued, dequeued, drops, enqueue -> dequeue latency
+\copyright
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, deque
+from queue import Empty
+
+import tools
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+PRIORITY = "priority"
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK, PRIORITY)
+
+#drops are logged once per DROP_LOG_INTERVAL drops
+DROP_LOG_INTERVAL = 100
+
+
+class BoundedQueue:
+    """Thread safe FIFO of at most capacity items
+
+    :param policy: one of POLICIES
+    :param timeout: BLOCK policy - seconds put waits for free space
+    :param priority: PRIORITY policy - callable(item) -> int, items with lower value are dropped first
+    """
+
+    def __init__(self, capacity, policy=DROP_NEWEST, timeout=1.0, priority=None, name="queue"):
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy {}".format(policy))
+        if policy == PRIORITY and priority is None:
+            raise ValueError("Priority policy needs priority function")
+        self.capacity = capacity
+        self.policy = policy
+        self.timeout = timeout
+        self.priority = priority
+        self.name = name
+
+        self.items = deque()    #(enqueue time, priority, item)
+        self.priorities = Counter()     #priority -> items in queue, PRIORITY policy
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+
+        self.high_water = 0
+        self.enqueued = 0
+        self.dequeued = 0
+        self.dropped = 0
+        self.latency = tools.LatencyStat()
+
+    def _drop(self, item):
+        self.dropped += 1
+        if self.dropped % DROP_LOG_INTERVAL == 1:
+            logging.warning("%s full (%d items), %s dropped, %d drops so far",
+                            self.name, self.capacity, type(item).__name__, self.dropped)
+
+    def _make_room(self, item, block, timeout):
+        """Called with lock held and queue full, returns False if item is not to be enqueued"""
+        if self.policy == DROP_OLDEST:
+            self._drop(self.items.popleft()[2])
+            return True
+        if self.policy == BLOCK and block:
+            deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+            while len(self.items) >= self.capacity:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.not_full.wait(remaining)
+            if len(self.items) < self.capacity:
+                return True
+        if self.policy == PRIORITY:
+            lowest = min(self.priorities)
+            if lowest < self.priority(item):
+                for index, entry in enumerate(self.items):
+                    if entry[1] == lowest:
+                        break
+                self._drop(entry[2])
+                del self.items[index]
+                self._forget(lowest)
+                return True
+        self._drop(item)
+        return False
+
+    def _forget(self, priority):
+        self.priorities[priority] -= 1
+        if not self.priorities[priority]:
+            del self.priorities[priority]
+
+    def put(self, item, block=True, timeout=None):
+        """Enqueues item, returns False if item was dropped"""
+        with self.lock:
+            if len(self.items) >= self.capacity and not self._make_room(item, block, timeout):
+                return False
+            priority = None
+            if self.policy == PRIORITY:
+                priority = self.priority(item)
+                self.priorities[priority] += 1
+            self.items.append((time.monotonic(), priority, item))
+            self.enqueued += 1
+            if len(self.items) > self.high_water:
+                self.high_water = len(self.items)
+            self.not_empty.notify()
+            return True
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        with self.lock:
+            if block:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while not self.items:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+            elif not self.items:
+                raise Empty
+            enqueued, priority, item = self.items.popleft()
+            if priority is not None:
+                self._forget(priority)
+            self.dequeued += 1
+            self.latency.record(time.monotonic() - enqueued)
+            self.not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def take(self, accept):
+        """Removes and returns first item for which accept(item) is True (PRIORITY policy - highest priority first),
+        None if no item is accepted, accept is called with lock held"""
+        with self.lock:
+            order = range(len(self.items))
+            if self.policy == PRIORITY:
+                order = sorted(order, key=lambda index: -self.items[index][1])
+            for index in order:
+                enqueued, priority, item = self.items[index]
+                if accept(item):
+                    del self.items[index]
+                    if priority is not None:
+                        self._forget(priority)
+                    self.dequeued += 1
+                    self.latency.record(time.monotonic() - enqueued)
+                    self.not_full.notify()
+                    return item
+        return None
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.priorities.clear()
+            self.not_full.notify_all()
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return not self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def report(self):
+        return dict(name=self.name, depth=len(self.items), capacity=self.capacity, policy=self.policy,
+                    high_water=self.high_water, enqueued=self.enqueued, dequeued=self.dequeued,
+                    dropped=self.dropped, latency=str(self.latency))
@@ -5,7 +5,7 @@
 \copyright
 """
 
-import requests
+import http_client
 import logging
 from collections import OrderedDict
 
@@ -112,6 +112,7 @@ class Config:
         self.fft_adc_sampling_time = None
         self.fft_adc_divider = None
         self.adc_resolution = None
+        self.fft_chunk_select = False   #node firmware handles FFTChunkSelectRequest (re-request of missing chunks only)
 
         #temperature_settings
         self.temperature_averaging_num = None
@@ -146,10 +147,19 @@ class Config:
 
     @staticmethod
     def HTTP_get_config_fromDB(config, idloranode):
+        """Fills config of node from DB (blocking), errors of request are raised"""
+        return Config.HTTP_fetch_config_async(config, idloranode).result()
+
+    @staticmethod
+    def HTTP_fetch_config_async(config, idloranode):
+        """Requests config of node from DB, returns future of config (filled when reply arrives)"""
 
         params = {'idloranode': idloranode}
-        req = requests.get(url=URL_CONFIG, params=params)
-        out = req.json()
+        future = http_client.shared_client().get(URL_CONFIG, params=params)
+        return http_client.then(future, lambda req: Config._fill_from_db(config, idloranode, req.json()))
+
+    @staticmethod
+    def _fill_from_db(config, idloranode, out):
 
         if not len(out):
             raise Exception("No DB config for loranode with id {}".format(idloranode))
@@ -162,6 +172,7 @@ class Config:
             config.__dict__[key] = value
 
         config.config_fetched = True
+        return config
 
     @staticmethod
     def store_config_to_radio_packet(config, cr):
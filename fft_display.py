@@ -1,7 +1,18 @@
+import sys
 import numpy as np
 import matplotlib.pyplot as plot
 from scipy import signal
 
+import spectrum_store
+
+#fft_display.py spectra/<address>_<nbins>.fft - latest spectrum received from node
+if len(sys.argv) > 1:
+    records = spectrum_store.memmap(sys.argv[1])
+    plot.plot(records["bins"][-1])
+    plot.title("{} records, latest at {}".format(len(records), records["timestamp"][-1]))
+    plot.show()
+    sys.exit(0)
+
 Fs = 46242
 #adc 1 us
 f= 10000
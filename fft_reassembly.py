@@ -0,0 +1,100 @@
+"""
+\file       fft_reassembly.py
+\author     Ladislav Stefka
+\brief      Reassembly of FFT spectrum received in FFTChunkData radio packets
+            - preallocated float32 buffer of N/2 bins (N from node config), 32 bins per chunk
+            - bitmap of received chunks, out of order chunks, duplicate suppression
+            - timeout since last chunk, then only missing chunks are requested again
+\copyright
+"""
+
+import logging
+import math
+import time
+from array import array
+
+import radio_packet as rp
+import tools
+
+#no chunk for FFT_CHUNK_TIMEOUT seconds -> missing chunks are requested again
+FFT_CHUNK_TIMEOUT = 10.0
+FFT_MAX_RETRIES = 3
+
+
+class FFTReassembler:
+    """FFT spectrum of one node assembled from chunks
+
+    Completion latency and retries of all spectra are in class attributes latency, retries, failed.
+    """
+
+    latency = tools.LatencyStat()
+    retries = 0
+    failed = 0
+
+    def __init__(self, n_samples, timeout=FFT_CHUNK_TIMEOUT, max_retries=FFT_MAX_RETRIES):
+        self.nbins = n_samples // 2
+        self.nchunks = math.ceil(self.nbins / rp.FFTChunkData.FFT_BINS)
+        #whole chunks are copied, buffer is rounded up to chunk size
+        size = self.nchunks * rp.FFTChunkData.FFT_BINS
+        self.buffer = tools.np.zeros(size, dtype=tools.np.float32) if tools.np is not None else array("f", bytes(4 * size))
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        self.received = 0           #bitmap of received chunks
+        self.complete_mask = (1 << self.nchunks) - 1
+        self.duplicates = 0
+        self.attempts = 0
+        self.started = None
+        self.deadline = None
+
+    def start(self, now=None):
+        self.started = time.monotonic() if now is None else now
+        self.deadline = self.started + self.timeout
+
+    @property
+    def complete(self):
+        return self.received == self.complete_mask
+
+    def missing(self):
+        return [seqnum for seqnum in range(self.nchunks) if not self.received >> seqnum & 1]
+
+    def add(self, chunk, now=None):
+        """Stores bins of chunk, returns True when spectrum is complete"""
+        now = time.monotonic() if now is None else now
+        seqnum = chunk.seqnum
+        if seqnum >= self.nchunks:
+            logging.warning("FFT chunk %d out of range, %d chunks expected", seqnum, self.nchunks)
+            return self.complete
+        if self.received >> seqnum & 1:
+            self.duplicates += 1
+            return self.complete
+
+        bins = rp.FFTChunkData.FFT_BINS
+        self.buffer[seqnum * bins: (seqnum + 1) * bins] = chunk.get_FFT_bins()
+        self.received |= 1 << seqnum
+        self.deadline = now + self.timeout
+        if self.complete:
+            FFTReassembler.latency.record(now - self.started)
+            logging.info("FFT spectrum of %d bins complete in %.1f s, %d re-requests, %d duplicate chunks",
+                         self.nbins, now - self.started, self.attempts, self.duplicates)
+        return self.complete
+
+    def expired(self, now=None):
+        return not self.complete and self.deadline is not None and (time.monotonic() if now is None else now) > self.deadline
+
+    def on_timeout(self, now=None):
+        """Chunks to request again, None if retries are exhausted (spectrum failed)"""
+        now = time.monotonic() if now is None else now
+        if self.attempts >= self.max_retries:
+            FFTReassembler.failed += 1
+            logging.error("FFT spectrum failed, chunks %s missing after %d re-requests", self.missing(), self.attempts)
+            self.deadline = None
+            return None
+        self.attempts += 1
+        FFTReassembler.retries += 1
+        self.deadline = now + self.timeout
+        return self.missing()
+
+    def spectrum(self):
+        """N/2 float32 bins"""
+        return self.buffer[:self.nbins]
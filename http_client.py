@@ -0,0 +1,117 @@
+"""
+\file       http_client.py
+\author     Ladislav Stefka
+\brief      Shared HTTP client for Node-RED calls
+            - one requests.Session, keep-alive connections pooled (HTTPAdapter)
+            - requests run on bounded executor (max_in_flight), callers get concurrent.futures.Future at once
+            - per request timeout (connect, read), requests over max_queued are rejected (future with HttpBusy)
+\copyright
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import tools
+
+HTTP_MAX_IN_FLIGHT = 4
+HTTP_MAX_QUEUED = 64
+HTTP_TIMEOUT = (2.0, 5.0)   #connect, read seconds
+
+
+class HttpBusy(Exception):
+    """Request rejected, too many requests are queued"""
+
+
+def then(future, func):
+    """Future of func(result of future), exception of future or func is propagated"""
+    chained = Future()
+
+    def done(f):
+        try:
+            chained.set_result(func(f.result()))
+        except Exception as e:
+            chained.set_exception(e)
+    future.add_done_callback(done)
+    return chained
+
+
+class HttpClient:
+
+    def __init__(self, max_in_flight=HTTP_MAX_IN_FLIGHT, max_queued=HTTP_MAX_QUEUED, timeout=HTTP_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="HTTP_CLIENT")
+        self.slots = threading.BoundedSemaphore(max_in_flight + max_queued)
+
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.latency = tools.LatencyStat()
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """Future of requests.Response, HTTP error statuses raise requests.HTTPError"""
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            future = Future()
+            future.set_exception(HttpBusy("{} {} rejected, {} requests pending".format(method, url, self.outstanding)))
+            return future
+        with self.lock:
+            self.outstanding += 1
+        return self.executor.submit(self._request, method, url, self.timeout if timeout is None else timeout, kwargs)
+
+    def _request(self, method, url, timeout, kwargs):
+        start = time.monotonic()
+        try:
+            req = self.session.request(method, url, timeout=timeout, **kwargs)
+            req.raise_for_status()
+        except Exception as e:
+            with self.lock:
+                self.failures += 1
+            logging.warning("HTTP %s %s failed: %s", method, url, e)
+            raise
+        finally:
+            with self.lock:
+                self.outstanding -= 1
+            self.slots.release()
+        with self.lock:
+            self.requests += 1
+            self.latency.record(time.monotonic() - start)
+        return req
+
+    def get(self, url, params=None, timeout=None):
+        return self.request("GET", url, timeout, params=params)
+
+    def post(self, url, data=None, json=None, timeout=None):
+        return self.request("POST", url, timeout, data=data, json=json)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def report(self):
+        return dict(outstanding=self.outstanding, requests=self.requests, failures=self.failures, rejected=self.rejected,
+                    latency=str(self.latency))
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+    """Client used for all Node-RED HTTP calls of gateway"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
@@ -16,6 +16,9 @@ import config as cfg
 class JsonPacket:
     """General JSON packet class"""
 
+    #name of Node-RED reply class to request, None if no reply is expected (see udp_endpoint.py)
+    REPLY = None
+
     def __init__(self, data=None):
         #received packet
         if data:
@@ -24,7 +27,7 @@ class JsonPacket:
             for x in JsonPacket.__subclasses__():
                 if x.CMD == self.cmd:
                     self.__class__ = x
-                    self.fill(data["data"])
+                    self.fill(data.get("data", {}))
                     return
             msg = "JSON packet cmd " + str(data["cmd"]) + " not found."
             logging.error(msg)
@@ -50,6 +53,7 @@ class JsonPacket:
 
 class NodeinfoRequest (JsonPacket):
     CMD = 0x10
+    REPLY = "NodeInfoReply"
 
     def __init__(self, address):
         super().__init__()
@@ -64,6 +68,7 @@ class NodeInfoReply (JsonPacket):
 
 class ConfigRequest (JsonPacket):
     CMD = 0x20
+    REPLY = "NodeConfigReply"
 
     def __init__(self, idloranode):
         self.topic = "getConfig"
@@ -82,6 +87,7 @@ class NodeConfigReply(JsonPacket):
 
 class StatusinfoPostRequest(JsonPacket):
     CMD = 0x30
+    REPLY = "StatusinfoACK"
 
     def __init__(self, idloranode):
         self.idloranode = idloranode
@@ -129,6 +135,29 @@ class StatusinfoACK(JsonPacket):
         super().__init__()
 
 
+class StatusinfoBatchPostRequest(JsonPacket):
+    """Status info records of several nodes (uplink_batcher.py), records as in StatusinfoPostRequest"""
+    CMD = 0x31
+    REPLY = "StatusinfoBatchACK"
+
+    def __init__(self, records):
+        self.topic = "postDataBatch"
+        self.records = records
+        super().__init__()
+
+
+class StatusinfoBatchACK(JsonPacket):
+    """ACK of batch (echoes corrid of batch), data is optional"""
+    CMD = 0x06
+
+    def __init__(self):
+        super().__init__()
+
+    def fill(self, data):
+        for key in data.keys():
+            self.__dict__[key] = data[key]
+
+
 class ResetNodeHard(JsonPacket):
     CMD = 0x04
 
@@ -8,6 +8,9 @@
 #works only in LoRa mode
 
 from enum import Enum
+from collections import namedtuple
+import math
+import threading
 
 from rpi_board import *
 from tools import *
@@ -114,10 +117,53 @@ class LNA_GAIN (Enum): #LOW NOISE AMPLIFIER
     G5 = 0b101
     G6 = 0b110
 
+#bandwidth register value -> Hz
+SX1276_BW_HZ = {
+    SX1276_BW.BW7_8.value: 7800,
+    SX1276_BW.BW10_4.value: 10400,
+    SX1276_BW.BW15_6.value: 15600,
+    SX1276_BW.BW20_8.value: 20800,
+    SX1276_BW.BW31_25.value: 31250,
+    SX1276_BW.BW41_7.value: 41700,
+    SX1276_BW.BW62_5.value: 62500,
+    SX1276_BW.BW125.value: 125000,
+    SX1276_BW.BW250.value: 250000,
+    SX1276_BW.BW500.value: 500000,
+}
+SX1272_BW_HZ = {
+    SX1272_BW.BW125.value: 125000,
+    SX1272_BW.BW250.value: 250000,
+    SX1272_BW.BW500.value: 500000,
+}
+
 LNA_MAX_GAIN = 0x23 #max gain and boost on
 LNA_LOW_GAIN = 0x20 #max gain and boost off
 LNA_OFF_GAIN = 0x00
 
+#registers changed by the chip itself, never served from the shadow register file
+VOLATILE_REGISTERS = frozenset([
+    REG_LORA.FIFO,
+    REG_LORA.OP_MODE,               #TX/CAD end in STDBY automatically
+    REG_LORA.LNA,                   #current gain when AGC is on
+    REG_LORA.FIFO_ADDR_PTR,         #auto-increments on FIFO access
+    REG_LORA.FIFO_RX_CURR_ADDR,
+    REG_LORA.IRQ_FLAGS,
+    REG_LORA.RX_NB_BYTES,
+    REG_LORA.RX_HEADER_CNT_MSB, REG_LORA.RX_HEADER_CNT_MSB + 1,
+    REG_LORA.RX_PACKET_CNT_MSB, REG_LORA.RX_PACKET_CNT_MSB + 1,
+    REG_LORA.MODEM_STAT,
+    REG_LORA.PKT_SNR_VALUE,
+    REG_LORA.PKT_RSSI_VALUE,
+    REG_LORA.RSSI_VALUE,
+    REG_LORA.HOP_CHANNEL,
+    REG_LORA.FIFO_RX_BYTE_ADDR,
+    REG_LORA.FEI_MSB, REG_LORA.FEI_MSB + 1, REG_LORA.FEI_MSB + 2,
+])
+
+#range covered by resync/verify of the shadow register file
+SHADOW_FIRST_REG = REG_LORA.OP_MODE
+SHADOW_LAST_REG = REG_LORA.PLL
+
 
 
 
@@ -131,7 +177,7 @@ def getter(register_address):
     """
     def decorator(func):
         def wrapper(self):
-            return func(self, self.rpi_board.SPI_read_register(register_address)[1])
+            return func(self, self.read_register(register_address))
         return wrapper
     return decorator
 
@@ -145,21 +191,257 @@ def setter(register_address):
     """
     def decorator(func):
         def wrapper(self, val):
-            return self.rpi_board.SPI_write_register(register_address, func(self, val))
+            return self.write_register(register_address, func(self, val))
         return wrapper
     return decorator
 
+def burst_getter(first_register_address, last_register_address):
+    """ The burst getter decorator reads a range of consecutive registers in one SPI transaction
+        and calls the decorated function to do post-processing.
+    :param first_register_address: First register address of the range
+    :param last_register_address: Last register address of the range (inclusive)
+    :return: Post-processed register values
+    """
+    def decorator(func):
+        def wrapper(self):
+            return func(self, *self.read_registers(first_register_address, last_register_address))
+        return wrapper
+    return decorator
+
+
+def snr_from_register(val):
+    """PKT_SNR_VALUE is two's complement, 1/4 dB step"""
+    return (val - 256) / 4. if val & 0x80 else val / 4.
+
+
+def irq_flags_from_register(v):
+    return dict(
+        rx_timeout=v >> 7 & 0x01,
+        rx_done=v >> 6 & 0x01,
+        crc_error=v >> 5 & 0x01,
+        valid_header=v >> 4 & 0x01,
+        tx_done=v >> 3 & 0x01,
+        cad_done=v >> 2 & 0x01,
+        fhss_change_ch=v >> 1 & 0x01,
+        cad_detected=v >> 0 & 0x01,
+    )
+
+
+def irq_register_from_flags(flags):
+    """IRQ_FLAGS register value of irq_flags_from_register dict"""
+    return sum(1 << bit for bit, name in enumerate(('cad_detected', 'fhss_change_ch', 'cad_done', 'tx_done',
+                                                    'valid_header', 'crc_error', 'rx_done', 'rx_timeout'))
+               if flags.get(name))
+
+
+#events routed by IRQ dispatcher, in dispatch order
+IRQ_EVENTS = ('valid_header', 'crc_error', 'rx_done', 'rx_timeout', 'tx_done', 'cad_done', 'fhss_change_ch')
+
+
+class RxRecord(namedtuple("RxRecord", "irq payload snr packet_rssi rssi")):
+    """Result of SX127X_harvest_rx - raw IRQ_FLAGS, payload (None on CRC error) and link metrics"""
+    __slots__ = ()
+
+    @property
+    def crc_error(self):
+        return bool(self.irq >> 5 & 0x01)
+
+    @property
+    def irq_flags(self):
+        return irq_flags_from_register(self.irq)
+
+
+def time_on_air(payload_len, spreading_factor, bandwidth_hz, coding_rate,
+                implicit_header_mode=0, rx_crc=1, lr_optimize=0, preamble_len=8):
+    """LoRa frame time on air in seconds (Semtech SX1272/76 datasheet, chapter 4.1.1.7)
+    :param coding_rate: CODING_RATE value, 1 (4/5) .. 4 (4/8)
+    """
+    t_sym = (1 << spreading_factor) / float(bandwidth_hz)
+    t_preamble = (preamble_len + 4.25) * t_sym
+    payload_symb = 8 + max(math.ceil((8 * payload_len - 4 * spreading_factor + 28 + 16 * rx_crc - 20 * implicit_header_mode) /
+                                     (4.0 * (spreading_factor - 2 * lr_optimize))) * (coding_rate + 4), 0)
+    return t_preamble + payload_symb * t_sym
+
+
+def compile_register_image(config, modemType):
+    """Compile module configuration (see packet_forwarder.config) into register image {address: value}"""
+    freq = int(config["freq"] * 16384.)
+    symb_timeout = config["symbol_timeout"]
+    image = {
+        REG_LORA.FR_MSB: to_uint8t(freq >> 16),
+        REG_LORA.FR_MID: to_uint8t(freq >> 8),
+        REG_LORA.FR_LSB: to_uint8t(freq),
+        REG_LORA.PA_CONFIG: (config["pa_select"] & 0x01) << 7 |
+                            (config.get("pa_max_power", 0x04) & 0x07) << 4 |
+                            (config["pa_output_power"] & 0x0F),
+        REG_LORA.SYMB_TIMEOUT_LSB: to_uint8t(symb_timeout),
+        REG_LORA.PAYLOAD_LENGTH: config["payload_len"],
+        REG_LORA.MAX_PAYLOAD_LENGTH: config["max_payload_len"],
+        REG_LORA.HOP_PERIOD: config["hop_period"],
+        REG_LORA.SYNC_WORD: config["sync_word"],
+    }
+    if modemType == "SX1272":
+        image[REG_LORA.MODEM_CONFIG_1] = (config["bandwidth"] & 0x03) << 6 | \
+                                         (config["coding_rate"] & 0x07) << 3 | \
+                                         (config["implicit_header_mode"] & 0x01) << 2 | \
+                                         (config["rx_crc"] & 0x01) << 1 | \
+                                         (config["lr_optimize"] & 0x01)
+        image[REG_LORA.MODEM_CONFIG_2] = (config["spreading_factor"] & 0x0F) << 4 | \
+                                         (config["tx_cont_mode"] & 0x01) << 3 | \
+                                         (config["agc_auto_on"] & 0x01) << 2 | \
+                                         (symb_timeout >> 8 & 0x03)
+    else:
+        image[REG_LORA.MODEM_CONFIG_1] = (config["bandwidth"] & 0x0F) << 4 | \
+                                         (config["coding_rate"] & 0x07) << 1 | \
+                                         (config["implicit_header_mode"] & 0x01)
+        image[REG_LORA.MODEM_CONFIG_2] = (config["spreading_factor"] & 0x0F) << 4 | \
+                                         (config["tx_cont_mode"] & 0x01) << 3 | \
+                                         (config["rx_crc"] & 0x01) << 2 | \
+                                         (symb_timeout >> 8 & 0x03)
+        image[REG_LORA.MODEM_CONFIG_3] = (config["lr_optimize"] & 0x01) << 3 | \
+                                         (config["agc_auto_on"] & 0x01) << 2
+    if not config["agc_auto_on"]:
+        image[REG_LORA.LNA] = LNA_MAX_GAIN
+    return image
+
+
+class RadioProfile:
+    """Named module configuration compiled once into register image"""
+
+    def __init__(self, name, config, modemType):
+        self.name = name
+        self.config = dict(config)
+        self.type = modemType
+        self.image = compile_register_image(self.config, modemType)
+
+    def time_on_air(self, payload_len):
+        c = self.config
+        bandwidth_hz = (SX1272_BW_HZ if self.type == "SX1272" else SX1276_BW_HZ)[c["bandwidth"]]
+        return time_on_air(payload_len, c["spreading_factor"], bandwidth_hz, c["coding_rate"],
+                           c["implicit_header_mode"], c["rx_crc"], c["lr_optimize"], c.get("preamble_len", 8))
+
+    def derive(self, name, **overrides):
+        """New profile with some settings changed, e.g. profile.derive("SF7", spreading_factor=7, lr_optimize=0)"""
+        config = dict(self.config)
+        config.update(overrides)
+        return RadioProfile(name, config, self.type)
+
+    def __str__(self):
+        return "Radio profile {} ({}): {}".format(self.name, self.type, self.config)
+
+
+def register_runs(addresses, known):
+    """Group sorted register addresses into consecutive runs for burst writes,
+        small gaps are bridged if values of registers in the gap are known"""
+    runs = []
+    for a in addresses:
+        if runs:
+            last = runs[-1][-1]
+            gap = range(last + 1, a)
+            if len(gap) <= 2 and all(g in known for g in gap):
+                runs[-1].extend(gap)
+                runs[-1].append(a)
+                continue
+        runs.append([a])
+    return runs
+
+
 class SX127X_Module:
 
-    def __init__(self, rpi_board, modemType="SX1272"):
+    def __init__(self, rpi_board, modemType="SX1272", shadow_registers=False):
         self.rpi_board = rpi_board
         self.mode = None
+        self.profile = None
+        #registers of profile image written outside of SX127X_apply_profile {address: value}, e.g. PAYLOAD_LENGTH by set_tx
+        self.profile_changes = {}
         self.received_packets = 0
         self.received_packets_ok = 0
 
         self.type = modemType
         self.RSSI_COOR = 0
 
+        #write-through shadow register file {address: value}, None if disabled
+        self.shadow = {} if shadow_registers else None
+
+        #IRQ dispatcher {event: handler(irq_flags)}, see IRQ_EVENTS
+        self.irq_handlers = {}
+        self.irq_lock = threading.Lock()
+        self.irq_unhandled = 0
+        self.irq_coalesced = 0
+
+
+    #region Register access
+    def read_register(self, reg_addr):
+        if self.shadow is None or reg_addr in VOLATILE_REGISTERS:
+            return self.rpi_board.SPI_read_register(reg_addr)[1]
+        val = self.shadow.get(reg_addr)
+        if val is None:
+            val = self.rpi_board.SPI_read_register(reg_addr)[1]
+            self.shadow[reg_addr] = val
+        return val
+
+    def write_register(self, reg_addr, value):
+        self.rpi_board.SPI_write_register(reg_addr, value)
+        if self.shadow is not None and reg_addr not in VOLATILE_REGISTERS:
+            self.shadow[reg_addr] = value
+        self._check_profile(reg_addr, [value])
+
+    def read_registers(self, first_reg_addr, last_reg_addr):
+        addrs = range(first_reg_addr, last_reg_addr + 1)
+        if self.shadow is not None and all(a in self.shadow for a in addrs):
+            return [self.shadow[a] for a in addrs]
+        values = self.rpi_board.SPI_read_registers(first_reg_addr, last_reg_addr)
+        self._update_shadow(first_reg_addr, values)
+        return values
+
+    def write_registers(self, first_reg_addr, values):
+        values = list(values)
+        self.rpi_board.SPI_write_registers(first_reg_addr, values)
+        self._update_shadow(first_reg_addr, values)
+        self._check_profile(first_reg_addr, values)
+
+    def _check_profile(self, first_reg_addr, values):
+        """Register written outside of SX127X_apply_profile, differences from current profile are tracked"""
+        if self.profile is None:
+            return
+        image = self.profile.image
+        for a, v in enumerate(values, first_reg_addr):
+            if a not in image:
+                continue
+            if image[a] != v:
+                self.profile_changes[a] = v
+            else:
+                self.profile_changes.pop(a, None)
+
+    def _update_shadow(self, first_reg_addr, values):
+        if self.shadow is None:
+            return
+        for a, v in enumerate(values, first_reg_addr):
+            if a not in VOLATILE_REGISTERS:
+                self.shadow[a] = v
+
+    def SX127X_resync_shadow(self):
+        """Reload the shadow register file from the chip in one burst read"""
+        if self.shadow is None:
+            return
+        self.shadow.clear()
+        self._update_shadow(SHADOW_FIRST_REG, self.rpi_board.SPI_read_registers(SHADOW_FIRST_REG, SHADOW_LAST_REG))
+
+    def SX127X_verify_shadow(self):
+        """Compare the shadow register file with the chip, returns {address: (shadow, chip)} of mismatches"""
+        if self.shadow is None:
+            return {}
+        chip = self.rpi_board.SPI_read_registers(SHADOW_FIRST_REG, SHADOW_LAST_REG)
+        mismatches = {}
+        for a, v in enumerate(chip, SHADOW_FIRST_REG):
+            if a in self.shadow and self.shadow[a] != v:
+                mismatches[a] = (self.shadow[a], v)
+        if mismatches:
+            logging.warning("Shadow registers differ from chip: %s",
+                            {"0x{:02X}".format(a): m for a, m in mismatches.items()})
+        return mismatches
+    #endregion
+
 
     def SX127X_is_alive(self):
 
@@ -181,54 +463,129 @@ class SX127X_Module:
             self.rpi_board.pin_reset(self.rpi_board.RST)
         elif self.type == "SX1276":
             self.rpi_board.pin_reset_inverse(self.rpi_board.RST)
+        if self.shadow is not None:
+            self.shadow.clear()
 
         #set sleepmode
         self.SX1272_set_mode(MODE.SLEEP)
 
+        #DIO edges are handled by one persistent dispatcher
+        self.rpi_board.add_irq_handlers(self._dispatch_irq, self._dispatch_irq, self._dispatch_irq)
 
-        #set frequency
-        self.SX127X_set_frequency(config["freq"])
-        freq_a = self.SX127X_get_frequency()
-        logging.debug("Frequency set up: %d MHz", freq_a)
+        self.RSSI_COOR = RSSI_COOR_SX1272 if self.type == "SX1272" else RSSI_COOR_SX1276
 
-        #set config
-        if self.type == "SX1272":
-            self.SX1272_set_modem_config1(config["bandwidth"], config["coding_rate"], config["implicit_header_mode"], config["rx_crc"], config["lr_optimize"])
-            self.SX1272_set_modem_config2(spreading_factor=config["spreading_factor"], tx_cont_mode=config["tx_cont_mode"], agc_auto_on=config['agc_auto_on'])
-            self.RSSI_COOR = RSSI_COOR_SX1272
-        elif self.type == "SX1276":
-            self.SX1276_set_modem_config1(bandwidth=config["bandwidth"], coding_rate=config["coding_rate"], implicit_header_mode=config["implicit_header_mode"])
-            self.SX1276_set_modem_config2(spreading_factor=config["spreading_factor"], tx_cont_mode=config["tx_cont_mode"], rx_crc=config["rx_crc"])
-            self.SX1276_set_modem_config3(lr_optimize=config["lr_optimize"], agc_auto=config['agc_auto_on'])
-            self.RSSI_COOR = RSSI_COOR_SX1276
+        #frequency, modem config, symbol timeout, payload lengths, sync word, power amplifier and lna gain
+        self.profile = None
+        self.profile_changes.clear()
+        self.SX127X_apply_profile(config if isinstance(config, RadioProfile) else RadioProfile("setup", config, self.type))
+        logging.debug("Frequency set up: %d MHz", self.SX127X_get_frequency())
 
-        #set timout
-        self.SX1272_set_symb_timeout(config["symbol_timeout"])
+        #set pointer addr
+        self.write_register(REG_LORA.FIFO_ADDR_PTR, self.read_register(REG_LORA.FIFO_RX_BASE_ADDR))
 
-        #set sync word
-        self.SX127X_set_syncword(config["sync_word"])
-        self.SX127X_set_max_payload_length(config["max_payload_len"])
-        self.SX127X_set_payload_length(config["payload_len"])
-        self.SX1272_set_hop_period(config["hop_period"])
+        print(self)
 
-        #set pointer addr
-        self.rpi_board.SPI_write_register(REG_LORA.FIFO_ADDR_PTR, self.rpi_board.SPI_read_register(REG_LORA.FIFO_RX_BASE_ADDR)[1])
+    def SX127X_apply_profile(self, profile):
+        """Switch to radio profile, only registers that differ from current profile are written (in bursts)
+            - returns number of SPI transactions used"""
+        if self.profile is profile and not self.profile_changes:
+            return 0
+        if self.mode not in (MODE.SLEEP, MODE.STDBY):
+            self.SX1272_set_mode(MODE.STDBY)
 
-        #set power amplifier and receive amplifier gain
-        self.SX127X_set_pa_config(config["pa_select"], config["pa_output_power"])
-        if not config['agc_auto_on']:
-            self.rpi_board.SPI_write_register(REG_LORA.LNA, LNA_MAX_GAIN)  #max lna gain
+        target = profile.image
+        if self.profile is not None:
+            current = dict(self.profile.image)
+            current.update(self.profile_changes)
+        else:
+            #unknown state (after reset) - one burst read of the whole image range
+            first, last = min(target), max(target)
+            current = dict(enumerate(self.read_registers(first, last), first))
 
-        print(self)
+        changed = sorted(a for a in target if current.get(a) != target[a])
+        runs = register_runs(changed, target)
+        for run in runs:
+            self.write_registers(run[0], [target[a] for a in run])
+
+        self.profile = profile
+        self.profile_changes.clear()
+        logging.debug("Radio profile %s applied, %d registers in %d bursts", profile.name, len(changed), len(runs))
+        return len(runs)
 
 
 
     def read_rx_payload(self):
-            current_addr = self.rpi_board.SPI_read_register(REG_LORA.FIFO_RX_CURR_ADDR)[1]
-            received_bytes = self.rpi_board.SPI_read_register(REG_LORA.RX_NB_BYTES)[1]
-            self.rpi_board.SPI_write_register(REG_LORA.FIFO_ADDR_PTR, current_addr)
+            #FIFO_RX_CURR_ADDR, IRQ_FLAGS_MASK, IRQ_FLAGS, RX_NB_BYTES
+            regs = self.read_registers(REG_LORA.FIFO_RX_CURR_ADDR, REG_LORA.RX_NB_BYTES)
+            current_addr, received_bytes = regs[0], regs[3]
+            self.write_register(REG_LORA.FIFO_ADDR_PTR, current_addr)
             return self.rpi_board.SPI_read_buffer(REG_LORA.FIFO, received_bytes)[1:received_bytes+1]
 
+    #region IRQ dispatcher
+    def set_irq_handler(self, event, handler):
+        """Route IRQ event (see IRQ_EVENTS) to handler(irq_flags), None removes the handler"""
+        assert event in IRQ_EVENTS
+        if handler is None:
+            self.irq_handlers.pop(event, None)
+        else:
+            self.irq_handlers[event] = handler
+
+    def _dispatch_irq(self, channel=None):
+        """DIO edge: read and clear IRQ_FLAGS once, route each raised flag to its registered handler once
+            - crc_error goes to its own handler if there is one, otherwise to rx_done handler
+            - edge of event mapped to more DIOs finds flags cleared by first edge, counted in irq_coalesced
+            - raised flags without handler are counted in irq_unhandled
+        """
+        with self.irq_lock:
+            irq = self.read_register(REG_LORA.IRQ_FLAGS)
+            if not irq:
+                self.irq_coalesced += 1
+                return
+            self.write_register(REG_LORA.IRQ_FLAGS, irq)
+            flags = irq_flags_from_register(irq)
+            handlers = self.irq_handlers
+            handled = False
+            for event in IRQ_EVENTS:
+                if not flags[event] or event not in handlers:
+                    continue
+                if event == 'rx_done' and flags['crc_error'] and 'crc_error' in handlers:
+                    continue
+                handlers[event](flags)
+                handled = True
+
+            if not handled:
+                self.irq_unhandled += 1
+                logging.debug("DIO%s IRQ without handler - Flags: 0x%02X", channel, irq)
+    #endregion
+
+    def SX127X_harvest_rx(self, irq_flags=None):
+        """Read everything needed after RX done with minimum of SPI transactions
+            1. burst FIFO_RX_CURR_ADDR..RSSI_VALUE (IRQ flags, RX pointer, length, SNR, RSSI)
+            2. clear IRQ flags (write 1 to clear flags read in 1.), skipped when called by IRQ dispatcher
+               with irq_flags it has already read and cleared
+            3. FIFO_ADDR_PTR write + 4. FIFO burst read, skipped on CRC error
+        """
+        regs = self.read_registers(REG_LORA.FIFO_RX_CURR_ADDR, REG_LORA.RSSI_VALUE)
+        base = REG_LORA.FIFO_RX_CURR_ADDR
+        if irq_flags is not None:
+            irq = irq_register_from_flags(irq_flags)
+        else:
+            irq = regs[REG_LORA.IRQ_FLAGS - base]
+            self.write_register(REG_LORA.IRQ_FLAGS, irq | 0x40)
+
+        payload = None
+        if not irq >> 5 & 0x01:
+            current_addr = regs[0]
+            received_bytes = regs[REG_LORA.RX_NB_BYTES - base]
+            self.write_register(REG_LORA.FIFO_ADDR_PTR, current_addr)
+            payload = self.rpi_board.SPI_read_buffer(REG_LORA.FIFO, received_bytes)[1:received_bytes+1]
+
+        return RxRecord(irq=irq,
+                        payload=payload,
+                        snr=snr_from_register(regs[REG_LORA.PKT_SNR_VALUE - base]),
+                        packet_rssi=regs[REG_LORA.PKT_RSSI_VALUE - base] - self.RSSI_COOR,
+                        rssi=regs[REG_LORA.RSSI_VALUE - base] - self.RSSI_COOR)
+
     #In RX_CONTINUOUS mode RX Timout flag is never rised
     def set_rx_continuous(self, rx_done_handler):
 
@@ -238,7 +595,7 @@ class SX127X_Module:
         # assert self.mode == MODE.STDBY or self.mode == MODE.SLEEP
         print("\nSetting rx...")
         self.SX1272_set_dio1_mapping(dio0=0, dio3=3)
-        self.rpi_board.add_irq_handlers(dio0_irq_handler=rx_done_handler)
+        self.set_irq_handler('rx_done', rx_done_handler)
         #self.SX1272_set_symb_timeout(timeout)
 
         #set mode
@@ -268,15 +625,22 @@ class SX127X_Module:
         # logging.debug("%s: Receiver inactive, timeout expired...", timestamp)
         # return None
 
-    #TODO: CAD check
+    #Channel activity detection, chip returns to STDBY after CAD, cad_detected flag is set if LoRa preamble was found
+    def set_cad(self, cad_done_handler):
+        self.SX1272_set_dio1_mapping(dio0=2, dio1=2, dio3=3)
+        self.set_irq_handler('cad_done', cad_done_handler)
+        self.SX1272_set_mode(MODE.STDBY)
+        self.SX1272_set_mode(MODE.CAD)
+
+    #CAD check (listen before talk) is done by caller, see set_cad
     def set_tx(self, tx_done_handler, radio_packet):
         print("\nSetting tx...")
         assert len(radio_packet) < 256
         self.SX1272_set_dio1_mapping(dio0=1, dio1=0, dio3=3)
-        self.rpi_board.add_irq_handlers(dio0_irq_handler=tx_done_handler)
-        self.rpi_board.SPI_write_register(REG_LORA.PAYLOAD_LENGTH, len(radio_packet))
-        self.rpi_board.SPI_write_register(REG_LORA.FIFO_TX_BASE_ADDR, 0)
-        self.rpi_board.SPI_write_register(REG_LORA.FIFO_ADDR_PTR, 0)
+        self.set_irq_handler('tx_done', tx_done_handler)
+        self.write_register(REG_LORA.PAYLOAD_LENGTH, len(radio_packet))
+        #FIFO_ADDR_PTR, FIFO_TX_BASE_ADDR
+        self.write_registers(REG_LORA.FIFO_ADDR_PTR, [0, 0])
 
         #set mode
         self.SX1272_set_mode(MODE.STDBY)
@@ -291,11 +655,11 @@ class SX127X_Module:
 
         assert len(payload) < 256
         #SX1272Write(REG_LR_PAYLOADLENGTH, size);
-        self.rpi_board.SPI_write_register(REG_LORA.PAYLOAD_LENGTH, len(payload))
+        self.write_register(REG_LORA.PAYLOAD_LENGTH, len(payload))
         #SX1272Write(REG_LR_FIFOTXBASEADDR, 0);
         #SX1272Write(REG_LR_FIFOADDRPTR, 0);
-        self.rpi_board.SPI_write_register(REG_LORA.FIFO_TX_BASE_ADDR, 0)
-        self.rpi_board.SPI_write_register(REG_LORA.FIFO_ADDR_PTR, 0)
+        self.write_register(REG_LORA.FIFO_TX_BASE_ADDR, 0)
+        self.write_register(REG_LORA.FIFO_ADDR_PTR, 0)
 
         #if ((SX1272Read(REG_OPMODE) & ~RF_OPMODE_MASK) == RF_OPMODE_SLEEP){SX1272SetStby();
 
@@ -318,7 +682,7 @@ class SX127X_Module:
 
     def reset_ptr_rx(self):
         self.SX1272_set_mode(MODE.STDBY)
-        self.rpi_board.SPI_write_register(REG_LORA.FIFO_ADDR_PTR, self.rpi_board.SPI_read_register(REG_LORA.FIFO_RX_BASE_ADDR)[1])
+        self.write_register(REG_LORA.FIFO_ADDR_PTR, self.read_register(REG_LORA.FIFO_RX_BASE_ADDR))
 
 
 
@@ -334,14 +698,11 @@ class SX127X_Module:
     def SX127X_set_frequency(self, freq):
         assert self.mode == MODE.SLEEP or self.mode == MODE.STDBY or self.mode == MODE.FSK_STDBY
         freq = int(freq * 16384.)
-        self.rpi_board.SPI_write_register(REG_LORA.FR_MSB, to_uint8t(freq >> 16))
-        self.rpi_board.SPI_write_register(REG_LORA.FR_MID, to_uint8t(freq >> 8))
-        self.rpi_board.SPI_write_register(REG_LORA.FR_LSB, to_uint8t(freq))
-
-    def SX127X_get_frequency(self):
-        msb = self.rpi_board.SPI_read_register(REG_LORA.FR_MSB)[1]
-        mid = self.rpi_board.SPI_read_register(REG_LORA.FR_MID)[1]
-        lsb = self.rpi_board.SPI_read_register(REG_LORA.FR_LSB)[1]
+        self.write_registers(REG_LORA.FR_MSB,
+                                           [to_uint8t(freq >> 16), to_uint8t(freq >> 8), to_uint8t(freq)])
+
+    @burst_getter(REG_LORA.FR_MSB, REG_LORA.FR_LSB)
+    def SX127X_get_frequency(self, msb, mid, lsb):
         f = lsb + 256 * (mid + 256 * msb)
         return f / 16384
     #endregion
@@ -349,7 +710,7 @@ class SX127X_Module:
 
     #region Config
     def SX1272_get_modem_config1(self):
-        val = self.rpi_board.SPI_read_register(REG_LORA.MODEM_CONFIG_1)[1]
+        val = self.read_register(REG_LORA.MODEM_CONFIG_1)
         d = dict(
             bandwidth=val >> 6 & 0x03,
             coding_rate=val >> 3 & 0x07,
@@ -360,7 +721,7 @@ class SX127X_Module:
         return d
 
     def SX1276_get_modem_config1(self):
-        val = self.rpi_board.SPI_read_register(REG_LORA.MODEM_CONFIG_1)[1]
+        val = self.read_register(REG_LORA.MODEM_CONFIG_1)
         d = dict(
             bandwidth=val >> 4 & 0x0F,
             coding_rate=val >> 1 & 0x07,
@@ -380,7 +741,7 @@ class SX127X_Module:
               (new['implicit_header_mode'] << 2) | \
               (new['coding_rate'] << 3) | \
               (new['bandwidth'] << 6)
-        self.rpi_board.SPI_write_register(REG_LORA.MODEM_CONFIG_1, val)
+        self.write_register(REG_LORA.MODEM_CONFIG_1, val)
 
     def SX1276_set_modem_config1(self, bandwidth=None, coding_rate=None, implicit_header_mode=None):
         var = locals()
@@ -388,10 +749,10 @@ class SX127X_Module:
         new = {s: current[s] if var[s] is None else var[s] for s in var}
 
         val = new['implicit_header_mode'] | (new['coding_rate'] << 1) | (new['bandwidth'] << 4)
-        self.rpi_board.SPI_write_register(REG_LORA.MODEM_CONFIG_1, val)
+        self.write_register(REG_LORA.MODEM_CONFIG_1, val)
 
     def SX1272_get_modem_config2(self, include_symb_timout_lsb=False):
-        val = self.rpi_board.SPI_read_register(REG_LORA.MODEM_CONFIG_2)[1]
+        val = self.read_register(REG_LORA.MODEM_CONFIG_2)
         d = dict(
             spreading_factor=val >> 4 & 0x0F,
             tx_cont_mode=val >> 3 & 0x01,
@@ -403,7 +764,7 @@ class SX127X_Module:
         return d
 
     def SX1276_get_modem_config2(self, include_symb_timout_lsb=False):
-        val = self.rpi_board.SPI_read_register(REG_LORA.MODEM_CONFIG_2)[1]
+        val = self.read_register(REG_LORA.MODEM_CONFIG_2)
         d = dict(
             spreading_factor=val >> 4 & 0x0F,
             tx_cont_mode=val >> 3 & 0x01,
@@ -424,7 +785,7 @@ class SX127X_Module:
               (new['tx_cont_mode'] << 3) | \
               (new['agc_auto_on'] << 2) | \
               current['symb_timout_lsb']
-        self.rpi_board.SPI_write_register(REG_LORA.MODEM_CONFIG_2, val)
+        self.write_register(REG_LORA.MODEM_CONFIG_2, val)
 
 
     def SX1276_set_modem_config2(self, spreading_factor=None, tx_cont_mode=None, rx_crc=None):
@@ -437,10 +798,10 @@ class SX127X_Module:
               (new['tx_cont_mode'] << 3) | \
               (new['rx_crc'] << 2) | \
               current['symb_timout_lsb']
-        self.rpi_board.SPI_write_register(REG_LORA.MODEM_CONFIG_2, val)
+        self.write_register(REG_LORA.MODEM_CONFIG_2, val)
 
     def SX1276_get_modem_config3(self):
-        val = self.rpi_board.SPI_read_register(REG_LORA.MODEM_CONFIG_3)[1]
+        val = self.read_register(REG_LORA.MODEM_CONFIG_3)
         d = dict(
             lr_optimize=val >> 3 & 0x01,
             agc_auto_on=val >> 2 & 0x01,
@@ -454,7 +815,27 @@ class SX127X_Module:
 
         val = (new['lr_optimize'] << 3) | \
               (new['agc_auto'] << 2)
-        self.rpi_board.SPI_write_register(REG_LORA.MODEM_CONFIG_3, val)
+        self.write_register(REG_LORA.MODEM_CONFIG_3, val)
+
+    def SX127X_get_modem_params(self):
+        """Modem settings that determine time on air, read from config registers (cheap with shadow registers)"""
+        #MODEM_CONFIG_1, MODEM_CONFIG_2, SYMB_TIMEOUT_LSB, PREAMBLE_MSB, PREAMBLE_LSB
+        cfg1, cfg2, _, preamble_msb, preamble_lsb = self.read_registers(REG_LORA.MODEM_CONFIG_1, REG_LORA.PREAMBLE_MSB + 1)
+        if self.type == "SX1272":
+            bandwidth_hz = SX1272_BW_HZ[cfg1 >> 6 & 0x03]
+            params = dict(coding_rate=cfg1 >> 3 & 0x07, implicit_header_mode=cfg1 >> 2 & 0x01,
+                          rx_crc=cfg1 >> 1 & 0x01, lr_optimize=cfg1 & 0x01)
+        else:
+            bandwidth_hz = SX1276_BW_HZ[cfg1 >> 4 & 0x0F]
+            params = dict(coding_rate=cfg1 >> 1 & 0x07, implicit_header_mode=cfg1 & 0x01,
+                          rx_crc=cfg2 >> 2 & 0x01, lr_optimize=self.read_register(REG_LORA.MODEM_CONFIG_3) >> 3 & 0x01)
+        params['spreading_factor'] = cfg2 >> 4 & 0x0F
+        params['bandwidth_hz'] = bandwidth_hz
+        params['preamble_len'] = (preamble_msb << 8) | preamble_lsb
+        return params
+
+    def SX127X_time_on_air(self, payload_len):
+        return time_on_air(payload_len, **self.SX127X_get_modem_params())
 
     #endregion
 
@@ -462,7 +843,7 @@ class SX127X_Module:
 
 
     def SX1272_get_dio1_mapping(self):
-        val = self.rpi_board.SPI_read_register(REG_LORA.DIO_MAPPING_1)[1]
+        val = self.read_register(REG_LORA.DIO_MAPPING_1)
         d = dict(
             dio0=val >> 6 & 0x03,
             dio1=val >> 4 & 0x03,
@@ -477,63 +858,50 @@ class SX127X_Module:
         current = self.SX1272_get_dio1_mapping()
         new = {s: current[s] if var[s] is None else var[s] for s in var}
         val = (new['dio0'] << 6) | (new['dio1'] << 4) | (new['dio2'] << 2) | new['dio3']
-        self.rpi_board.SPI_write_register(REG_LORA.DIO_MAPPING_1, val)
+        self.write_register(REG_LORA.DIO_MAPPING_1, val)
 
 
-    def SX1272_get_symb_timeout(self):
-        SYMB_TIMEOUT_MSB = REG_LORA.MODEM_CONFIG_2
-        msb = self.rpi_board.SPI_read_register(SYMB_TIMEOUT_MSB)[1] & 0x3
-        lsb = self.rpi_board.SPI_read_register(REG_LORA.SYMB_TIMEOUT_LSB)[1]
-        return (msb << 8) | lsb
+    #SYMB_TIMEOUT_MSB bits are in MODEM_CONFIG_2, followed by SYMB_TIMEOUT_LSB
+    @burst_getter(REG_LORA.MODEM_CONFIG_2, REG_LORA.SYMB_TIMEOUT_LSB)
+    def SX1272_get_symb_timeout(self, confreg, lsb):
+        return ((confreg & 0x3) << 8) | lsb
 
     def SX1272_set_symb_timeout(self, symb_timeout):
-        SYMB_TIMEOUT_MSB = REG_LORA.MODEM_CONFIG_2
-        confreg = self.rpi_board.SPI_read_register(REG_LORA.MODEM_CONFIG_2)[1]
+        confreg = self.read_register(REG_LORA.MODEM_CONFIG_2)
         msb = symb_timeout >> 8 & 0b11  # bits 8-9
         lsb = symb_timeout - 256 * msb  # bits 0-7
-        self.rpi_board.SPI_write_register(SYMB_TIMEOUT_MSB, confreg | msb)
-        self.rpi_board.SPI_write_register(REG_LORA.SYMB_TIMEOUT_LSB, lsb)
+        self.write_registers(REG_LORA.MODEM_CONFIG_2, [confreg | msb, lsb])
 
 
     def SX1272_set_mode(self, mode):
         self.mode = mode
-        self.rpi_board.SPI_write_register(REG_LORA.OP_MODE, mode.value)
+        self.write_register(REG_LORA.OP_MODE, mode.value)
 
     def SX1272_get_mode(self, assertion=True):
         if assertion:
-            assert self.rpi_board.SPI_read_register(REG_LORA.OP_MODE)[1] == self.mode.value
+            assert self.read_register(REG_LORA.OP_MODE) == self.mode.value
         return self.mode.value
 
 
     def SX1272_get_irq_flags(self):
-        v = self.rpi_board.SPI_read_register(REG_LORA.IRQ_FLAGS)[1]
-        return dict(
-            rx_timeout=v >> 7 & 0x01,
-            rx_done=v >> 6 & 0x01,
-            crc_error=v >> 5 & 0x01,
-            valid_header=v >> 4 & 0x01,
-            tx_done=v >> 3 & 0x01,
-            cad_done=v >> 2 & 0x01,
-            fhss_change_ch=v >> 1 & 0x01,
-            cad_detected=v >> 0 & 0x01,
-        )
+        return irq_flags_from_register(self.read_register(REG_LORA.IRQ_FLAGS))
 
 
     def SX1272_clear_irq_flags(self,
                                rx_timeout=None, rx_done=None, crc_error=None, valid_header=None, tx_done=None,
                                cad_done=None, fhss_change_ch=None, cad_detected=None):
 
-        reg = self.rpi_board.SPI_read_register(REG_LORA.IRQ_FLAGS)[1]
+        reg = self.read_register(REG_LORA.IRQ_FLAGS)
         for i, s in enumerate(['cad_detected', 'fhss_change_ch', 'cad_done', 'tx_done', 'valid_header',
                                'crc_error', 'rx_done', 'rx_timeout']):
             val = locals()[s]
             if val is not None:
                 reg = set_bit(reg, i, val)
-        return self.rpi_board.SPI_write_register(REG_LORA.IRQ_FLAGS, reg)
+        return self.write_register(REG_LORA.IRQ_FLAGS, reg)
 
 
     def SX1272_get_modem_status(self):
-        status = self.rpi_board.SPI_read_register(REG_LORA.MODEM_STAT)[1]
+        status = self.read_register(REG_LORA.MODEM_STAT)
         return dict(
             rx_coding_rate=status >> 5 & 0x03,
             modem_clear=status >> 4 & 0x01,
@@ -562,7 +930,7 @@ class SX127X_Module:
         new = {s: current[s] if var[s] is None else var[s] for s in var}
 
         val = (new['pa_select'] << 7) | (new['pa_max_power'] << 4) | new['pa_output_power']
-        self.rpi_board.SPI_write_register(REG_LORA.PA_CONFIG, val)
+        self.write_register(REG_LORA.PA_CONFIG, val)
     #endregion
 
 
@@ -579,7 +947,15 @@ class SX127X_Module:
 
     @getter(REG_LORA.PKT_SNR_VALUE)
     def SX127X_get_packet_snr_value(self, val):
-        return -float(~val + 1)/4. if val & 0x80 else float(val)/4.
+        return snr_from_register(val)
+
+    @burst_getter(REG_LORA.PKT_SNR_VALUE, REG_LORA.RSSI_VALUE)
+    def SX127X_get_link_metrics(self, snr, packet_rssi, rssi):
+        return dict(
+            snr=snr_from_register(snr),
+            packet_rssi=packet_rssi - self.RSSI_COOR,
+            rssi=rssi - self.RSSI_COOR,
+        )
     #endregion
 
 
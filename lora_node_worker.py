@@ -2,36 +2,57 @@
 \file       lora_node_worker.py
 \author     Ladislav Stefka
 \brief      Object represents connected measuring unit
-            - 3 threads for handling radio and UDP communication
+            - state machine driven by shared worker pool (worker_pool.py), messages come through node inbox
+            - session is checkpointed on state change (session_store.py), resume() continues stored session
+            - liveness and FFT chunk timeouts are timers of pool timer wheel, expiry is message in inbox
+            - JSON packets to/from Node-RED go through shared UDP endpoint (udp_endpoint.py)
             - state machine description 
 \copyright
 """
 
-import threading
 import logging
-from queue import Queue, Empty
+from queue import Empty
 import enum
-import socket
-import requests
 import json
 import datetime
+import threading
+import time
 
 
 import radio_packet as rp
 import json_packet as jp
 import config as cfg
 import params as prm
-import tools
+import fft_reassembly
+import http_client
+import spectrum_store
+import worker_pool
+import udp_endpoint
+import bounded_queue as bq
+import uplink_batcher
 
 
 
-#TODO: move server ip and urls to separate file
-SERVER_IP = "127.0.0.1"
-SERVER_PORT = 12344
+#TODO: move urls to separate file
 URL_STATUSINFO = "http://127.0.0.1:1880/lora_nodered/statusinfo"
+URL_STATUSINFO_BATCH = "http://127.0.0.1:1880/lora_nodered/statusinfo_batch"
 
 APPLICATION_MODE = 0 #status mode
 
+#inbox messages of node timers
+LIVENESS_TIMEOUT = object()
+FFT_TIMEOUT = object()
+
+#node queues, radio packets are shed first when inbox is full (timers and Node-RED replies are kept)
+INBOX_CAPACITY = 256
+INBOX_POLICY = bq.PRIORITY
+UDP_QUEUE_CAPACITY = 32
+UDP_QUEUE_POLICY = bq.DROP_OLDEST
+
+
+def inbox_priority(rec):
+    return 0 if isinstance(rec, rp.RadioPacket) else 1
+
 
 class States(enum.IntEnum):
     STOPPED = 0
@@ -41,28 +62,29 @@ class States(enum.IntEnum):
     EXPECTING_CHUNK = 40
     ERROR = 100
 
-FFT_NUM_OF_CHUNKS = 32
-
 
 
 class NodeWorker:
     """Communication with lora node"""
 
     TIMEOUT = 1000
-    MAIN_LOOP_SLEEP = 0.1
     DEBUG = True
 
     def get_id(self):
         return self.params.idloranode
 
-    def __init__(self, tx_queue, nat):
+    def __init__(self, tx_queue, nat, pool=None, endpoint=None, sessions=None):
         self.name = "LORA_WORKER ??"
         self.state = 0
 
-        self.rx_common_queue = Queue()
+        #radio packets, JSON packets and timer expiries, processed by pool thread
+        self.inbox = bq.BoundedQueue(INBOX_CAPACITY, INBOX_POLICY, priority=inbox_priority, name="node inbox")
+        self.scheduled = False
+        self.pool = pool if pool is not None else worker_pool.shared_pool()
         self.tx_radio_queue = tx_queue
-        self.tx_udp_queue = Queue()
+        self.tx_udp_queue = bq.BoundedQueue(UDP_QUEUE_CAPACITY, UDP_QUEUE_POLICY, name="node UDP queue")
         self.nat = nat
+        self.sessions = sessions
 
         #config
         self.config = cfg.Config()
@@ -72,19 +94,24 @@ class NodeWorker:
 
 
         self.start_time = 0
-        self.fft_buffer = [0] * 1024
+        self.fft = None
+        self.spectra = None
+        self.spectra_lock = threading.Lock()    #store is closed by stop (other thread) while worker may append
         self.last_temperature = 0
 
         self.shouldRun = True
-        self.worker_thread = threading.Thread(target=self.worker)
-        self.receive_thread = threading.Thread(target=self.receiver)
-        self.sending_thread = threading.Thread(target=self.sender)
+        self.started = False
 
         self.statusInfoPeriod = NodeWorker.TIMEOUT
 
-        #socket connection
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind(("127.0.0.1", prm.Params.CFG_DEFAULT_PORT))
+        #Node-RED connection
+        self.endpoint = endpoint
+        if self.endpoint is None:
+            try:
+                self.endpoint = udp_endpoint.shared_endpoint(self.pool)
+            except OSError:
+                logging.error("%s: UDP port %d is already bound, node has no Node-RED connection",
+                              self.name, prm.Params.CFG_DEFAULT_PORT)
 
         #http connection
 
@@ -97,7 +124,8 @@ class NodeWorker:
         self.lastStatusInfo = None
         self.statusInfo = None
         self.uptime = 0
-        self.nextTimeout = None
+        self.liveness = None
+        self.fft_timer = None
         self.nextStatusInfo = None
         if NodeWorker.DEBUG:
             logging.info("+++ New lora node worker...")
@@ -138,22 +166,41 @@ class NodeWorker:
         return message
 
     def HTTP_send_data(self, statusinfo_rp):
+        """Status info is posted in batch with other nodes (when Node-RED handles batches) or alone"""
         message = self._prepare_message(statusinfo_rp)
-        req = requests.post(url=URL_STATUSINFO, data=message)
-        out = (req.status_code, req.reason)
-        logging.debug("Data was successfully sent to node-red server %s", out)
+        if uplink_batcher.BATCH_ENABLED:
+            uplink_batcher.shared_http_batcher(self.pool, URL_STATUSINFO_BATCH).put(message)
+        else:
+            #failures are logged by client
+            http_client.shared_client().post(URL_STATUSINFO, data=message)
 
     def UDP_send_data(self, statusinfo_rp):
         message = self._prepare_message(statusinfo_rp)
-        self.socket.sendto(json.dumps(message).encode('ascii'), (SERVER_IP, SERVER_PORT))
+        self.endpoint.send_raw(json.dumps(message).encode('ascii'))
         logging.debug("Data was successfully sent to node-red server")
 
 
 
-    def send_fft_req(self):
-        req = rp.FFTChunkRequest()
+    def send_fft_req(self, seqnums=None):
+        """Requests whole FFT spectrum, or again after timeout (seqnums - missing chunks of spectrum being reassembled)
+
+        Only missing chunks are requested when node firmware supports it (config.fft_chunk_select),
+        otherwise whole spectrum is requested again and chunks received already are dropped as duplicates.
+        """
+        if seqnums is None:
+            fs, N = self.config.get_fft_params()
+            self.fft = fft_reassembly.FFTReassembler(N)
+            self.fft.start()
+        if seqnums is None or not self.config.fft_chunk_select or max(seqnums) >= rp.FFTChunkSelectRequest.MAX_CHUNKS:
+            req = rp.FFTChunkRequest()
+        else:
+            req = rp.FFTChunkSelectRequest()
+            req.seqnums = seqnums
         req.sessionid = self.params.sessionid
-        req.data_type = rp.FFTChunkRequest.DATA_TYPE
+        if self.fft_timer is None:
+            self.fft_timer = self.pool.timers.schedule(self.fft.timeout, self.put, FFT_TIMEOUT)
+        else:
+            self.pool.timers.rearm(self.fft_timer, self.fft.timeout)
         self.tx_radio_queue.put(req)
         self.state = States.EXPECTING_CHUNK
 
@@ -184,22 +231,29 @@ class NodeWorker:
     def extendTimeout(self, timeout=None):
         if not timeout:
             timeout = NodeWorker.TIMEOUT
-        self.nextTimeout = datetime.datetime.now() + datetime.timedelta(seconds=timeout)
+        if self.liveness is None:
+            self.liveness = self.pool.timers.schedule(timeout, self.put, LIVENESS_TIMEOUT)
+        else:
+            self.pool.timers.rearm(self.liveness, timeout)
+
+    def put(self, packet):
+        """Message for node state machine, node is scheduled on pool once it is started"""
+        if self.inbox.put(packet) and self.started:
+            self.pool.schedule(self)
 
-    def start(self):
-        logging.warning("%s:Starting lora node worker threads.", self.name)
+    def start(self, state=States.JOINING):
+        logging.warning("%s:Starting lora node worker.", self.name)
         try:
             #connect to internet
             #self.ms.connect()
             self.extendTimeout()
-            self.state = States.JOINING
+            self.state = state
         except:
             self.state = States.ERROR.value
             raise
 
-        self.worker_thread.start()
-        self.receive_thread.start()
-        self.sending_thread.start()
+        self.started = True
+        self.pool.add(self)
 
         #self.tx_udp_queue.put({"topic": "getInfo", "address": "0x0D473533"})
 
@@ -207,222 +261,274 @@ class NodeWorker:
         logging.debug("%s: Stopping lora node: %s")
         self.shouldRun = False
         self.state = States.STOPPED
-        self.worker_thread.join(0.1)
-        self.receive_thread.join(0.1)
-        self.sending_thread.join(0.1)
+        self.cancel_timers()
+        self.pool.remove(self)
+        if self.endpoint is not None:
+            self.endpoint.unregister(self.params.address, self)
+        self.close_spectra()
+
+    def store_spectrum(self, spectrum):
+        """Appends spectrum to spectrum store of node (opened on first spectrum or when number of bins changes)"""
+        with self.spectra_lock:
+            if self.state == States.STOPPED:
+                return
+            if self.spectra is None or self.spectra.nbins != len(spectrum):
+                if self.spectra is not None:
+                    self.spectra.close()
+                self.spectra = spectrum_store.SpectrumStore.for_node(self.params.address, len(spectrum))
+            self.spectra.append(spectrum)
+
+    def close_spectra(self):
+        with self.spectra_lock:
+            if self.spectra is not None:
+                self.spectra.close()
+                self.spectra = None
+
+    def resume(self, record):
+        """Starts node in session restored from session store, without join and config requests"""
+        self.params.__dict__.update(record["params"])
+        self.config.__dict__.update(record["config"])
+        self.name = "LORA_WORKER 0x{:02X}".format(self.params.sessionid)
+        if self.endpoint is not None:
+            self.endpoint.register(self.params.address, self)
+        state = States(record["state"])
+        #FFT transfer is not resumed
+        if state == States.EXPECTING_CHUNK:
+            state = States.JOINED
+        logging.info("%s: Resuming session of %s, state %s", self.name, self.params.address, state.name)
+        self.start(state)
+
+    def checkpoint(self):
+        """Stores session of joined node, session of node that is not joined is removed
+            - stopped worker (replaced by worker of rejoined node) does not touch the session"""
+        if self.sessions is None or self.params.address is None or self.state == States.STOPPED:
+            return
+        if self.state in (States.JOINED, States.CONFIGURED, States.EXPECTING_CHUNK):
+            self.sessions.checkpoint(self)
+        else:
+            self.sessions.remove(self.params.address, self.params.sessionid)
 
     def is_alive(self):
-        if self.worker_thread.is_alive() or self.receive_thread.is_alive() or self.sending_thread.is_alive():
-            return True
-        else:
-            return False
+        return self.started and self.shouldRun
 
+    def cancel_timers(self):
+        for timer in (self.liveness, self.fft_timer):
+            if timer is not None:
+                self.pool.timers.cancel(timer)
 
 
-    #Main stauts worker Thread
-    def worker(self):
 
-        while self.shouldRun:
-            dt = datetime.datetime.now()
-            if dt > self.nextTimeout:
-                logging.error("%s:Timeout expecting data", self.name)
-                self.shouldRun = False
-                self.state = States.ERROR
-            #if self.nextStatusInfo and dt > self.nextStatusInfo:
-            #     self.objToSend.put(jsonPacket.StatusInfo())
-            #     self.nextStatusInfo = datetime.datetime.now() + datetime.timedelta(seconds=self.STATUS_INFO_PERIOD)
-            #     self.extendTimeout()
+    def run(self, max_batch):
+        """Processes up to max_batch inbox messages (called by pool thread), returns number of processed"""
+        processed = 0
+        while processed < max_batch and self.shouldRun:
             try:
-                rec = self.rx_common_queue.get(True, NodeWorker.MAIN_LOOP_SLEEP)
+                rec = self.inbox.get_nowait()
             except Empty:
-                continue
-
-            #packet processing routine
-            self.extendTimeout()
-
-            #STETE_01: Join request is pending...
-            if self.state == States.JOINING:
-
-                if isinstance(rec, rp.JoinRequest):
-                    assert rec.sessionid == 0x00
-
-                    self.start_time = rec.time
+                break
+            processed += 1
+            if rec is LIVENESS_TIMEOUT:
+                self.on_liveness_timeout()
+            elif rec is FFT_TIMEOUT:
+                self.on_fft_timeout()
+            else:
+                state = self.state
+                self.handle(rec)
+                if self.state != state:
+                    self.checkpoint()
+        if not self.shouldRun:
+            self.inbox.clear()
+        self.sender()
+        return processed
+
+    def on_liveness_timeout(self):
+        #timer re-armed by packet processed after expiry was queued, or worker already stopped
+        if self.liveness.armed or not self.shouldRun:
+            return
+        logging.error("%s:Timeout expecting data", self.name)
+        self.shouldRun = False
+        self.state = States.ERROR
+        self.checkpoint()
+        self.cancel_timers()
+        self.pool.remove(self)
+        if self.endpoint is not None:
+            self.endpoint.unregister(self.params.address, self)
+        self.close_spectra()
+        logging.info("%s:Main loop stopped.", self.name)
 
-                    logging.info("%s: Received JOIN REQUEST RP from address %s, start time %s...",
-                                 self.name, rec.unique_id, self.start_time)
-                    #get params
-                    #prm.Params.HTTP_get_params_fromDB(self.params, rec.unique_id)
-                    nr = jp.NodeinfoRequest(rec.unique_id)
-                    self.tx_udp_queue.put(nr)
+    def on_fft_timeout(self):
+        if self.state != States.EXPECTING_CHUNK or self.fft.complete:
+            return
+        #timer is not re-armed on every chunk, deadline of reassembler moves instead
+        if not self.fft.expired():
+            self.pool.timers.rearm(self.fft_timer, self.fft.deadline - time.monotonic())
+            return
+        missing = self.fft.on_timeout()
+        if missing is None:
+            self.state = States.JOINED
+        else:
+            logging.warning("%s: FFT chunks %s missing, requesting them again", self.name, missing)
+            self.send_fft_req(missing)
 
+    #Node state machine, one radio or JSON packet
+    def handle(self, rec):
+        #packet processing routine
+        self.extendTimeout()
+        if isinstance(rec, rp.RadioPacket):
+            self.cntRadio += 1
 
-                elif isinstance(rec, jp.NodeInfoReply):
+        #STETE_01: Join request is pending...
+        if self.state == States.JOINING:
 
-                    #get params object
-                    self.params.set_from_json_packet(rec)
+            if isinstance(rec, rp.JoinRequest):
+                assert rec.sessionid == 0x00
 
-                    #set NAT
-                    self.nat[self.params.sessionid] = self.params.address
+                self.start_time = rec.time
 
-                    #bind port
-                    try:
-                        #self.socket.close()
-                        pass
-                        #self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                        #self.socket.bind(("127.0.0.1", int(self.params.port)))
-                    except:
-                        logging.error("Receiver port bind failed...")
-                        raise
+                logging.info("%s: Received JOIN REQUEST RP from address %s, start time %s...",
+                             self.name, rec.unique_id, self.start_time)
+                #get params
+                #prm.Params.HTTP_get_params_fromDB(self.params, rec.unique_id)
+                nr = jp.NodeinfoRequest(rec.unique_id)
+                self.tx_udp_queue.put(nr)
 
-                    #change state
-                    self.state = States.JOINED
 
-                    self.name = "LORA_WORKER 0x{:02X}".format(self.params.sessionid)
-                    logging.info("%s: Received NODE INFO JP, relation (%s - %s), fwver %s",
-                                  self.name, self.params.address, self.params.sessionid, self.params.fwver)
-                    #send reply
-                    self.send_join_reply()
+            elif isinstance(rec, jp.NodeInfoReply):
 
-                else:
-                    logging.error("%s: Received unexpected packet %s, STATE=JOINING\n", self.name, rec.getName())
-                    self.state = States.ERROR
+                #get params object
+                self.params.set_from_json_packet(rec)
 
-            #STETE_02: Node is joined, waiting for another packets...
-            elif self.state == States.JOINED:
+                #set NAT
+                self.nat[self.params.sessionid] = self.params.address
 
-                if isinstance(rec, rp.ConfigRequest):
-                    assert self.config.config_fetched is False
+                #reset commands from Node-RED are routed by address
+                self.endpoint.register(self.params.address, self)
 
-                    logging.info("%s: Received CONFIG REQUEST RP", self.name)
+                #change state
+                self.state = States.JOINED
 
-                    # #get config
-                    # cfg.Config.HTTP_get_config_fromDB(self.config, self.params.idloranode)
-                    cr = jp.ConfigRequest(self.get_id())
-                    self.tx_udp_queue.put(cr)
+                self.name = "LORA_WORKER 0x{:02X}".format(self.params.sessionid)
+                logging.info("%s: Received NODE INFO JP, relation (%s - %s), fwver %s",
+                              self.name, self.params.address, self.params.sessionid, self.params.fwver)
+                #send reply
+                self.send_join_reply()
 
+            else:
+                logging.error("%s: Received unexpected packet %s, STATE=JOINING\n", self.name, rec.getName())
+                self.state = States.ERROR
 
-                elif isinstance(rec, jp.NodeConfigReply):
+        #STETE_02: Node is joined, waiting for another packets...
+        elif self.state == States.JOINED:
 
-                    #get config object
-                    self.config.set_from_json_packet(rec)
+            if isinstance(rec, rp.ConfigRequest):
+                assert self.config.config_fetched is False
 
-                    #change state
-                    self.state = States.CONFIGURED
+                logging.info("%s: Received CONFIG REQUEST RP", self.name)
 
-                    logging.info("%s: Received NODE CONFIG JP \n %s", self.name, self.config)
+                # #get config
+                # cfg.Config.HTTP_get_config_fromDB(self.config, self.params.idloranode)
+                cr = jp.ConfigRequest(self.get_id())
+                self.tx_udp_queue.put(cr)
 
-                    #send reply
-                    self.send_config_reply()
 
-                elif isinstance(rec, jp.ResetNodeHard):
-                    logging.info("%s: Received HARD RESTART JP", self.name)
-                    self.state = States.JOINING
-                    self.send_restart(resetConfig=False)
+            elif isinstance(rec, jp.NodeConfigReply):
 
+                #get config object
+                self.config.set_from_json_packet(rec)
 
-                elif isinstance(rec, jp.StatusinfoACK):
-                    pass
+                #change state
+                self.state = States.CONFIGURED
 
+                logging.info("%s: Received NODE CONFIG JP \n %s", self.name, self.config)
 
-                elif isinstance(rec, rp.StatusInfo):
-                    assert rec.sessionid == self.params.sessionid
-                    logging.warning("%s: Received STATUS INFO packet for unknown configuration!!!\n", self.name)
-                    #TODO: send reset packet
+                #send reply
+                self.send_config_reply()
 
-                else:
-                    logging.error("%s: Received unexpected packet %s, STATE=JOINED\n", self.name, rec.getName())
+            elif isinstance(rec, jp.ResetNodeHard):
+                logging.info("%s: Received HARD RESTART JP", self.name)
+                self.state = States.JOINING
+                self.send_restart(resetConfig=False)
 
 
-            #STETE_03: Node is configured, waiting for status info packets...
-            elif self.state == States.CONFIGURED:
-                assert self.config.config_fetched is True
+            elif isinstance(rec, jp.StatusinfoACK):
+                pass
 
-                if isinstance(rec, rp.StatusInfo):
-                    assert rec.sessionid == self.params.sessionid
 
-                    logging.info("%s: Received STATUS INFO RP\n"
-                                 "     temp: %.3f bat: %u rms: %.3f vpp: %.3f\n"
-                                 "     kurtosis ratio: %.3f ringdown counts: %u, risetime: %u th.duration: %u\n"
-                                 "     peaks (%u): %s",
-                                 self.name, rec.temperature, rec.battery, rec.rms, rec.vpp,
-                                 rec.kurtosis_ratio, rec.ringdown_counts, rec.rise_time, rec.threshold_duration,
-                                 rec.fft_peaks_num, rec.get_fft_peaks()
-                                 )
-                    #post data
-                    #self.UDP_send_data(rec)
-                    #self.HTTP_send_data(rec)
-                    pr = jp.StatusinfoPostRequest(self.get_id())
-                    pr.prepare_from_statusinfo_radio_packet(rec, self.config)
-                    self.tx_udp_queue.put(pr)
+            elif isinstance(rec, rp.StatusInfo):
+                assert rec.sessionid == self.params.sessionid
+                logging.warning("%s: Received STATUS INFO packet for unknown configuration!!!\n", self.name)
+                #TODO: send reset packet
 
-                elif isinstance(rec, jp.ResetNodeHard):
-                    logging.info("%s: Received HARD RESTART JP", self.name)
-                    self.state = States.JOINING
-                    self.send_restart(resetConfig=False)
+            else:
+                logging.error("%s: Received unexpected packet %s, STATE=JOINED\n", self.name, rec.getName())
+
+
+        #STETE_03: Node is configured, waiting for status info packets...
+        elif self.state == States.CONFIGURED:
+            assert self.config.config_fetched is True
+
+            if isinstance(rec, rp.StatusInfo):
+                assert rec.sessionid == self.params.sessionid
+
+                logging.info("%s: Received STATUS INFO RP\n"
+                             "     temp: %.3f bat: %u rms: %.3f vpp: %.3f\n"
+                             "     kurtosis ratio: %.3f ringdown counts: %u, risetime: %u th.duration: %u\n"
+                             "     peaks (%u): %s",
+                             self.name, rec.temperature, rec.battery, rec.rms, rec.vpp,
+                             rec.kurtosis_ratio, rec.ringdown_counts, rec.rise_time, rec.threshold_duration,
+                             rec.fft_peaks_num, rec.get_fft_peaks()
+                             )
+                #post data
+                #self.UDP_send_data(rec)
+                #self.HTTP_send_data(rec)
+                pr = jp.StatusinfoPostRequest(self.get_id())
+                pr.prepare_from_statusinfo_radio_packet(rec, self.config)
+                self.tx_udp_queue.put(pr)
+
+            elif isinstance(rec, jp.ResetNodeHard):
+                logging.info("%s: Received HARD RESTART JP", self.name)
+                self.state = States.JOINING
+                self.send_restart(resetConfig=False)
+
+            elif isinstance(rec, jp.ResetNodeConfig):
+                logging.info("%s: Received CONFIG RESET JP", self.name)
+                self.state = States.JOINED
+                self.send_restart(resetConfig=True)
+
+            elif isinstance(rec, jp.StatusinfoACK):
+                pass
 
-                elif isinstance(rec, jp.ResetNodeConfig):
-                    logging.info("%s: Received CONFIG RESET JP", self.name)
+            else:
+                logging.error("%s: Received unexpected packet %s, STATE=CONFIGURED\n", self.name, rec.getName())
+
+        elif self.state == States.EXPECTING_CHUNK:
+            if isinstance(rec, rp.FFTChunkData):
+                logging.info("FFT chunk %d received...", rec.seqnum)
+                if self.fft.add(rec):
+                    self.store_spectrum(self.fft.spectrum())
+                    logging.info("FFT spectrum was received...")
                     self.state = States.JOINED
-                    self.send_restart(resetConfig=True)
-
-                elif isinstance(rec, jp.StatusinfoACK):
-                    pass
-
-                else:
-                    logging.error("%s: Received unexpected packet %s, STATE=CONFIGURED\n", self.name, rec.getName())
-
-            elif self.state == States.EXPECTING_CHUNK:
-                if isinstance(rec, rp.FFTChunkData):
-                    self.fft_buffer[rec.seqnum * 32: rec.seqnum * 32 + 32] = rec.get_FFT_bins()
-                    if rec.seqnum == FFT_NUM_OF_CHUNKS - 1: #32 fft chunks in total
-                        tools.write_data_to_file(self.fft_buffer, "fft_values", "f")
-                        logging.info("FFT spectrum was received...")
-                        self.state = States.JOINED
-                    logging.info("FFT chunk received...")
-                elif isinstance(rec, rp.TemperatureData):
-                    self.last_temperature = rec.temperature
-                    logging.info("Temperature packet received...")
-                else:
-                    logging.error("%s:unexpected packet:%s", self.name, rec.getName)
-
+            elif isinstance(rec, rp.TemperatureData):
+                self.last_temperature = rec.temperature
+                logging.info("Temperature packet received...")
             else:
-                logging.error("%s:Unexpected condition :%s", self.name, rec.packet)
-            #End of packet processing routine
+                logging.error("%s:unexpected packet:%s", self.name, rec.getName)
 
-        self.state = States.ERROR
-        logging.info("%s:Main loop stopped.", self.name)
+        else:
+            logging.error("%s:Unexpected condition :%s", self.name, rec.packet)
+        #End of packet processing routine
 
-    #Receiver Thread
-    def receiver(self):
-        while self.shouldRun:
-            packet = self.socket.recvfrom(2048)
-            if packet:
-                if NodeWorker.DEBUG: logging.debug("%s - receiver: Received packet %s", self.name, packet)
-                try:
-                    self.cntNet += 1
-                    data = json.loads(packet[0].decode())
-                    try:
-                        rec = jp.JsonPacket(data)
-                    except:
-                        raise
-                    self.rx_common_queue.put(rec)
-                    if NodeWorker.DEBUG: logging.debug("%s - receiver: Json packet %s put in rx_queue", self.name, rec.getName())
-                except:
-                    raise
-                    logging.error("%s - receiver: Invalid JSON... ", self.getName)
-                    self.cntNetErr += 1
-
-    #Sender Thread
+    #Sender, sends JSON packets queued by state machine (pool thread), replies come to inbox from endpoint
     def sender(self):
-        while self.shouldRun:
+        while True:
             try:
-                packet = self.tx_udp_queue.get(block=True, timeout=10)  # blokujici get
-                data = json.dumps(packet.__dict__).encode('ascii')
-                if NodeWorker.DEBUG: logging.debug("%s - sender: Sending json %s", self.name,  data)
-                self.socket.sendto(data, (SERVER_IP, SERVER_PORT))
+                packet = self.tx_udp_queue.get_nowait()
             except Empty:
-                if NodeWorker.DEBUG: logging.debug("%s - sender:No JSON to send", self.name)
-                pass
+                return
+            if self.endpoint is None:
+                continue
+            if NodeWorker.DEBUG: logging.debug("%s - sender: Sending json %s", self.name, packet.getName())
+            self.endpoint.send(self, packet)
 
 
 
@@ -0,0 +1,70 @@
+"""
+\file       nodered_cache.py
+\author     Ladislav Stefka
+\brief      Gateway side cache of Node-RED replies to node info and config requests
+            - NodeInfoReply by node address, NodeConfigReply by idloranode, entries expire after CACHE_TTL
+            - request with fresh entry is answered by gateway (udp_endpoint.py), Node-RED is not asked
+            - entries are invalidated by ResetNodeConfig / ResetNodeHard and can be prefetched at startup
+\copyright
+"""
+
+import threading
+import time
+
+import json_packet as jp
+
+CACHE_TTL = 600.0
+
+
+class NodeRedCache:
+    """Reply JSON data keyed by (request CMD, address or idloranode)"""
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}       #key -> (expires, reply data)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(packet):
+        """Cache key of request, None if replies to request are not cached"""
+        if isinstance(packet, jp.NodeinfoRequest):
+            return packet.CMD, packet.address
+        if isinstance(packet, jp.ConfigRequest):
+            return packet.CMD, packet.idloranode
+        return None
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, data):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, data)
+
+    def invalidate(self, address=None, idloranode=None, config_only=True):
+        """Drops config of node, node info too if config_only is False"""
+        with self.lock:
+            keys = [(jp.ConfigRequest.CMD, idloranode)]
+            if not config_only:
+                keys.append((jp.NodeinfoRequest.CMD, address))
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def report(self):
+        return dict(entries=len(self.entries), hits=self.hits, misses=self.misses, invalidations=self.invalidations)
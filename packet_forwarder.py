@@ -5,6 +5,9 @@
             - main loop of application
             - loading default radio configuration
             - setup, loop structure
+            - node sessions are journaled (session_store.py) and restored on start, joined nodes need not rejoin
+            - node info and config of known nodes are prefetched from Node-RED on start (nodered_cache.py)
+            - status batches not acknowledged by Node-RED are spooled to disk and replayed (uplink_spool.py)
 \copyright
 """
 
@@ -13,13 +16,24 @@
 import logging
 import time
 import sys
-from queue import Queue
+import random
+import threading
+from collections import OrderedDict
 from enum import Enum
 
 import lora_module as lm
 import rpi_board as rb
 import radio_packet
 import lora_node_worker as lnw
+import sx127x_sim
+import tools
+import tx_scheduler
+import bounded_queue as bq
+import session_store
+import udp_endpoint
+import uplink_batcher
+import uplink_spool
+import worker_pool
 
 
 # HIGH PRIORITY
@@ -56,56 +70,270 @@ class States(Enum):
     CAD = 3
 
 
-class Gateway:
-    """Gateway object holding main references"""
-    board = None
-    module = None
-    state = States.IDLE
-    tx_queue = Queue()
-    nodes = {}
-    nat = {}
-    RX_TIMEOUT = 10
+# radio TX queue is bounded, under overload data requests are shed before join/config/restart replies
+TX_QUEUE_CAPACITY = 64
+TX_QUEUE_POLICY = bq.PRIORITY
 
 
-def on_tx_done(channel):
-    irq_flags = Gateway.module.SX1272_get_irq_flags()
-    #logging.debug("DIO0 IRQ ON TX DONE handler - Flags: %s", irq_flags)
-    Gateway.module.SX1272_clear_irq_flags(tx_done=1)
-    #Gateway.module.SX1272_set_mode(lm.MODE.SLEEP)
-    Gateway.state = States.IDLE
+def tx_priority(frame):
+    return 1 if isinstance(frame, (radio_packet.JoinReply, radio_packet.ConfigReply, radio_packet.Restart)) else 0
 
 
-def on_rx_done(channel=None):
-    m = Gateway.module
-    logging.info("On RX Done")
-    irq_flags = m.SX1272_get_irq_flags()
-    logging.debug("DIO0 IRQ ON RX DONE handler - Flags: %s", irq_flags)
-    m.received_packets += 1
+class TxQueue(bq.BoundedQueue):
+    """Radio TX queue waking up gateway main loop on every put"""
+
+    def __init__(self, capacity=TX_QUEUE_CAPACITY, policy=TX_QUEUE_POLICY):
+        super().__init__(capacity, policy, priority=tx_priority, name="radio TX queue")
+
+    def put(self, item, block=True, timeout=None):
+        queued = super().put(item, block, timeout)
+        Gateway.wakeup.set()
+        return queued
 
-    if m.mode == lm.MODE.RXCONT:
-        m.SX1272_clear_irq_flags(rx_done=1)
-        if irq_flags['crc_error']:
-            logging.error("CRC ERROR WAS DETECTED!!!")
-            Gateway.state = States.IDLE
-            return
 
-        #output received raw data
-        payload = m.read_rx_payload()
-        packet_SNR = m.SX127X_get_packet_snr_value()
-        packet_RSII = m.SX127X_get_packet_rssi_value()
-        RSII = m.SX127X_get_rssi_value()
-        logging.debug("Packet CRC OK: SNR= %s, packet RSII= %s, RSII= %s, length = %d, message = %s",
-                     packet_SNR, packet_RSII, RSII, len(payload), "".join("\\x{:02x}".format(x) for x in payload))
+# RADIOS - SX127x modules of gateway, they share SPI bus and differ in pins, channel and spreading factor
+# pins None -> RPI_BOARD default pins, config - overrides of default configuration (RX channel, SF)
+# tx False -> module only listens
+# NSS is driven as plain GPIO, do not use CE0/CE1 (GPIO 8/7) owned by spidev hardware chip select
+RADIOS = [
+    dict(name="radio0", pins=None, config={}, tx=True),
+    #dict(name="radio1", pins=rb.RadioPins(NSS=16, DIO0=5, DIO1=6, DIO3=13, RST=12), config=dict(spreading_factor=9), tx=True),
+]
 
-        #convert payload to appropriate radio packet
-        rp = radio_packet.RadioPacket(payload)
-        rp.snr = packet_SNR
-        rp.rsii = packet_RSII
 
-        #create new node if it is join request
+class Gateway:
+    """Gateway object holding main references"""
+    board = None            #first radio board/module, single radio gateway
+    module = None
+    radios = []
+    wakeup = threading.Event()
+    tx_queue = TxQueue()
+    scheduler = None
+    profiles = {}
+    default_profile = None
+    nodes = {}
+    nat = {}
+    sessions = None         #SessionStore, None -> sessions are not persisted
+    endpoint = None         #Node-RED endpoint of node workers, None -> shared endpoint
+    spool = None            #UplinkSpool of status batches, None -> batches are lost while Node-RED is down
+    dispatch_lock = threading.Lock()
+    RX_TIMEOUT = 10
+    running = True
+
+    #IRQ -> action latency
+    irq_latency = tools.LatencyStat()
+
+    #listen before talk - every downlink is preceded by CAD, busy channel -> backoff and retry
+    LBT_BACKOFF_MIN = 0.05
+    LBT_BACKOFF_MAX = 0.5
+    LBT_MAX_RETRIES = 5
+    lbt_stats = dict(cad=0, clear=0, collisions_avoided=0, dropped=0)
+
+    #the same frame heard by several radios is dispatched only once, frame repeated by node is not dropped
+    DEDUP_WINDOW = 0.5
+    recent_frames = OrderedDict()       #payload -> (time, radio), oldest first
+    duplicates = 0
+
+
+class Radio:
+    """One SX127x module of gateway with its own pins, RX channel/SF and state
+
+    All radios listen on their RX profile, downlink is given to one idle radio
+    with tx enabled, the other radios stay in RX meanwhile.
+    """
+
+    def __init__(self, name, board, type, radio_config, tx=True):
+        self.name = name
+        self.board = board
+        self.tx = tx
+        self.rx_profile = lm.RadioProfile(name, radio_config, type)
+        self.module = lm.SX127X_Module(board, type, shadow_registers=True)
+        self.module.SX127X_module_setup(self.rx_profile)
+
+        self.state = States.IDLE
+        self.timeout = time.monotonic() + Gateway.RX_TIMEOUT
+        #time of last IRQ not yet followed by main loop action
+        self.irq_time = None
+
+        self.lbt_frame = None
+        self.lbt_retries = 0
+        self.lbt_retry_at = 0.0
+        self.lbt_channel_clear = False
+
+    def __str__(self):
+        return "{} ({:.3f} MHz, SF{}, {})".format(self.name, self.rx_profile.config["freq"],
+                                                 self.rx_profile.config["spreading_factor"], self.state.name)
+
+    @property
+    def ready(self):
+        return self.state == States.IDLE or self.state == States.RX_RUNNING
+
+    #region IRQ handlers
+    def irq_entry(self):
+        self.irq_time = time.monotonic()
+
+    def irq_exit(self):
+        Gateway.wakeup.set()
+
+    def irq_action_taken(self):
+        if self.irq_time is not None:
+            Gateway.irq_latency.record(time.monotonic() - self.irq_time)
+            self.irq_time = None
+
+    def on_tx_done(self, irq_flags=None):
+        self.irq_entry()
+        #logging.debug("DIO0 IRQ ON TX DONE handler - Flags: %s", irq_flags)
+        #flags were cleared by IRQ dispatcher
+        self.state = States.IDLE
+        self.irq_exit()
+
+    def on_rx_done(self, irq_flags=None):
+        self.irq_entry()
+        m = self.module
+        logging.info("On RX Done (%s)", self.name)
+        m.received_packets += 1
+
+        if m.mode == lm.MODE.RXCONT:
+            rx = m.SX127X_harvest_rx(irq_flags)
+            logging.debug("DIO0 IRQ ON RX DONE handler - Flags: %s", rx.irq_flags)
+            if rx.crc_error:
+                logging.error("CRC ERROR WAS DETECTED!!!")
+                self.state = States.IDLE
+                self.irq_exit()
+                return
+
+            #output received raw data
+            payload = rx.payload
+            logging.debug("Packet CRC OK: SNR= %s, packet RSII= %s, RSII= %s, length = %d, message = %s",
+                          rx.snr, rx.packet_rssi, rx.rssi, len(payload), "".join("\\x{:02x}".format(x) for x in payload))
+
+            #convert payload to appropriate radio packet
+            rp = radio_packet.decode(payload)
+            if rp is None:
+                logging.error("Unknown radio packet, command 0x%02x, length %d", payload[0] if payload else 0, len(payload))
+                self.state = States.IDLE
+                self.irq_exit()
+                return
+            rp.snr = rx.snr
+            rp.rsii = rx.packet_rssi
+            dispatch_packet(rp, payload, self)
+
+            self.state = States.IDLE
+        self.irq_exit()
+
+    def on_cad_done(self, irq_flags=None):
+        self.irq_entry()
+        if irq_flags is not None and irq_flags['cad_detected']:
+            Gateway.lbt_stats['collisions_avoided'] += 1
+            self.lbt_retries += 1
+            if self.lbt_retries > Gateway.LBT_MAX_RETRIES:
+                logging.warning("Radio packet %s dropped, channel busy after %d CAD retries",
+                                self.lbt_frame.getName(), Gateway.LBT_MAX_RETRIES)
+                Gateway.lbt_stats['dropped'] += 1
+                self.lbt_frame = None
+            else:
+                backoff = random.uniform(Gateway.LBT_BACKOFF_MIN, Gateway.LBT_BACKOFF_MAX)
+                logging.debug("Channel busy, TX deferred by %.3f s", backoff)
+                self.lbt_retry_at = time.monotonic() + backoff
+        else:
+            Gateway.lbt_stats['clear'] += 1
+            self.lbt_channel_clear = True
+        #back to RX during backoff, busy channel is most likely uplink
+        self.state = States.IDLE
+        self.irq_exit()
+
+    def on_rx_timeout(self, irq_flags=None):
+        #logging.debug("ON RX TIMEOUT handler...")
+        irq_flags = self.module.SX1272_get_irq_flags()
+        self.state = States.IDLE
+    #endregion
+
+    def assign(self, frame):
+        """Downlink frame goes out through this radio (CAD first)"""
+        self.lbt_frame = frame
+        self.lbt_retries = 0
+        self.lbt_retry_at = 0.0
+        self.lbt_channel_clear = False
+
+    def step(self, now):
+        """One state machine step, returns True if an action was taken"""
+        if self.ready and self.lbt_frame is not None and now >= self.lbt_retry_at:
+            #CAD has to run with the same channel/SF/BW as the downlink
+            self.module.SX127X_apply_profile(profile_for(self.lbt_frame))
+            if self.lbt_channel_clear:
+                self.module.set_tx(self.on_tx_done, self.lbt_frame)
+                Gateway.scheduler.tx_started(self.lbt_frame, config["freq"], now)
+                self.lbt_frame = None
+                self.state = States.TX_RUNNING
+            else:
+                self.module.set_cad(self.on_cad_done)
+                Gateway.lbt_stats['cad'] += 1
+                self.state = States.CAD
+            self.irq_action_taken()
+            self.timeout = now + Gateway.RX_TIMEOUT
+            return True
+
+        elif self.state == States.IDLE:
+            self.module.SX127X_apply_profile(self.rx_profile)
+            self.module.set_rx_continuous(self.on_rx_done)
+            self.state = States.RX_RUNNING
+            self.irq_action_taken()
+            self.timeout = time.monotonic() + Gateway.RX_TIMEOUT
+            return True
+
+        elif self.state == States.RX_RUNNING and now > self.timeout:
+            self.on_rx_timeout()
+            return True
+
+        elif (self.state == States.CAD or self.state == States.TX_RUNNING) and now > self.timeout:
+            logging.error("%s: no IRQ in %s state, back to RX", self.name, self.state.name)
+            self.state = States.IDLE
+            return True
+
+        return False
+
+    def wake_at(self, now):
+        wake_at = self.timeout
+        if self.lbt_frame is not None and self.lbt_retry_at > now:
+            wake_at = min(wake_at, self.lbt_retry_at)
+        return wake_at
+
+
+def is_duplicate(payload, radio, now=None):
+    """Frame was received by another radio in last DEDUP_WINDOW seconds"""
+    now = time.monotonic() if now is None else now
+    recent = Gateway.recent_frames
+    while recent:
+        oldest = next(iter(recent.values()))
+        if now - oldest[0] < Gateway.DEDUP_WINDOW:
+            break
+        recent.popitem(last=False)
+    seen = recent.get(payload)
+    if seen is not None and seen[1] is not radio:
+        return True
+    recent[payload] = (now, radio)
+    recent.move_to_end(payload)
+    return False
+
+
+def dispatch_packet(rp, payload, radio=None):
+    """Moves received radio packet to its node worker, called from RX done handlers of all radios"""
+    with Gateway.dispatch_lock:
+        if radio is not None and len(Gateway.radios) > 1 and is_duplicate(bytes(payload), radio):
+            Gateway.duplicates += 1
+            logging.debug("Duplicate radio packet %s dropped", rp.getName())
+            return
+
+        #create new node if it is join request, worker of previous session of rejoining node is stopped
         if rp.sessionid == 0x00:
-            node_worker = lnw.NodeWorker(Gateway.tx_queue, Gateway.nat)
-            node_worker.rx_common_queue.put(rp)
+            previous = Gateway.nodes.get(rp.unique_id)
+            if previous is not None:
+                logging.info("Node %s rejoins, worker of session %s stopped", rp.unique_id, previous.params.sessionid)
+                previous.stop()
+                if Gateway.nat.get(previous.params.sessionid) == rp.unique_id:
+                    del Gateway.nat[previous.params.sessionid]
+            node_worker = lnw.NodeWorker(Gateway.tx_queue, Gateway.nat, endpoint=Gateway.endpoint, sessions=Gateway.sessions)
+            node_worker.put(rp)
             node_worker.start()
 
             Gateway.nodes[rp.unique_id] = node_worker
@@ -116,67 +344,173 @@ def on_rx_done(channel=None):
             logging.debug("Received packet with seassion id 0x%02x", rp.sessionid)
             address = Gateway.nat[rp.sessionid]
             node = Gateway.nodes[address]
-            node.rx_common_queue.put(rp)
+            node.put(rp)
+
+
+def setup(type, board=None, radios=None, sessions=None, spool=None):
+    """Setup of gateway radios
+
+    :param board: board of single radio gateway (Raspberry Pi hardware if not given)
+    :param radios: list of dict(name, board or pins, config, tx), RADIOS format, overrides board
+    :param sessions: path of session journal, stored sessions are restored
+    :param spool: directory of status batch spool, used by shared Node-RED endpoint (batches must be enabled)
+    """
+    if radios is None:
+        radios = [dict(name="radio0", board=board)]
+
+    # radio profiles - default (join) profile, data rate profiles for node specific downlinks
+    # downlinks always go out on default channel, where nodes listen
+    join = lm.RadioProfile("join", config, type)
+    Gateway.profiles = {"join": join}
+    Gateway.default_profile = join
+    for sf in range(7, 13):
+        add_profile("SF{}".format(sf), spreading_factor=sf, lr_optimize=1 if sf >= 11 else 0)
+
+    # setup board and config of every lora module
+    Gateway.running = True
+    Gateway.recent_frames = OrderedDict()
+    Gateway.duplicates = 0
+    Gateway.radios = []
+    for i, r in enumerate(radios):
+        radio_board = r.get("board")
+        if radio_board is None:
+            radio_board = rb.RPI_BOARD(pins=r.get("pins"))
+        radio_config = dict(config, **r.get("config", {}))
+        Gateway.radios.append(Radio(r.get("name", "radio{}".format(i)), radio_board, type, radio_config, r.get("tx", True)))
+    Gateway.board = Gateway.radios[0].board
+    Gateway.module = Gateway.radios[0].module
+    logging.info("Gateway radios: %s", ", ".join(str(radio) for radio in Gateway.radios))
+
+    # downlinks go out through duty cycle scheduler
+    Gateway.scheduler = tx_scheduler.DutyCycleScheduler(Gateway.tx_queue,
+                                                        lambda frame: profile_for(frame).time_on_air(len(frame)))
+
+    Gateway.spool = None
+    if spool is not None:
+        Gateway.spool = uplink_spool.UplinkSpool(spool)
+        endpoint = Gateway.endpoint
+        if endpoint is None:
+            try:
+                endpoint = udp_endpoint.shared_endpoint(worker_pool.shared_pool())
+            except OSError:
+                logging.error("Node-RED endpoint is not available, status batches are not spooled")
+        #endpoint may exist already (created by earlier setup or given by caller), spool is attached to it
+        if endpoint is None or not endpoint.attach_spool(Gateway.spool):
+            Gateway.spool.close()
+            Gateway.spool = None
+
+    Gateway.sessions = None
+    if sessions is not None:
+        Gateway.sessions = session_store.SessionStore(sessions)
+        restore_sessions()
+
+
+def restore_sessions():
+    """Node workers of stored sessions, their uplinks are forwarded without rejoin"""
+    for address, record in list(Gateway.sessions.sessions.items()):
+        node = lnw.NodeWorker(Gateway.tx_queue, Gateway.nat, endpoint=Gateway.endpoint, sessions=Gateway.sessions)
+        node.resume(record)
+        Gateway.nat[node.params.sessionid] = address
+        Gateway.nodes[address] = node
+    logging.info("%d node sessions restored from %s", len(Gateway.sessions), Gateway.sessions.path)
+
+    endpoint = Gateway.endpoint
+    if endpoint is None:
+        try:
+            endpoint = udp_endpoint.shared_endpoint(worker_pool.shared_pool())
+        except OSError:
+            logging.error("Node-RED endpoint is not available, node info is not prefetched")
+            return
+    records = Gateway.sessions.sessions.values()
+    endpoint.prefetch([r["address"] for r in records],
+                      [r["params"]["idloranode"] for r in records if r["params"].get("idloranode") is not None])
 
-        Gateway.state = States.IDLE
 
+def add_profile(name, **overrides):
+    """Radio profile derived from default one, packets select it by radio_profile attribute"""
+    Gateway.profiles[name] = Gateway.default_profile.derive(name, **overrides)
+    return Gateway.profiles[name]
 
-def on_rx_timeout(channel=None):
-    #logging.debug("ON RX TIMEOUT handler...")
-    irq_flags = Gateway.module.SX1272_get_irq_flags()
-    #logging.debug("DIO0 IRQ ON RX TIMEOUT handler - Flags: %s", irq_flags)
-    #Gateway.module.SX1272_clear_irq_flags(rx_timeout=1)
-    #Gateway.module.SX1272_set_mode(lm.MODE.STDBY)
-    Gateway.state = States.IDLE
 
+def profile_for(frame):
+    return Gateway.profiles.get(frame.radio_profile, Gateway.default_profile)
 
 
-def setup(type):
-    # setup board
-    board = rb.RPI_BOARD()
-    Gateway.board = board
+def tx_radio():
+    """Idle radio for next downlink, None if all are busy or a downlink is already in progress
+        (downlinks share channel, one at a time) - with more radios one of them always keeps listening"""
+    listening = [radio for radio in Gateway.radios if radio.state == States.RX_RUNNING]
+    for radio in Gateway.radios:
+        if radio.lbt_frame is not None or radio.state == States.CAD or radio.state == States.TX_RUNNING:
+            return None
+    for radio in Gateway.radios:
+        if radio.tx and radio.ready and (len(Gateway.radios) == 1 or any(r is not radio for r in listening)):
+            return radio
+    return None
 
-    # setup config of lora module
-    module = lm.SX127X_Module(board, type)
-    module.SX127X_module_setup(config)
-    Gateway.module = module
 
+def stop():
+    Gateway.running = False
+    Gateway.wakeup.set()
 
-def loop():
 
-    timeout = None
+def loop():
+    """Event driven main loop, sleeps until TX enqueue, TX done, CAD done, RX done or RX timeout of any radio"""
 
-    while True:
+    while Gateway.running:
         try:
-            #TODO: check channel detection
-            if (Gateway.state == States.IDLE or Gateway.state == States.RX_RUNNING) and not Gateway.tx_queue.empty():
-                Gateway.module.set_tx(on_tx_done, Gateway.tx_queue.get())
-                Gateway.state = States.TX_RUNNING
+            Gateway.wakeup.clear()
 
-            elif Gateway.state == States.IDLE:
-                Gateway.module.set_rx_continuous(on_rx_done)
-                Gateway.state = States.RX_RUNNING
-                timeout = time.time() + Gateway.RX_TIMEOUT
+            now = time.monotonic()
+            if Gateway.scheduler.has_pending():
+                radio = tx_radio()
+                if radio is not None:
+                    frame = Gateway.scheduler.next_frame(config["freq"])
+                    if frame is not None:
+                        radio.assign(frame)
 
-            elif Gateway.state == States.RX_RUNNING and time.time() > timeout:
-                on_rx_timeout()
+            if any([radio.step(now) for radio in Gateway.radios]):
+                continue
 
-            time.sleep(0.1)
+            wake_at = min(radio.wake_at(now) for radio in Gateway.radios)
+            if Gateway.scheduler.next_eligible is not None:
+                wake_at = min(wake_at, Gateway.scheduler.next_eligible)
+            Gateway.wakeup.wait(max(0.0, wake_at - time.monotonic()))
 
         except KeyboardInterrupt:
             print("Cleaning...")
-            Gateway.board.clean()
+            for radio in Gateway.radios:
+                radio.board.clean()
             break
         except AssertionError:
             print("Cleaning...")
-            Gateway.board.clean()
+            for radio in Gateway.radios:
+                radio.board.clean()
             break
 
+    logging.info("IRQ -> action latency: %s", Gateway.irq_latency)
+    logging.info("Duty cycle budget: %s", Gateway.scheduler.report())
+    logging.info("Listen before talk: %s", Gateway.lbt_stats)
+    logging.info("TX queue: %s", Gateway.tx_queue.report())
+    if Gateway.spool is not None:
+        Gateway.spool.close()
+        logging.info("Status spool: %s", Gateway.spool.report())
+    logging.info("Unknown radio packets: %s", dict(radio_packet.RadioPacket.unknown))
+    logging.info("Radios: %s, duplicate frames: %d", ", ".join(str(radio) for radio in Gateway.radios), Gateway.duplicates)
+
 
 if __name__ == "__main__":
     logging.getLogger().setLevel(logging.DEBUG)
     if sys.argv[1] == "SX1272" or sys.argv[1] == "SX1276":
-        setup(sys.argv[1])
+        #optional "sim" argument runs gateway on simulated module
+        radios = [dict(r) for r in RADIOS]
+        if len(sys.argv) > 2 and sys.argv[2] == "sim":
+            for r in radios:
+                pins = r.get("pins") or rb.RPI_BOARD
+                r["board"] = rb.RPI_BOARD(sx127x_sim.SimulatedSX127X(sys.argv[1], pins=pins), r.get("pins"))
+        #spool needs batches acknowledged by Node-RED
+        spool = uplink_spool.SPOOL_DIR if uplink_batcher.BATCH_ENABLED else None
+        setup(sys.argv[1], radios=radios, sessions=session_store.SESSION_FILE, spool=spool)
         loop()
     else:
         print("Wrong module name")
@@ -5,7 +5,7 @@
 \copyright
 """
 
-import requests
+import http_client
 
 URL_PARAMS = "http://127.0.0.1:1880/lora_nodered/node_params"
 
@@ -40,10 +40,19 @@ class Params:
 
     @staticmethod
     def HTTP_get_params_fromDB(params, address):
+        """Fills params of node from DB (blocking), errors of request are raised"""
+        return Params.HTTP_fetch_params_async(params, address).result()
+
+    @staticmethod
+    def HTTP_fetch_params_async(params, address):
+        """Requests params of node from DB, returns future of params (filled when reply arrives)"""
 
         http_params = {'address': address}
-        req = requests.get(url=URL_PARAMS, params=http_params)
-        out = req.json()
+        future = http_client.shared_client().get(URL_PARAMS, params=http_params)
+        return http_client.then(future, lambda req: Params._fill_from_db(params, address, req.json()))
+
+    @staticmethod
+    def _fill_from_db(params, address, out):
 
         if not len(out):
             raise Exception("No DB item for loranode with address {}".format(address))
@@ -53,4 +62,4 @@ class Params:
             for key in row:
                 params.__dict__[key] = row[key]
         params.sessionid = int(params.sessionid, 16)
-
+        return params
@@ -3,13 +3,18 @@
 \author     Ladislav Stefka
 \brief      Definition of binary radio protocol between central unit and measuring units
             - defines radio packets used in application
+            - packet fields are declared by FIELDS (name, struct format) and compiled into one struct.Struct,
+              received frame is decoded by single unpack call into slot attributes
 \copyright
 """
 
 import binascii
-from struct import pack, unpack
+from collections import Counter
+from struct import Struct
 import json
 
+import tools
+
 # TODO: Soleve nsamples
 
 PAT_UINT64 = "Q"
@@ -24,8 +29,26 @@ PAT_STR8 = "8s"
 # [1] ID
 # [2] DATA_TYPE !OPTIONAL
 
-class RadioPacket:
-    """General radio packet class"""
+class PacketSchema(type):
+    """Compiles FIELDS of radio packet class (appended to fields of base class) into
+        LAYOUT, FIELD_NAMES, SCHEMA (little endian struct.Struct) and __slots__ of the fields"""
+
+    def __new__(mcs, name, bases, namespace):
+        fields = tuple(namespace.get("FIELDS", ()))
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple(field for field, _ in fields)
+        cls = super().__new__(mcs, name, bases, namespace)
+        cls.LAYOUT = getattr(cls.__mro__[1], "LAYOUT", ()) + fields
+        cls.FIELD_NAMES = tuple(field for field, _ in cls.LAYOUT)
+        cls.SCHEMA = Struct("<" + "".join(fmt for _, fmt in cls.LAYOUT))
+        return cls
+
+
+class RadioPacket(metaclass=PacketSchema):
+    """General radio packet class
+
+    Received packets (decode, RadioPacket(data)) keep their raw data and are read only,
+    rawdata of packets created for sending is encoded from the fields.
+    """
 
     RES_RESULT_OK = 0,
     RES_ERROR = 1,
@@ -33,43 +56,95 @@ class RadioPacket:
     RES_INVALID_CMD = 3,
     RES_TIMEOUT = 4,
 
-    def __init__(self, data=None):
+    FIELDS = (("command", PAT_UINT8), ("sessionid", PAT_UINT8))
+    #variable part after fixed fields, its length in packets created for sending
+    TAIL_SIZE = 0
+    #field -> check of value, asserted when packet is encoded
+    CHECKS = {}
+
+    #radio_profile - name of gateway radio profile used to send the packet, None for default
+    __slots__ = ("_raw", "tail", "rsii", "snr", "radio_profile")
+
+    #(CMD, DATA_TYPE) -> packet class, DATA_TYPE None for classes selected by command only
+    registry = {}
+    #subclasses of packet class are selected by data type byte [2]
+    DATA_TYPE_DISPATCH = False
+    #received frames without packet class, (command, data type) -> count
+    unknown = Counter()
+    #received frames shorter than fixed fields of their class (missing fields are 0), class name -> count
+    truncated = Counter()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if "CMD" in cls.__dict__:
+            key = (cls.CMD, None)
+        elif cls.DATA_TYPE_DISPATCH and "DATA_TYPE" in cls.__dict__:
+            key = (cls.CMD, cls.DATA_TYPE)
+        else:
+            return
+        if key in RadioPacket.registry:
+            raise ValueError("Radio packet {} already registered for {}".format(RadioPacket.registry[key].__name__, key))
+        RadioPacket.registry[key] = cls
+
+    def __new__(cls, data=None):
         if data:
-            self.command = data[0]
-            self.rawdata = bytes(data)
-            self.rsii = None
-            self.snr = None
-            for x in RadioPacket.__subclasses__():
-                if x.CMD == self.command:
-                    if self.command == SensorDataReply.CMD:
-                        for sensor_dt in SensorDataReply.__subclasses__():
-                            if self.rawdata[2] == sensor_dt.DATA_TYPE:
-                                self.__class__ = sensor_dt
-                                return
-                        raise NameError("Sensor class not found for data_type", self.rawdata[2], "data len",
-                                        len(self.rawdata))
-                    else:
-                        self.__class__ = x
-                        return
-            raise NameError("Packet class not found for command ", self.command)
+            packet_class = packet_class_for(data)
+            if packet_class is None:
+                raise NameError("Packet class not found for command ", data[0], "data len", len(data))
+            packet = object.__new__(packet_class)
+            packet._load(data)
+            return packet
+        return object.__new__(cls)
 
+    def __init__(self, data=None):
+        if data:
+            #decoded in __new__
+            return
+        self._assign((0,) * len(self.FIELD_NAMES))
+        self.command = self.CMD
+        if "data_type" in self.FIELD_NAMES:
+            self.data_type = self.DATA_TYPE
+        self.tail = bytes(self.TAIL_SIZE)
+        self._raw = None
+        self.rsii = None
+        self.snr = None
+        self.radio_profile = None
+
+    def _assign(self, values):
+        for field, value in zip(self.FIELD_NAMES, values):
+            setattr(self, field, value)
+
+    def _load(self, data):
+        data = bytes(data)
+        size = self.SCHEMA.size
+        if len(data) < size:
+            RadioPacket.truncated[self.getName()] += 1
+            self._assign(self.SCHEMA.unpack(data + bytes(size - len(data))))
         else:
-            self.rawdata = bytearray(2)
-            self.rawdata[0] = self.__class__.CMD
+            self._assign(self.SCHEMA.unpack_from(data))
+        self.tail = data[size:]
+        self._raw = data
+        self.rsii = None
+        self.snr = None
+        self.radio_profile = None
+
+    def encode(self):
+        for field, check in self.CHECKS.items():
+            assert check(getattr(self, field)), "Invalid {} {}".format(field, getattr(self, field))
+        return self.SCHEMA.pack(*[getattr(self, field) for field in self.FIELD_NAMES]) + self.tail
 
     @property
-    def sessionid(self):
-        return self.rawdata[1]
+    def rawdata(self):
+        return self._raw if self._raw is not None else self.encode()
 
-    @sessionid.setter
-    def sessionid(self, value):
-        self.rawdata[1] = value
+    def fields(self):
+        return {field: getattr(self, field) for field in self.FIELD_NAMES}
 
     def __str__(self):
-        return "Radio packet {} data: {}".format(self.getName(), str(self.__dict__))
+        return "Radio packet {} data: {}".format(self.getName(), str(self.fields()))
 
     def __len__(self):
-        return len(self.rawdata)
+        return len(self._raw) if self._raw is not None else self.SCHEMA.size + len(self.tail)
 
     def __iter__(self):
         return iter(self.rawdata)
@@ -88,81 +163,50 @@ class RadioPacket:
         return self.__class__.__name__
 
 
+def packet_class_for(data):
+    """Packet class of received frame, one dict lookup (two for data type dispatch), None if unknown"""
+    packet_class = RadioPacket.registry.get((data[0], None))
+    if packet_class is not None and packet_class.DATA_TYPE_DISPATCH:
+        packet_class = RadioPacket.registry.get((data[0], data[2])) if len(data) > 2 else None
+    return packet_class
+
+
+def decode(data):
+    """Radio packet from received frame, None (and counted in RadioPacket.unknown) if there is no packet class for it"""
+    packet_class = packet_class_for(data) if data else None
+    if packet_class is None:
+        RadioPacket.unknown[(data[0] if data else None, data[2] if data and len(data) > 2 else None)] += 1
+        return None
+    packet = object.__new__(packet_class)
+    packet._load(data)
+    return packet
+
+
 #region Join Process
 class JoinRequest(RadioPacket):
     CMD = 0x10
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(4 + 1))
+    FIELDS = (
+        ("uid", PAT_UINT32),
+        ("time", PAT_UINT32),
+        ("reserved", PAT_UINT8),
+        ("fwver", PAT_UINT8),
+    )
 
     @property
     def unique_id(self):
-        return "0x{0:08X}".format(unpack(PAT_UINT32, self.rawdata[2:6])[0])
-
-    @property
-    def time(self):
-        return unpack(PAT_UINT32, self.rawdata[6:10])[0]
-
-    @property
-    def fwver(self):
-        return self.rawdata[11]
+        return "0x{0:08X}".format(self.uid)
 
 #TODO: move application mode up
 class JoinReply(RadioPacket):
     CMD = 0x01
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(1 + 3 * 1 + 2 + 1))
-
-    @property
-    def result(self):
-        return self.rawdata[2]
-
-    @result.setter
-    def result(self, value):
-        self.rawdata[2] = value
-
-    @property
-    def bw(self):
-        return self.rawdata[3]
-
-    @bw.setter
-    def bw(self, value):
-        self.rawdata[3] = value
-
-    @property
-    def sf(self):
-        return self.rawdata[4]
-
-    @sf.setter
-    def sf(self, value):
-        self.rawdata[4] = value
-
-    @property
-    def cr(self):
-        return self.rawdata[5]
-
-    @cr.setter
-    def cr(self, value):
-        self.rawdata[5] = value
-
-    @property
-    def join_interval(self):
-        return unpack(PAT_UINT16, self.rawdata[6:8])[0]
-
-    @join_interval.setter
-    def join_interval(self, value):
-        self.rawdata[6:8] = pack(PAT_UINT16, value)
-
-    @property
-    def app_mode(self):
-        return self.rawdata[8]
-
-    @app_mode.setter
-    def app_mode(self, value):
-        self.rawdata[8] = value
+    FIELDS = (
+        ("result", PAT_UINT8),
+        ("bw", PAT_UINT8),
+        ("sf", PAT_UINT8),
+        ("cr", PAT_UINT8),
+        ("join_interval", PAT_UINT16),
+        ("app_mode", PAT_UINT8),
+    )
 
 #endregion
 
@@ -174,212 +218,76 @@ class JoinReply(RadioPacket):
 class ConfigRequest(RadioPacket):
     CMD = 0x20
 
-    def __init__(self):
-        super().__init__()
-
 class ConfigReply(RadioPacket):
     CMD = 0x02
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(5 + 5 + 5))
-        self.app_mode = 0
-
-    #region General Settings
-    @property
-    def statusinfo_interval(self):
-        return unpack(PAT_UINT16, self.rawdata[2:4])[0]
-
-    @statusinfo_interval.setter
-    def statusinfo_interval(self, value):
-        self.rawdata[2:4] = pack(PAT_UINT16, value)
-
-    @property
-    def statusinfo_listen_interval(self):
-        return unpack(PAT_UINT16, self.rawdata[4:6])[0]
-
-    @statusinfo_listen_interval.setter
-    def statusinfo_listen_interval(self, value):
-        self.rawdata[4:6] = pack(PAT_UINT16, value)
-
-    @property
-    def temperature_averaging_num(self):
-        return self.rawdata[6]
-
-    @temperature_averaging_num.setter
-    def temperature_averaging_num(self, value):
-        assert value <= 10
-        self.rawdata[6] = value
-    #endregion
-
-    #region ADC && FFT
-    @property
-    def fft_adc_sampling_time(self):
-        return self.rawdata[7]
-
-    @fft_adc_sampling_time.setter
-    def fft_adc_sampling_time(self, value):
-        self.rawdata[7] = value
-
-    @property
-    def fft_adc_divider(self):
-        return self.rawdata[8]
-
-    @fft_adc_divider.setter
-    def fft_adc_divider(self, value):
-        self.rawdata[8] = value
-
-    @property
-    def fft_samples_num(self):
-        return self.rawdata[9]
-
-    @fft_samples_num.setter
-    def fft_samples_num(self, value):
-        self.rawdata[9] = value
-
-    @property
-    def fft_peaks_num(self):
-        return self.rawdata[10]
-
-    @fft_peaks_num.setter
-    def fft_peaks_num(self, value):
-        assert value <= 10
-        self.rawdata[10] = value
-
-    @property
-    def fft_peaks_delta(self):
-        return self.rawdata[11]
-
-    @fft_peaks_delta.setter
-    def fft_peaks_delta(self, value):
-        assert value <= 10
-        self.rawdata[11] = value
-    #endregion
-
-    #region DSP
-    @property
-    def dsp_threshold_voltage(self):
-        return unpack(PAT_UINT16, self.rawdata[12:14])[0]
-
-    @dsp_threshold_voltage.setter
-    def dsp_threshold_voltage(self, value):
-        self.rawdata[12:14] = pack(PAT_UINT16, value)
-
-    @property
-    def dsp_kurtosis_trimmed_samples(self):
-        return self.rawdata[14]
-
-    @dsp_kurtosis_trimmed_samples.setter
-    def dsp_kurtosis_trimmed_samples(self, value):
-        assert value < 50
-        self.rawdata[14] = value
-
-    @property
-    def dsp_rms_ac(self):
-        return self.rawdata[15]
-
-    @dsp_rms_ac.setter
-    def dsp_rms_ac(self, value):
-        assert value == 0 or value == 1
-        self.rawdata[15] = value
-
-    @property
-    def dsp_rms_averaging_num(self):
-        return self.rawdata[16]
-
-    @dsp_rms_averaging_num.setter
-    def dsp_rms_averaging_num(self, value):
-        assert value <= 10
-        self.rawdata[16] = value
+    FIELDS = (
+        #General Settings
+        ("statusinfo_interval", PAT_UINT16),
+        ("statusinfo_listen_interval", PAT_UINT16),
+        ("temperature_averaging_num", PAT_UINT8),
+        #ADC && FFT
+        ("fft_adc_sampling_time", PAT_UINT8),
+        ("fft_adc_divider", PAT_UINT8),
+        ("fft_samples_num", PAT_UINT8),
+        ("fft_peaks_num", PAT_UINT8),
+        ("fft_peaks_delta", PAT_UINT8),
+        #DSP
+        ("dsp_threshold_voltage", PAT_UINT16),
+        ("dsp_kurtosis_trimmed_samples", PAT_UINT8),
+        ("dsp_rms_ac", PAT_UINT8),
+        ("dsp_rms_averaging_num", PAT_UINT8),
+    )
+    CHECKS = {
+        "temperature_averaging_num": lambda value: value <= 10,
+        "fft_peaks_num": lambda value: value <= 10,
+        "fft_peaks_delta": lambda value: value <= 10,
+        "dsp_kurtosis_trimmed_samples": lambda value: value < 50,
+        "dsp_rms_ac": lambda value: value == 0 or value == 1,
+        "dsp_rms_averaging_num": lambda value: value <= 10,
+    }
 #endregion
 
 
 #region Statusinfo
 class StatusInfo(RadioPacket):
     CMD = 0x30  # StatusInfo.CMD
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(0))
-
-    #region measurments
-    @property
-    def battery(self):
-        return self.rawdata[2]
-
-    @property
-    def temperature(self):
-        return unpack(PAT_UINT16, self.rawdata[3:5])[0]
-
-    @property
-    def rms(self):
-        return unpack(PAT_UINT16, self.rawdata[5:7])[0]
-
-    @property
-    def vpp(self):
-        return unpack(PAT_UINT16, self.rawdata[7:9])[0]
-
-    @property
-    def kurtosis_ratio(self):
-        return unpack(PAT_FLOAT, self.rawdata[9:13])[0]
-
-    @property
-    def ringdown_counts(self):
-        return self.rawdata[13]
-
-    @property
-    def rise_time(self):
-        return unpack(PAT_UINT16, self.rawdata[14:16])[0]
-
-    @property
-    def threshold_duration(self):
-        return unpack(PAT_UINT16, self.rawdata[16:18])[0]
-
-    @property
-    def fft_peaks_num(self):
-        return self.rawdata[18]
+    #measurments, FFT peaks (fft_peaks_num indexes, fft_peaks_num values) follow
+    FIELDS = (
+        ("battery", PAT_UINT8),
+        ("temperature", PAT_UINT16),
+        ("rms", PAT_UINT16),
+        ("vpp", PAT_UINT16),
+        ("kurtosis_ratio", PAT_FLOAT),
+        ("ringdown_counts", PAT_UINT8),
+        ("rise_time", PAT_UINT16),
+        ("threshold_duration", PAT_UINT16),
+        ("fft_peaks_num", PAT_UINT8),
+    )
 
     @property
     def fft_peaks_indexes(self):
-        peaks = []
-        lastindex = 19
-        for i in range(self.fft_peaks_num):
-            index = unpack(PAT_UINT16, self.rawdata[lastindex+i*2 : lastindex+(i+1)*2])[0]
-            peaks.append(index)
-        return peaks
+        """uint16 typed array (see tools.typed_array)"""
+        return tools.typed_array(self.rawdata, PAT_UINT16, self.fft_peaks_num, self.SCHEMA.size)
 
     @property
     def fft_peaks_values(self):
-        peaks = []
-        lastindex = 19 + self.fft_peaks_num * 2
-        for i in range(self.fft_peaks_num):
-            value = unpack(PAT_FLOAT, self.rawdata[lastindex+i*4 : lastindex+(i+1)*4])[0]
-            peaks.append(value)
-        return peaks
+        """float32 typed array (see tools.typed_array)"""
+        return tools.typed_array(self.rawdata, PAT_FLOAT, self.fft_peaks_num, self.SCHEMA.size + self.fft_peaks_num * 2)
 
     def get_fft_peaks(self):
-        peaks = []
-        fft_peaks_indexes = self.fft_peaks_indexes
-        fft_peaks_values = self.fft_peaks_values
-        for i in range(self.fft_peaks_num):
-            peaks.append((fft_peaks_indexes[i], fft_peaks_values[i]))
-        return sorted(peaks)
+        """Sorted list of (index, value) tuples"""
+        indexes = self.fft_peaks_indexes
+        values = self.fft_peaks_values
+        if tools.np is not None:
+            order = tools.np.lexsort((values, indexes))
+            return list(zip(indexes[order].tolist(), values[order].tolist()))
+        return sorted(zip(indexes.tolist(), values.tolist()))
 #endregion
 
 class Restart(RadioPacket):
     CMD = 0x60  # StatusInfo.CMD
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(1))
-    @property
-    def resetConfig(self):
-        return self.rawdata[2]
-
-    @resetConfig.setter
-    def resetConfig(self, value):
-        assert int(value) == 1 or int(value) == 0
-        self.rawdata[2] = value
+    FIELDS = (("resetConfig", PAT_UINT8),)
+    CHECKS = {"resetConfig": lambda value: int(value) == 1 or int(value) == 0}
 
 
 
@@ -387,47 +295,26 @@ class Restart(RadioPacket):
 class SensorDataRequest(RadioPacket):
     CMD = 0x04
     DATA_TYPE = 0x00
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(1 + 1))
-        if self.DATA_TYPE:
-            self.rawdata[2] = self.DATA_TYPE
-
-    @property
-    def data_type(self):
-        return self.rawdata[2]
-
-    @data_type.setter
-    def data_type(self, value):
-        self.rawdata[2] = value
-
-    @property
-    def nsamples(self):
-        return self.rawdata[3]
-
-    @nsamples.setter
-    def nsamples(self, value):
-        self.rawdata[3] = value
+    FIELDS = (
+        ("data_type", PAT_UINT8),
+        ("nsamples", PAT_UINT8),
+    )
 
 
 class TemperatureDataRequest(SensorDataRequest):
     DATA_TYPE = 0x01
 
-    def __init__(self):
-        super().__init__()
-
 
 # data types max 256 seqn num
 class SensorDataReply(RadioPacket):
     CMD = 0x40
     DATA_TYPE = 0x00
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(3))  # data_type, seqnum, nsamples
-        if self.DATA_TYPE:
-            self.rawdata[2] = self.DATA_TYPE
+    DATA_TYPE_DISPATCH = True
+    FIELDS = (
+        ("data_type", PAT_UINT8),
+        ("seqnum", PAT_UINT8),
+        ("nsamples", PAT_UINT8),
+    )
 
     def getTypeName(self):
         raise NotImplementedError("Implemnt in sub-class")
@@ -438,46 +325,25 @@ class SensorDataReply(RadioPacket):
     def getDataSize(self):
         raise NotImplementedError("Implemnt in sub-class")
 
-    @property
-    def data_type(self):
-        return self.rawdata[2]
-
-    @data_type.setter
-    def data_type(self, value):
-        self.rawdata[2] = value
-
-    @property
-    def seqnum(self):
-        return self.rawdata[3]
-
-    @seqnum.setter
-    def seqnum(self, value):
-        self.rawdata[3] = value
-
-    @property
-    def nsamples(self):
-        return self.rawdata[4]
-
-    @nsamples.setter
-    def nsamples(self, value):
-        self.rawdata[4] = value
-
     @property
     def data(self):
         return self.rawdata[5:5 + self.getDataSize()]
 
     @data.setter
     def data(self, value):
-        self.rawdata[5:5 + self.getDataSize()] = value
+        rawdata = bytearray(self.rawdata)
+        rawdata[5:5 + self.getDataSize()] = value
+        self._load(rawdata)
+        #packet stays editable, rawdata is encoded again from fields
+        self._raw = None
 
 
 class TemperatureData(SensorDataReply):
     DATA_TYPE = 0x01
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(4))  # time
-        self.rawdata.extend(bytearray(2))  # temperature
+    FIELDS = (
+        ("time", PAT_UINT32),
+        ("temperature", PAT_UINT16),
+    )
 
     def getJson(self):
         return json.dumps({"time": self.time, "temperature": self.temperature})
@@ -488,78 +354,62 @@ class TemperatureData(SensorDataReply):
     def getDataSize(self):
         return 5 * self.nsamples
 
-    @property
-    def time(self):
-        return unpack(PAT_UINT32, self.rawdata[5:9])[0]
-
-    # @time.setter
-    # def time(self, value):
-    #     self.rawdata[4:8] = pack(PAT_UINT32, value)
-
-    @property
-    def temperature(self):
-        return unpack(PAT_UINT16, self.rawdata[9:11])[0]
-
-        # @temperature.setter
-        # def temperature(self, value):
-        #     self.rawdata[8:10] = pack(PAT_UINT16, value)
-
 
 # region DATA CHUNKS
 
 class FFTChunkRequest(RadioPacket):
     CMD = 0x05
     DATA_TYPE = 0x01
+    FIELDS = (("data_type", PAT_UINT8),)
+
 
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(1))
+class FFTChunkSelectRequest(RadioPacket):
+    """Request of selected chunks of FFT spectrum (missing ones), own command so FFTChunkRequest layout is unchanged
+        chunk_mask - bitmap of requested seqnums, seqnums 0..MAX_CHUNKS-1
+        sent only to nodes with config.fft_chunk_select, other nodes get FFTChunkRequest of whole spectrum"""
+    CMD = 0x06
+    DATA_TYPE = 0x01
+    MAX_CHUNKS = 32
+    FIELDS = (
+        ("data_type", PAT_UINT8),
+        ("chunk_mask", PAT_UINT32),
+    )
 
     @property
-    def data_type(self):
-        return self.rawdata[2]
+    def seqnums(self):
+        return [seqnum for seqnum in range(self.MAX_CHUNKS) if self.chunk_mask >> seqnum & 1]
 
-    @data_type.setter
-    def data_type(self, value):
-        self.rawdata[2] = value
+    @seqnums.setter
+    def seqnums(self, value):
+        mask = 0
+        for seqnum in value:
+            if not 0 <= seqnum < self.MAX_CHUNKS:
+                raise ValueError("FFT chunk seqnum {} cannot be requested, chunk mask holds seqnums 0..{}".format(
+                    seqnum, self.MAX_CHUNKS - 1))
+            mask |= 1 << seqnum
+        self.chunk_mask = mask
 
 
 class FFTChunkData(RadioPacket):
     CMD = 0x50
     DATA_TYPE = 0x01
-
-    def __init__(self):
-        super().__init__()
-        self.rawdata.extend(bytearray(3))  # data_type, seqnum, nsamples
-        self.rawdata.extend(bytearray(128))  # chunksize
-        if self.DATA_TYPE:
-            self.rawdata[2] = self.DATA_TYPE
-
-    @property
-    def data_type(self):
-        return self.rawdata[2]
-
-    @property
-    def seqnum(self):
-        return self.rawdata[3]
-
-    @property
-    def nchunks(self):
-        return self.rawdata[4]
-
-    @property
-    def time(self):
-        return unpack(PAT_UINT32, self.rawdata[5:9])[0]
+    FIELDS = (
+        ("data_type", PAT_UINT8),
+        ("seqnum", PAT_UINT8),
+        ("nchunks", PAT_UINT8),
+        ("time", PAT_UINT32),
+    )
+    #chunksize
+    TAIL_SIZE = 128
+    FFT_BINS = TAIL_SIZE // 4
 
     @property
     def data(self):
-        return self.rawdata[9:]
+        return self.tail
 
     def get_FFT_bins(self):
-        fft_bins = []
-        for i in range(128 // 4):
-            fft_bins.append(unpack(PAT_FLOAT, self.rawdata[9 + i * 4: 9 + i * 4 + 4])[0])
-        return fft_bins
+        """float32 typed array of 32 bins (see tools.typed_array), zero copy view of rawdata with numpy"""
+        return tools.typed_array(self.rawdata, PAT_FLOAT, self.FFT_BINS, self.SCHEMA.size)
 
     def getTypeName(self):
         return "FFT"
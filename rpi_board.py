@@ -1,24 +1,99 @@
 """
 \file       rpi_board.py
 \author     Ladislav Stefka
-\brief      API for handling Raspberry Pi hardware 
+\brief      API for handling Raspberry Pi hardware
             - defines GPIO pins operations
             - defines SPI operations
+            - GPIO/SPI go through a transport, Raspberry Pi hardware by default (see sx127x_sim.py for software one)
 \copyright
 """
 
 #import wiringpi
 import time
 import logging
-import RPi.GPIO as GPIO
-import spidev
+import threading
+from collections import namedtuple
 
 SPI_speed = 500000
 SPI_channel = 0
 SPI_bus = 0
 
+#pins of one LoRa module, several modules share SPI bus and differ in chip select (NSS)
+RadioPins = namedtuple("RadioPins", "NSS DIO0 DIO1 DIO3 RST")
 
 
+class HardwareTransport:
+    """GPIO and SPI of Raspberry Pi (RPi.GPIO, spidev)
+
+    Transport interface used by RPI_BOARD:
+        setup_output(pin), setup_input(pin), output(pin, value), input(pin),
+        add_event_detect(pin, callback), remove_event_detect(pin),
+        spi_open(bus, channel, speed), xfer(data), xfer2(data), cleanup()
+        lock - held for whole SPI transaction (NSS low .. NSS high)
+    """
+
+    #one SPI bus shared by all modules, SpiDev and GPIO mode are set up once for all transports
+    lock = threading.RLock()
+    spi = None
+    spi_opened = False
+    users = 0
+
+    def __init__(self):
+        #imported here so the rest of the stack can be imported without Raspberry Pi libraries
+        import RPi.GPIO as GPIO
+        import spidev
+        self.GPIO = GPIO
+        with HardwareTransport.lock:
+            if HardwareTransport.users == 0:
+                GPIO.setmode(GPIO.BCM)
+                HardwareTransport.spi = spidev.SpiDev()
+            HardwareTransport.users += 1
+        self.spi = HardwareTransport.spi
+
+    def setup_output(self, pin):
+        self.GPIO.setup(pin, self.GPIO.OUT)
+
+    def setup_input(self, pin):
+        self.GPIO.setup(pin, self.GPIO.IN, pull_up_down=self.GPIO.PUD_DOWN)
+
+    def output(self, pin, value):
+        self.GPIO.output(pin, value)
+
+    def input(self, pin):
+        return self.GPIO.input(pin)
+
+    def add_event_detect(self, pin, callback):
+        self.GPIO.add_event_detect(pin, self.GPIO.RISING, callback=callback)
+
+    def remove_event_detect(self, pin):
+        self.GPIO.remove_event_detect(pin)
+
+    def spi_open(self, bus, channel, speed):
+        with HardwareTransport.lock:
+            if HardwareTransport.spi_opened:
+                return
+            self.spi.open(bus, channel)
+            self.spi.max_speed_hz = speed  # SX127x can go up to 10MHz, pick half that to be safe
+            HardwareTransport.spi_opened = True
+
+    def xfer(self, data):
+        return self.spi.xfer(data)
+
+    def xfer2(self, data):
+        return self.spi.xfer2(data)
+
+    def cleanup(self):
+        """Releases GPIO and SPI when last transport is cleaned"""
+        with HardwareTransport.lock:
+            HardwareTransport.users -= 1
+            if HardwareTransport.users > 0:
+                return
+            if HardwareTransport.spi_opened:
+                self.spi.close()
+            HardwareTransport.spi = None
+            HardwareTransport.spi_opened = False
+            self.GPIO.cleanup()
+
 
 class RPI_BOARD:
 
@@ -33,125 +108,152 @@ class RPI_BOARD:
     LED = 18
     NSS = 25
 
-    SPI = None
 
-
-    def __init__(self):
+    def __init__(self, transport=None, pins=None):
+        self.transport = transport if transport is not None else HardwareTransport()
+        if pins is not None:
+            self.NSS, self.DIO0, self.DIO1, self.DIO3, self.RST = pins
+        self.SPI_transactions = 0
+        self.irq_handlers = {}
         self.io_setup()
 
     def clean(self):
-        GPIO.cleanup()
+        self.transport.cleanup()
 
 
-    @staticmethod
-    def io_setup():
-        GPIO.setmode(GPIO.BCM)
+    def io_setup(self):
         #SPI
-        RPI_BOARD.spi_setup()
+        self.spi_setup()
         # LED
-        GPIO.setup(RPI_BOARD.LED, GPIO.OUT)
-        GPIO.output(RPI_BOARD.LED, 0)
-        GPIO.setup(RPI_BOARD.DIO0, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        self.transport.setup_output(self.LED)
+        self.transport.output(self.LED, 0)
         #RST, DIO
-        GPIO.setup(RPI_BOARD.RST, GPIO.OUT)
-        GPIO.setup(RPI_BOARD.NSS, GPIO.OUT)
-        GPIO.setup(RPI_BOARD.DIO0, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(RPI_BOARD.DIO1, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-        GPIO.setup(RPI_BOARD.DIO3, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-
-    @staticmethod
-    def spi_setup():
-        RPI_BOARD.SPI = spidev.SpiDev()
-        RPI_BOARD.SPI.open(SPI_bus, SPI_channel)
-        RPI_BOARD.SPI.max_speed_hz = SPI_speed  # SX127x can go up to 10MHz, pick half that to be safe
-
-    @staticmethod
-    def add_irq_handlers(dio0_irq_handler=None, dio1_irq_handler=None, dio3_irq_handler=None):
-        if dio0_irq_handler is not None:
-            try:
-                GPIO.remove_event_detect(RPI_BOARD.DIO0)
-            finally:
-                GPIO.add_event_detect(RPI_BOARD.DIO0, GPIO.RISING, callback=dio0_irq_handler)
-
-        if dio1_irq_handler is not None:
-            try:
-                GPIO.remove_event_detect(RPI_BOARD.DIO1)
-            finally:
-                GPIO.add_event_detect(RPI_BOARD.DIO1, GPIO.RISING, callback=dio1_irq_handler)
-
-        if dio3_irq_handler is not None:
-            try:
-                GPIO.remove_event_detect(RPI_BOARD.DIO3)
-            finally:
-                GPIO.add_event_detect(RPI_BOARD.DIO3, GPIO.RISING, callback=dio3_irq_handler)
-
-    @staticmethod
-    def pin_write (pin, value):
-        GPIO.output(pin, value)
-
-    @staticmethod
-    def pin_read (pin):
-        return GPIO.input(pin)
-
-    @staticmethod
-    def pin_reset(pin):
-        RPI_BOARD.pin_write(pin, 1)
+        self.transport.setup_output(self.RST)
+        self.transport.setup_output(self.NSS)
+        self.transport.setup_input(self.DIO0)
+        self.transport.setup_input(self.DIO1)
+        self.transport.setup_input(self.DIO3)
+
+    def spi_setup(self):
+        self.transport.spi_open(SPI_bus, SPI_channel, SPI_speed)
+
+    def add_irq_handlers(self, dio0_irq_handler=None, dio1_irq_handler=None, dio3_irq_handler=None):
+        """Set handlers of DIO rising edges, edge detection is registered only once per pin,
+            later calls just replace the handler (no GPIO event thread restart, no lost edges)"""
+        for pin, handler in ((self.DIO0, dio0_irq_handler), (self.DIO1, dio1_irq_handler), (self.DIO3, dio3_irq_handler)):
+            if handler is None:
+                continue
+            registered = pin in self.irq_handlers
+            self.irq_handlers[pin] = handler
+            if not registered:
+                self.transport.add_event_detect(pin, self._on_edge)
+
+    def _on_edge(self, channel):
+        handler = self.irq_handlers.get(channel)
+        if handler is not None:
+            handler(channel)
+
+    def pin_write (self, pin, value):
+        self.transport.output(pin, value)
+
+    def pin_read (self, pin):
+        return self.transport.input(pin)
+
+    def pin_reset(self, pin):
+        self.pin_write(pin, 1)
         time.sleep(0.1)
-        RPI_BOARD.pin_write(pin, 0)
+        self.pin_write(pin, 0)
         time.sleep(0.1)
 
-    @staticmethod
-    def pin_reset_inverse(pin):
-        RPI_BOARD.pin_write(pin, 0)
+    def pin_reset_inverse(self, pin):
+        self.pin_write(pin, 0)
         time.sleep(0.1)
-        RPI_BOARD.pin_write(pin, 1)
+        self.pin_write(pin, 1)
         time.sleep(0.1)
 
 
 
 
-    @staticmethod
-    def SPI_write_buffer(reg_addr, buffer):
+    def SPI_write_buffer(self, reg_addr, buffer):
         if type(buffer) is str:
             buffer = list(map(ord, buffer))
         if reg_addr > 0xFF or any(el > 0xFF for el in buffer):
             logging.error("Address not within range or values overflow")
 
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 0)
-        reg_addr |= 0x80
-        RPI_BOARD.SPI.xfer2([reg_addr] + buffer)[1]
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 1)
+        with self.transport.lock:
+            self.pin_write(self.NSS, 0)
+            self.SPI_transactions += 1
+            try:
+                reg_addr |= 0x80
+                self.transport.xfer2([reg_addr] + buffer)[1]
+            finally:
+                self.pin_write(self.NSS, 1)
 
-    @staticmethod
-    def SPI_read_buffer(reg_addr, length):
+    def SPI_read_buffer(self, reg_addr, length):
         if reg_addr > 0xFF:
             logging.error("Address not within range")
             return None
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 0)
-        reg_addr &= 0x7F
-        ret = RPI_BOARD.SPI.xfer2([reg_addr] + [0x00] * length)
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 1)
+        with self.transport.lock:
+            self.pin_write(self.NSS, 0)
+            self.SPI_transactions += 1
+            try:
+                reg_addr &= 0x7F
+                ret = self.transport.xfer2([reg_addr] + [0x00] * length)
+            finally:
+                self.pin_write(self.NSS, 1)
         return ret
 
-    @staticmethod
-    def SPI_write_register(reg_addr, value):
+    def SPI_write_registers(self, reg_addr, values):
+        """Burst write of consecutive registers, SX127x auto-increments address after each byte"""
+        values = list(values)
+        if reg_addr + len(values) - 1 > 0x7F or any(el > 0xFF for el in values):
+            logging.error("Address range not within range or values overflow")
+        with self.transport.lock:
+            self.pin_write(self.NSS, 0)
+            self.SPI_transactions += 1
+            try:
+                reg_addr |= 0x80
+                self.transport.xfer2([reg_addr] + values)
+            finally:
+                self.pin_write(self.NSS, 1)
+
+    def SPI_read_registers(self, first_reg_addr, last_reg_addr):
+        """Burst read of registers first_reg_addr..last_reg_addr (inclusive), returns only register values"""
+        if last_reg_addr > 0x7F or first_reg_addr > last_reg_addr:
+            logging.error("Address range not within range")
+            return None
+        with self.transport.lock:
+            self.pin_write(self.NSS, 0)
+            self.SPI_transactions += 1
+            try:
+                first_reg_addr &= 0x7F
+                ret = self.transport.xfer2([first_reg_addr] + [0x00] * (last_reg_addr - first_reg_addr + 1))
+            finally:
+                self.pin_write(self.NSS, 1)
+        return ret[1:]
+
+    def SPI_write_register(self, reg_addr, value):
         if reg_addr > 0xFF or value > 0xFF:
             logging.error("Address not within range or values overflow")
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 0)
-        reg_addr |= 0x80
-        RPI_BOARD.SPI.xfer([reg_addr, value])[1]
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 1)
+        with self.transport.lock:
+            self.pin_write(self.NSS, 0)
+            self.SPI_transactions += 1
+            try:
+                reg_addr |= 0x80
+                self.transport.xfer([reg_addr, value])[1]
+            finally:
+                self.pin_write(self.NSS, 1)
 
-    @staticmethod
-    def SPI_read_register(reg_addr):
+    def SPI_read_register(self, reg_addr):
         if reg_addr > 0xFF:
             logging.error("Address not within range")
             return None
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 0)
-        reg_addr &= 0x7F
-        ret = RPI_BOARD.SPI.xfer([reg_addr, 0x00])
-        RPI_BOARD.pin_write(RPI_BOARD.NSS, 1)
+        with self.transport.lock:
+            self.pin_write(self.NSS, 0)
+            self.SPI_transactions += 1
+            try:
+                reg_addr &= 0x7F
+                ret = self.transport.xfer([reg_addr, 0x00])
+            finally:
+                self.pin_write(self.NSS, 1)
         return ret
-
-
-
@@ -0,0 +1,107 @@
+"""
+\file       session_store.py
+\author     Ladislav Stefka
+\brief      Persistent table of node sessions for warm restart of gateway
+            - journal file of JSON lines, one record per node state change (sessionid, address, params, state)
+            - node config is written only when its digest changes, later records carry the digest only
+            - journal is compacted to one record per node when it has COMPACT_RECORDS records
+            - load() replays journal, torn last line (crash while writing) is ignored
+\copyright
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+SESSION_FILE = "sessions.journal"
+COMPACT_RECORDS = 1000
+
+
+def config_digest(settings):
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class SessionStore:
+    """Sessions of joined nodes by address, checkpoints are appended by node workers (pool threads)"""
+
+    def __init__(self, path=SESSION_FILE, compact_records=COMPACT_RECORDS):
+        self.path = path
+        self.compact_records = compact_records
+        self.lock = threading.Lock()
+        self.sessions = self.load()
+        self.records = len(self.sessions)
+        self.compact()
+
+    def load(self):
+        sessions = {}
+        if not os.path.exists(self.path):
+            return sessions
+        with open(self.path) as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning("Session journal %s: line %d is not complete, ignored", self.path, number)
+                    continue
+                address = record["address"]
+                if record.get("removed"):
+                    sessions.pop(address, None)
+                    continue
+                previous = sessions.get(address)
+                if "config" not in record and previous is not None and previous["digest"] == record["digest"]:
+                    record["config"] = previous["config"]
+                sessions[address] = record
+        return sessions
+
+    def _append(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+        self.records += 1
+        if self.records >= self.compact_records:
+            self.file.close()
+            self.compact()
+
+    def compact(self):
+        """Rewrites journal with one record per session"""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for record in self.sessions.values():
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.records = len(self.sessions)
+        self.file = open(self.path, "a")
+
+    def checkpoint(self, node):
+        """Stores session of node, config settings are written only when they changed"""
+        params = dict(node.params.__dict__)
+        settings = dict(node.config.__dict__)
+        digest = config_digest(settings)
+        record = dict(address=params["address"], sessionid=params["sessionid"], params=params,
+                      digest=digest, state=int(node.state), time=time.time())
+        with self.lock:
+            previous = self.sessions.get(record["address"])
+            self.sessions[record["address"]] = dict(record, config=settings)
+            if previous is None or previous["digest"] != digest:
+                record["config"] = settings
+            self._append(record)
+
+    def remove(self, address, sessionid=None):
+        """Removes session of address, only if it is session sessionid when given"""
+        with self.lock:
+            record = self.sessions.get(address)
+            if record is None or sessionid is not None and record["sessionid"] != sessionid:
+                return
+            del self.sessions[address]
+            self._append(dict(address=address, removed=True))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,151 @@
+"""
+\file       spectrum_store.py
+\author     Ladislav Stefka
+\brief      Append only store of FFT spectra of one node
+            - memory mapped file of fixed size records (timestamp float64, nbins float32), little endian
+            - header with number of committed records, file grows by GROW_RECORDS records
+            - reads: latest, time range (binary search over timestamps), every Nth record
+            - memmap(path) maps records as NumPy structured array without parsing
+\copyright
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import sys
+import time
+
+import tools
+
+#magic, version, nbins, record size, committed records
+HEADER = struct.Struct("<4sHxxIIQ")
+HEADER_SIZE = 64
+MAGIC = b"FFTS"
+VERSION = 1
+TIMESTAMP = struct.Struct("<d")
+
+GROW_RECORDS = 256
+
+#directory of node stores, file per node and spectrum size
+SPECTRUM_DIR = "spectra"
+
+
+def record_dtype(nbins):
+    return tools.np.dtype([("timestamp", "<f8"), ("bins", "<f4", (nbins,))])
+
+
+def read_header(path):
+    """(nbins, record size, committed records) of store file"""
+    with open(path, "rb") as f:
+        magic, version, nbins, record_size, count = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("{} is not spectrum store file".format(path))
+    return nbins, record_size, count
+
+
+def memmap(path):
+    """Committed records of store file as read only NumPy structured array (timestamp, bins)"""
+    nbins, record_size, count = read_header(path)
+    return tools.np.memmap(path, dtype=record_dtype(nbins), mode="r", offset=HEADER_SIZE, shape=(count,))
+
+
+class SpectrumStore:
+    """Spectra of one node, single writer
+
+    Read methods return (timestamp, bins) records, bins are float32 typed arrays (see tools.typed_array).
+    """
+
+    def __init__(self, path, nbins):
+        self.path = path
+        self.nbins = nbins
+        self.record_size = TIMESTAMP.size + 4 * nbins
+        new = not os.path.exists(path)
+        self.file = open(path, "w+b" if new else "r+b")
+        if new:
+            self.file.write(HEADER.pack(MAGIC, VERSION, nbins, self.record_size, 0).ljust(HEADER_SIZE, b"\0"))
+            self.file.truncate(HEADER_SIZE + GROW_RECORDS * self.record_size)
+            self.count = 0
+        else:
+            stored_nbins, stored_record_size, self.count = read_header(path)
+            if stored_nbins != nbins:
+                raise ValueError("{} holds spectra of {} bins, not {}".format(path, stored_nbins, nbins))
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+
+    @classmethod
+    def for_node(cls, address, nbins, directory=SPECTRUM_DIR):
+        os.makedirs(directory, exist_ok=True)
+        return cls(os.path.join(directory, "{}_{}.fft".format(address, nbins)), nbins)
+
+    @property
+    def capacity(self):
+        return (len(self.mm) - HEADER_SIZE) // self.record_size
+
+    def _offset(self, index):
+        return HEADER_SIZE + index * self.record_size
+
+    def append(self, spectrum, timestamp=None):
+        """Appends spectrum (nbins float32 values, any buffer or sequence), record is committed by header count"""
+        capacity = self.capacity
+        if self.count == capacity:
+            self.mm.close()
+            self.file.truncate(self._offset(capacity + GROW_RECORDS))
+            self.mm = mmap.mmap(self.file.fileno(), 0)
+        offset = self._offset(self.count)
+        TIMESTAMP.pack_into(self.mm, offset, time.time() if timestamp is None else timestamp)
+        try:
+            data = memoryview(spectrum).cast("B")
+        except TypeError:
+            data = None
+        if data is None or len(data) != 4 * self.nbins or sys.byteorder == "big":
+            data = struct.pack("<{}f".format(self.nbins), *spectrum)
+        self.mm[offset + TIMESTAMP.size: offset + self.record_size] = data
+        self.count += 1
+        struct.pack_into("<Q", self.mm, HEADER.size - 8, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def timestamp(self, index):
+        return TIMESTAMP.unpack_from(self.mm, self._offset(index))[0]
+
+    def record(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("spectrum record out of range")
+        offset = self._offset(index)
+        bins = tools.typed_array(self.mm[offset + TIMESTAMP.size: offset + self.record_size], "f", self.nbins)
+        return self.timestamp(index), bins
+
+    def latest(self):
+        return self.record(-1) if self.count else None
+
+    def range(self, start, end):
+        """Records with start <= timestamp < end"""
+        timestamps = _Timestamps(self)
+        return [self.record(i) for i in range(bisect.bisect_left(timestamps, start), bisect.bisect_left(timestamps, end))]
+
+    def every_nth(self, n, first=0):
+        return [self.record(i) for i in range(first, self.count, n)]
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+
+class _Timestamps:
+    """Timestamps of store as sequence for bisect (records are appended in time order)"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        return self.store.timestamp(index)
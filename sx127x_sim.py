@@ -0,0 +1,279 @@
+"""
+\file       sx127x_sim.py
+\author     Ladislav Stefka
+\brief      Software model of SX1272/SX1276 LoRa module behind RPI_BOARD transport interface
+            - register file with address auto-increment and FIFO
+            - RX continuous / TX / CAD modes with DIO0 callbacks (rx done, tx done, cad done)
+            - injectable received frames with configurable airtime
+            - runs gateway without Raspberry Pi, e.g. rb.RPI_BOARD(SimulatedSX127X("SX1276"))
+\copyright
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from rpi_board import RPI_BOARD
+
+
+#register addresses used by the model (LoRa mode), see lora_module.REG_LORA
+REG_FIFO = 0x00
+REG_OP_MODE = 0x01
+REG_FIFO_ADDR_PTR = 0x0D
+REG_FIFO_TX_BASE_ADDR = 0x0E
+REG_FIFO_RX_BASE_ADDR = 0x0F
+REG_FIFO_RX_CURR_ADDR = 0x10
+REG_IRQ_FLAGS = 0x12
+REG_RX_NB_BYTES = 0x13
+REG_PKT_SNR_VALUE = 0x19
+REG_PKT_RSSI_VALUE = 0x1A
+REG_RSSI_VALUE = 0x1B
+REG_PREAMBLE_LSB = 0x21
+REG_PAYLOAD_LENGTH = 0x22
+REG_DIO_MAPPING_1 = 0x40
+REG_VERSION = 0x42
+
+MODE_SLEEP = 0
+MODE_STDBY = 1
+MODE_TX = 3
+MODE_RXCONT = 5
+MODE_RXSINGLE = 6
+MODE_CAD = 7
+
+IRQ_RX_DONE = 0x40
+IRQ_CRC_ERROR = 0x20
+IRQ_VALID_HEADER = 0x10
+IRQ_TX_DONE = 0x08
+IRQ_CAD_DONE = 0x04
+IRQ_CAD_DETECTED = 0x01
+
+VERSIONS = {"SX1272": 0x22, "SX1276": 0x12}
+RSSI_COOR = {"SX1272": 139, "SX1276": 157}
+
+
+class SimulatedSX127X:
+    """SX127x register file model implementing RPI_BOARD transport interface
+
+    IRQ callbacks are called from one event thread, as RPi.GPIO does.
+    """
+
+    def __init__(self, modemType="SX1276", tx_airtime=0.0, cad_time=0.001, pins=RPI_BOARD):
+        self.type = modemType
+        self.tx_airtime = tx_airtime
+        self.cad_time = cad_time
+        self.dio0 = pins.DIO0
+        self.rst = pins.RST
+        #SX1272 reset pin is active high, SX1276 active low
+        self.rst_idle = 0 if modemType == "SX1272" else 1
+
+        self.lock = threading.RLock()
+        self.callbacks = {}
+        self.pins = {}
+
+        self.transmitted = []           #payloads sent by gateway
+        self.on_transmit = None         #optional hook on_transmit(payload)
+        self.received_frames = 0
+        self.lost_frames = 0            #frames injected while not in RX mode
+        self.on_air = []                #(start, end) of injected frames, for CAD
+
+        self._events = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._event_loop, name="SX127X_SIM", daemon=True)
+        self._thread.start()
+
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.regs = bytearray(0x80)
+            self.fifo = bytearray(0x100)
+            self.regs[REG_OP_MODE] = 0x09
+            self.regs[REG_FIFO_TX_BASE_ADDR] = 0x80
+            self.regs[REG_PREAMBLE_LSB] = 0x08
+            self.regs[REG_VERSION] = VERSIONS[self.type]
+            self._tx_id = 0
+
+    @property
+    def mode(self):
+        return self.regs[REG_OP_MODE] & 0x07
+
+    #region Transport interface
+    def setup_output(self, pin):
+        self.pins[pin] = 0
+
+    def setup_input(self, pin):
+        self.pins[pin] = 0
+
+    def output(self, pin, value):
+        previous = self.pins.get(pin)
+        self.pins[pin] = value
+        if pin == self.rst and value == self.rst_idle and previous != value:
+            self.reset()
+
+    def input(self, pin):
+        return self.pins.get(pin, 0)
+
+    def add_event_detect(self, pin, callback):
+        self.callbacks[pin] = callback
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def spi_open(self, bus, channel, speed):
+        pass
+
+    def xfer(self, data):
+        return self.xfer2(data)
+
+    def xfer2(self, data):
+        addr = data[0] & 0x7F
+        write = data[0] & 0x80
+        ret = [0x00]
+        with self.lock:
+            for value in data[1:]:
+                if write:
+                    self._write(addr, value)
+                    ret.append(0x00)
+                else:
+                    ret.append(self._read(addr))
+                #FIFO address does not auto-increment, FIFO_ADDR_PTR does
+                if addr != REG_FIFO:
+                    addr = (addr + 1) & 0x7F
+        return ret
+
+    def cleanup(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+    #endregion
+
+    #region Register file
+    def _read(self, addr):
+        if addr == REG_FIFO:
+            ptr = self.regs[REG_FIFO_ADDR_PTR]
+            self.regs[REG_FIFO_ADDR_PTR] = (ptr + 1) & 0xFF
+            return self.fifo[ptr]
+        return self.regs[addr]
+
+    def _write(self, addr, value):
+        if addr == REG_FIFO:
+            ptr = self.regs[REG_FIFO_ADDR_PTR]
+            self.regs[REG_FIFO_ADDR_PTR] = (ptr + 1) & 0xFF
+            self.fifo[ptr] = value
+        elif addr == REG_IRQ_FLAGS:
+            self.regs[addr] &= ~value & 0xFF
+        elif addr == REG_VERSION:
+            pass
+        elif addr == REG_OP_MODE:
+            previous = self.mode
+            self.regs[addr] = value
+            if self.mode == MODE_TX and previous != MODE_TX:
+                self._start_tx()
+            elif self.mode == MODE_CAD and previous != MODE_CAD:
+                self.schedule(self.cad_time, self._cad_done)
+        else:
+            self.regs[addr] = value
+
+    def _dio0_mapping(self):
+        return self.regs[REG_DIO_MAPPING_1] >> 6 & 0x03
+
+    def _raise_dio0(self):
+        self.pins[self.dio0] = 1
+        callback = self.callbacks.get(self.dio0)
+        if callback is not None:
+            callback(self.dio0)
+        self.pins[self.dio0] = 0
+    #endregion
+
+    #region TX
+    def _start_tx(self):
+        base = self.regs[REG_FIFO_TX_BASE_ADDR]
+        length = self.regs[REG_PAYLOAD_LENGTH]
+        payload = bytes(self.fifo[(base + i) & 0xFF] for i in range(length))
+        self._tx_id += 1
+        self.schedule(self.tx_airtime, self._tx_done, self._tx_id, payload)
+
+    def _tx_done(self, tx_id, payload):
+        with self.lock:
+            if self.mode != MODE_TX or tx_id != self._tx_id:
+                return
+            self.regs[REG_IRQ_FLAGS] |= IRQ_TX_DONE
+            self.regs[REG_OP_MODE] = (self.regs[REG_OP_MODE] & ~0x07) | MODE_STDBY
+        self.transmitted.append(payload)
+        if self.on_transmit is not None:
+            self.on_transmit(payload)
+        if self._dio0_mapping() == 1:
+            self._raise_dio0()
+    #endregion
+
+    #region CAD
+    def channel_busy(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.on_air = [(start, end) for start, end in self.on_air if end > now]
+            return any(start <= now for start, end in self.on_air)
+
+    def _cad_done(self):
+        busy = self.channel_busy()
+        with self.lock:
+            if self.mode != MODE_CAD:
+                return
+            self.regs[REG_IRQ_FLAGS] |= IRQ_CAD_DONE | (IRQ_CAD_DETECTED if busy else 0)
+            self.regs[REG_OP_MODE] = (self.regs[REG_OP_MODE] & ~0x07) | MODE_STDBY
+        if self._dio0_mapping() == 2:
+            self._raise_dio0()
+    #endregion
+
+    #region RX
+    def inject_frame(self, payload, snr=10.0, rssi=-60, airtime=0.0, crc_error=False):
+        """Frame arrives at antenna now and is received after airtime seconds"""
+        now = time.monotonic()
+        with self.lock:
+            self.on_air.append((now, now + airtime))
+        self.schedule(airtime, self._rx_done, bytes(payload), snr, rssi, crc_error)
+
+    def _rx_done(self, payload, snr, rssi, crc_error):
+        with self.lock:
+            if self.mode not in (MODE_RXCONT, MODE_RXSINGLE):
+                self.lost_frames += 1
+                return
+            base = self.regs[REG_FIFO_RX_BASE_ADDR]
+            for i, b in enumerate(payload):
+                self.fifo[(base + i) & 0xFF] = b
+            self.regs[REG_FIFO_RX_CURR_ADDR] = base
+            self.regs[REG_RX_NB_BYTES] = len(payload)
+            self.regs[REG_PKT_SNR_VALUE] = int(round(snr * 4)) & 0xFF
+            self.regs[REG_PKT_RSSI_VALUE] = max(0, min(0xFF, rssi + RSSI_COOR[self.type]))
+            self.regs[REG_RSSI_VALUE] = self.regs[REG_PKT_RSSI_VALUE]
+            self.regs[REG_IRQ_FLAGS] |= IRQ_RX_DONE | IRQ_VALID_HEADER | (IRQ_CRC_ERROR if crc_error else 0)
+            if self.mode == MODE_RXSINGLE:
+                self.regs[REG_OP_MODE] = (self.regs[REG_OP_MODE] & ~0x07) | MODE_STDBY
+            self.received_frames += 1
+        if self._dio0_mapping() == 0:
+            self._raise_dio0()
+    #endregion
+
+    #region Event thread
+    def schedule(self, delay, func, *args):
+        with self._cond:
+            heapq.heappush(self._events, (time.monotonic() + delay, next(self._seq), func, args))
+            self._cond.notify()
+
+    def _event_loop(self):
+        while True:
+            with self._cond:
+                while self._running and (not self._events or self._events[0][0] > time.monotonic()):
+                    timeout = self._events[0][0] - time.monotonic() if self._events else None
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                _, _, func, args = heapq.heappop(self._events)
+            try:
+                func(*args)
+            except Exception:
+                logging.exception("SX127X simulator event failed")
+    #endregion
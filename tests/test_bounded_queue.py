@@ -0,0 +1,66 @@
+import threading
+import time
+from queue import Empty
+
+import pytest
+
+import bounded_queue as bq
+
+
+def fill(queue, items):
+    return [queue.put(item) for item in items]
+
+
+def test_drop_newest():
+    queue = bq.BoundedQueue(3, bq.DROP_NEWEST)
+    assert fill(queue, range(5)) == [True, True, True, False, False]
+    assert [queue.get_nowait() for _ in range(3)] == [0, 1, 2]
+    assert queue.dropped == 2 and queue.high_water == 3
+
+
+def test_drop_oldest():
+    queue = bq.BoundedQueue(3, bq.DROP_OLDEST)
+    assert all(fill(queue, range(5)))
+    assert [queue.get_nowait() for _ in range(3)] == [2, 3, 4]
+    with pytest.raises(Empty):
+        queue.get_nowait()
+
+
+def test_block_waits_for_consumer_then_drops():
+    queue = bq.BoundedQueue(1, bq.BLOCK, timeout=0.05)
+    queue.put("a")
+    start = time.monotonic()
+    assert not queue.put("b")
+    assert time.monotonic() - start >= 0.05
+
+    threading.Timer(0.02, queue.get).start()
+    assert queue.put("c", timeout=1.0)
+    assert queue.get_nowait() == "c"
+
+
+def test_priority_sheds_lowest_priority_oldest_first():
+    queue = bq.BoundedQueue(3, bq.PRIORITY, priority=lambda item: item[0])
+    fill(queue, [(0, "a"), (1, "b"), (0, "c")])
+    assert queue.put((1, "d"))
+    assert not queue.put((0, "e"))
+    assert [queue.get_nowait()[1] for _ in range(3)] == ["b", "c", "d"]
+    assert queue.dropped == 2
+    assert not queue.priorities
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        bq.BoundedQueue(1, "lifo")
+    with pytest.raises(ValueError):
+        bq.BoundedQueue(1, bq.PRIORITY)
+
+
+def test_take_prefers_highest_priority():
+    q = bq.BoundedQueue(4, bq.PRIORITY, priority=lambda item: item[0])
+    for item in ((0, "a"), (1, "b"), (0, "c"), (1, "d")):
+        q.put(item)
+    assert q.take(lambda item: item[1] != "b") == (1, "d")
+    assert q.take(lambda item: item[0] == 0) == (0, "a")
+    assert q.take(lambda item: False) is None
+    assert [q.get_nowait() for _ in range(2)] == [(1, "b"), (0, "c")]
+    assert not q.priorities
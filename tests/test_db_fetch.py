@@ -0,0 +1,68 @@
+import http.server
+import json
+import threading
+import urllib.parse
+
+import pytest
+
+import config as cfg
+import params as prm
+
+ROWS = {
+    "/node_params": [{"idloranode": 7, "address": "0x00000001", "sessionid": "0x2a"}],
+    "/config": [{"code": "node.sf", "datatype": "int", "value": "9"}],
+}
+
+
+class DBHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        body = json.dumps(ROWS.get(url.path, [])).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), DBHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:{}".format(server.server_address[1])
+    monkeypatch.setattr(prm, "URL_PARAMS", base + "/node_params")
+    monkeypatch.setattr(cfg, "URL_CONFIG", base + "/config")
+    yield base
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_params_blocks_until_filled(db):
+    params = prm.Params()
+    assert prm.Params.HTTP_get_params_fromDB(params, "0x00000001") is params
+    assert params.idloranode == 7
+    assert params.sessionid == 0x2a
+
+
+def test_fetch_params_async_returns_future(db):
+    params = prm.Params()
+    future = prm.Params.HTTP_fetch_params_async(params, "0x00000001")
+    assert future.result(timeout=5) is params
+    assert params.sessionid == 0x2a
+
+
+def test_get_params_raises_when_node_missing(db, monkeypatch):
+    monkeypatch.setattr(prm, "URL_PARAMS", db + "/missing")
+    with pytest.raises(Exception, match="No DB item"):
+        prm.Params.HTTP_get_params_fromDB(prm.Params(), "0x00000009")
+
+
+def test_get_config_blocks_until_filled(db):
+    config = cfg.Config()
+    assert cfg.Config.HTTP_get_config_fromDB(config, 7) is config
+    assert config.sf == 9
+    assert config.config_fetched
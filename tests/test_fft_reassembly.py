@@ -0,0 +1,95 @@
+import queue
+import struct
+import types
+
+import pytest
+
+import fft_reassembly
+import lora_node_worker as lnw
+import radio_packet as rp
+import worker_pool
+
+
+def chunk(seqnum):
+    return rp.decode(struct.pack("<BBBBBI", rp.FFTChunkData.CMD, 0x01, rp.FFTChunkData.DATA_TYPE, seqnum, 32, 0) +
+                     struct.pack("<32f", *[float(seqnum * 32 + i) for i in range(32)]))
+
+
+def test_missing_chunks_are_rerequested_by_mask():
+    fft = fft_reassembly.FFTReassembler(2048, timeout=1.0)
+    fft.start(0.0)
+    for seqnum in reversed(range(fft.nchunks)):
+        if seqnum not in (2, 17, 31):
+            assert not fft.add(chunk(seqnum), 0.1)
+    fft.add(chunk(5), 0.2)
+    assert fft.duplicates == 1
+
+    missing = fft.on_timeout(1.5)
+    assert missing == [2, 17, 31]
+    req = rp.FFTChunkSelectRequest()
+    req.seqnums = missing
+    assert req.chunk_mask == 1 << 2 | 1 << 17 | 1 << 31
+
+    for seqnum in req.seqnums:
+        fft.add(chunk(seqnum), 1.6)
+    assert fft.complete
+    assert list(fft.spectrum()) == [float(i) for i in range(1024)]
+
+
+def test_spectrum_fails_after_retries():
+    fft = fft_reassembly.FFTReassembler(128, timeout=1.0, max_retries=2)
+    fft.start(0.0)
+    fft.add(chunk(0), 0.1)
+    assert fft.on_timeout(1.2) == [1]
+    assert fft.on_timeout(2.3) == [1]
+    assert fft.on_timeout(3.4) is None
+    assert not fft.complete
+
+
+@pytest.fixture
+def worker():
+    node = lnw.NodeWorker(queue.Queue(), {}, pool=worker_pool.WorkerPool(threads=1),
+                          endpoint=types.SimpleNamespace(unregister=lambda address, node: None))
+    node.config.fft_samples_num = "N_2048"
+    node.config.fft_adc_divider = "ASYNC_DIV1"
+    node.config.fft_adc_sampling_time = "1CYCLE5"
+    yield node
+    node.pool.timers.cancel(node.fft_timer)
+
+
+def test_timeout_rerequests_whole_spectrum_by_default(worker):
+    worker.send_fft_req()
+    assert type(worker.tx_radio_queue.get_nowait()) is rp.FFTChunkRequest
+    for seqnum in range(worker.fft.nchunks):
+        if seqnum != 3:
+            worker.fft.add(chunk(seqnum))
+
+    worker.send_fft_req(worker.fft.missing())
+    assert type(worker.tx_radio_queue.get_nowait()) is rp.FFTChunkRequest
+    #chunks of full resend received already are duplicates
+    for seqnum in range(worker.fft.nchunks):
+        worker.fft.add(chunk(seqnum))
+    assert worker.fft.complete
+    assert worker.fft.duplicates == worker.fft.nchunks - 1
+
+
+def test_missing_chunks_are_selected_when_node_supports_it(worker):
+    worker.config.fft_chunk_select = True
+    worker.send_fft_req()
+    worker.tx_radio_queue.get_nowait()
+    worker.send_fft_req([3, 7])
+    req = worker.tx_radio_queue.get_nowait()
+    assert isinstance(req, rp.FFTChunkSelectRequest)
+    assert req.seqnums == [3, 7]
+
+
+def test_spectrum_store_is_closed_on_stop(worker, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    worker.params.address = "0x00000001"
+    worker.send_fft_req()
+    worker.store_spectrum(worker.fft.spectrum())
+    store = worker.spectra
+    assert len(store) == 1
+    worker.stop()
+    assert worker.spectra is None
+    assert store.mm.closed
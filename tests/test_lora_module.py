@@ -0,0 +1,83 @@
+import pytest
+
+import lora_module as lm
+import rpi_board as rb
+import sx127x_sim
+
+
+@pytest.fixture
+def module():
+    transport = sx127x_sim.SimulatedSX127X("SX1276")
+    m = lm.SX127X_Module(rb.RPI_BOARD(transport), "SX1276")
+    yield m
+    transport.cleanup()
+
+
+def raise_flags(module, value):
+    module.rpi_board.transport.regs[sx127x_sim.REG_IRQ_FLAGS] |= value
+
+
+def test_event_on_two_dios_is_dispatched_once(module):
+    calls = []
+    module.set_irq_handler('cad_done', calls.append)
+    raise_flags(module, sx127x_sim.IRQ_CAD_DONE | sx127x_sim.IRQ_CAD_DETECTED)
+
+    #cad_done on DIO0, cad_detected on DIO1
+    module._dispatch_irq(module.rpi_board.DIO0)
+    module._dispatch_irq(module.rpi_board.DIO1)
+
+    assert len(calls) == 1
+    assert calls[0]['cad_detected'] == 1
+    assert module.irq_unhandled == 0
+    assert module.irq_coalesced == 1
+    assert module.rpi_board.transport.regs[sx127x_sim.REG_IRQ_FLAGS] == 0
+
+
+def test_flags_without_handler_are_cleared_and_counted(module):
+    raise_flags(module, sx127x_sim.IRQ_TX_DONE)
+    module._dispatch_irq(module.rpi_board.DIO0)
+
+    assert module.irq_unhandled == 1
+    assert module.rpi_board.transport.regs[sx127x_sim.REG_IRQ_FLAGS] == 0
+
+
+def test_crc_error_goes_to_rx_done_handler(module):
+    records = []
+    module.set_irq_handler('rx_done', lambda flags: records.append(module.SX127X_harvest_rx(flags)))
+    raise_flags(module, sx127x_sim.IRQ_RX_DONE | sx127x_sim.IRQ_CRC_ERROR)
+    module._dispatch_irq(module.rpi_board.DIO0)
+
+    assert len(records) == 1
+    assert records[0].crc_error
+    assert records[0].payload is None
+
+
+def test_tx_between_profile_switches_is_diff_only():
+    import packet_forwarder as pf
+    import radio_packet
+
+    transport = sx127x_sim.SimulatedSX127X("SX1276")
+    board = rb.RPI_BOARD(transport)
+    m = lm.SX127X_Module(board, "SX1276")
+    m.SX127X_module_setup(pf.config)
+    join = m.profile
+    sf7 = join.derive("SF7", spreading_factor=7, lr_optimize=0)
+    frame = radio_packet.JoinReply()
+    try:
+        m.set_tx(lambda flags: None, frame)
+        assert m.profile is join
+        assert m.profile_changes == {lm.REG_LORA.PAYLOAD_LENGTH: len(frame)}
+
+        start = board.SPI_transactions
+        runs = m.SX127X_apply_profile(sf7)
+        #STDBY mode write + register bursts, no burst read of whole image
+        assert board.SPI_transactions - start == runs + 1
+        assert transport.regs[lm.REG_LORA.PAYLOAD_LENGTH] == pf.config["payload_len"]
+
+        m.set_tx(lambda flags: None, frame)
+        start = board.SPI_transactions
+        runs = m.SX127X_apply_profile(join)
+        assert board.SPI_transactions - start == runs + 1
+        assert m.profile_changes == {}
+    finally:
+        transport.cleanup()
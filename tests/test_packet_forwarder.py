@@ -0,0 +1,90 @@
+import collections
+import struct
+import time
+
+import pytest
+
+import lora_node_worker as lnw
+import packet_forwarder as pf
+import radio_packet
+import session_store
+import udp_endpoint
+import worker_pool
+
+ADDRESS = "0x00001234"
+
+
+def join_request(uid, time=0):
+    frame = struct.pack("<BBIIBB", radio_packet.JoinRequest.CMD, 0x00, uid, time, 0, 1)
+    return radio_packet.decode(frame), frame
+
+
+def wait_idle(node, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while (node.inbox or node.scheduled) and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def gateway(tmp_path, monkeypatch):
+    pool = worker_pool.shared_pool()
+    endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0), server=("127.0.0.1", 9), batch=False)
+    sessions = session_store.SessionStore(str(tmp_path / "sessions.journal"))
+    monkeypatch.setattr(pf.Gateway, "endpoint", endpoint)
+    monkeypatch.setattr(pf.Gateway, "sessions", sessions)
+    monkeypatch.setattr(pf.Gateway, "nodes", {})
+    monkeypatch.setattr(pf.Gateway, "nat", {})
+    monkeypatch.setattr(pf.Gateway, "recent_frames", collections.OrderedDict())
+    yield pf.Gateway
+    for node in pf.Gateway.nodes.values():
+        node.stop()
+    endpoint.close()
+    sessions.close()
+
+
+def joined(node, sessionid):
+    """Node info reply of Node-RED as processed by worker"""
+    wait_idle(node)
+    node.params.address = ADDRESS
+    node.params.sessionid = sessionid
+    node.nat[sessionid] = ADDRESS
+    node.endpoint.register(ADDRESS, node)
+    node.state = lnw.States.JOINED
+    node.checkpoint()
+
+
+def test_rejoin_stops_previous_worker(gateway):
+    pf.dispatch_packet(*join_request(0x1234, time=1))
+    first = gateway.nodes[ADDRESS]
+    joined(first, 0x34)
+
+    pf.dispatch_packet(*join_request(0x1234, time=2))
+    second = gateway.nodes[ADDRESS]
+    assert second is not first
+    assert not first.is_alive()
+    assert first.state == lnw.States.STOPPED
+    assert 0x34 not in gateway.nat
+    joined(second, 0x35)
+
+    #liveness expiry of replaced worker queued before it was stopped
+    first.on_liveness_timeout()
+    first.checkpoint()
+    assert gateway.sessions.sessions[ADDRESS]["sessionid"] == 0x35
+    assert gateway.nat[0x35] == ADDRESS
+
+    #Node-RED reset commands still reach live worker
+    first.stop()
+    assert gateway.endpoint.routes[ADDRESS] is second
+
+
+def test_frame_is_deduplicated_only_across_radios(gateway):
+    radio0, radio1 = object(), object()
+    frame = b"\x30\x34\x01"
+    assert not pf.is_duplicate(frame, radio0, now=0.0)
+    #retransmission heard by the same radio is dispatched
+    assert not pf.is_duplicate(frame, radio0, now=0.1)
+    assert pf.is_duplicate(frame, radio1, now=0.2)
+    assert not pf.is_duplicate(frame, radio1, now=0.7)
+    #expired frames are pruned oldest first
+    assert not pf.is_duplicate(b"\x30\x35\x01", radio0, now=1.5)
+    assert list(gateway.recent_frames) == [b"\x30\x35\x01"]
@@ -0,0 +1,39 @@
+import pytest
+
+import radio_packet as rp
+
+
+def test_fft_chunk_request_layout_is_unchanged():
+    req = rp.FFTChunkRequest()
+    req.sessionid = 0x12
+    assert req.rawdata == bytes([rp.FFTChunkRequest.CMD, 0x12, rp.FFTChunkRequest.DATA_TYPE])
+
+
+def test_fft_chunk_select_request_mask():
+    req = rp.FFTChunkSelectRequest()
+    req.sessionid = 0x12
+    req.seqnums = [0, 3, 31]
+    assert req.chunk_mask == 1 | 1 << 3 | 1 << 31
+    assert req.seqnums == [0, 3, 31]
+
+    decoded = rp.RadioPacket(req.rawdata)
+    assert isinstance(decoded, rp.FFTChunkSelectRequest)
+    assert decoded.seqnums == [0, 3, 31]
+
+
+@pytest.mark.parametrize("seqnum", [32, 40, -1])
+def test_fft_chunk_select_request_rejects_seqnum_out_of_mask(seqnum):
+    req = rp.FFTChunkSelectRequest()
+    with pytest.raises(ValueError):
+        req.seqnums = [1, seqnum]
+    assert req.chunk_mask == 0
+
+
+def test_packet_edited_after_data_set_is_encoded_again():
+    packet = rp.TemperatureData()
+    packet.nsamples = 1
+    packet.data = bytes([0x01, 0x00, 0x00, 0x00, 0x02])
+    assert packet.time == 1
+    packet.seqnum = 7
+    assert packet.rawdata[3] == 7
+    assert rp.decode(packet.rawdata).fields() == packet.fields()
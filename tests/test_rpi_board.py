@@ -0,0 +1,72 @@
+import sys
+import threading
+import types
+
+import pytest
+
+import rpi_board as rb
+
+
+class FakeSpiDev:
+    opened = 0
+
+    def open(self, bus, channel):
+        FakeSpiDev.opened += 1
+
+    def close(self):
+        FakeSpiDev.opened -= 1
+
+    def xfer2(self, data):
+        raise OSError("SPI transfer failed")
+
+
+@pytest.fixture
+def hardware(monkeypatch):
+    calls = dict(setmode=0, cleanup=0, output={})
+    GPIO = types.SimpleNamespace(BCM=11, OUT=0, IN=1, PUD_DOWN=21,
+                                 setmode=lambda mode: calls.__setitem__("setmode", calls["setmode"] + 1),
+                                 setup=lambda *args, **kwargs: None, output=lambda pin, value: calls["output"].__setitem__(pin, value),
+                                 cleanup=lambda: calls.__setitem__("cleanup", calls["cleanup"] + 1))
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = GPIO
+    monkeypatch.setitem(sys.modules, "RPi", rpi)
+    monkeypatch.setitem(sys.modules, "RPi.GPIO", GPIO)
+    monkeypatch.setitem(sys.modules, "spidev", types.SimpleNamespace(SpiDev=FakeSpiDev))
+    FakeSpiDev.opened = 0
+    return calls
+
+
+def test_boards_share_spi_and_gpio_setup(hardware):
+    first = rb.RPI_BOARD()
+    second = rb.RPI_BOARD(pins=rb.RadioPins(NSS=16, DIO0=5, DIO1=6, DIO3=13, RST=12))
+
+    assert first.transport.spi is second.transport.spi
+    assert FakeSpiDev.opened == 1
+    assert hardware["setmode"] == 1
+
+    first.clean()
+    assert hardware["cleanup"] == 0 and FakeSpiDev.opened == 1
+    second.clean()
+    assert hardware["cleanup"] == 1 and FakeSpiDev.opened == 0
+    assert rb.HardwareTransport.users == 0
+
+
+def test_failed_transfer_releases_bus(hardware):
+    board = rb.RPI_BOARD()
+    try:
+        with pytest.raises(OSError):
+            board.SPI_read_registers(0x00, 0x10)
+        assert hardware["output"][board.NSS] == 1
+        #other radio (IRQ dispatch thread) gets the bus
+        acquired = []
+
+        def other_radio():
+            if board.transport.lock.acquire(timeout=1.0):
+                acquired.append(True)
+                board.transport.lock.release()
+        thread = threading.Thread(target=other_radio)
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+    finally:
+        board.clean()
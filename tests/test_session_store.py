@@ -0,0 +1,52 @@
+import types
+
+import session_store
+
+
+def node(address, sessionid, state=30, sf=12):
+    params = types.SimpleNamespace(address=address, sessionid=sessionid, idloranode=1)
+    config = types.SimpleNamespace(sf=sf)
+    return types.SimpleNamespace(params=params, config=config, state=state)
+
+
+def test_journal_replay_ignores_torn_last_line(tmp_path):
+    path = str(tmp_path / "sessions.journal")
+    store = session_store.SessionStore(path)
+    store.checkpoint(node("0x00000001", 0x01))
+    store.checkpoint(node("0x00000002", 0x02))
+    store.checkpoint(node("0x00000001", 0x01, sf=9))
+    store.close()
+    with open(path, "a") as f:
+        f.write('{"address":"0x00000002","sessi')
+
+    restored = session_store.SessionStore(path)
+    assert set(restored.sessions) == {"0x00000001", "0x00000002"}
+    assert restored.sessions["0x00000001"]["config"] == {"sf": 9}
+    assert restored.sessions["0x00000002"]["config"] == {"sf": 12}
+    restored.close()
+
+    #compacted on load, torn line is gone
+    with open(path) as f:
+        assert len(f.readlines()) == 2
+
+
+def test_config_is_written_only_when_changed(tmp_path):
+    path = str(tmp_path / "sessions.journal")
+    store = session_store.SessionStore(path)
+    store.checkpoint(node("0x00000001", 0x01, state=20))
+    store.checkpoint(node("0x00000001", 0x01, state=30))
+    store.close()
+    with open(path) as f:
+        lines = f.readlines()
+    assert '"config"' in lines[0] and '"config"' not in lines[1]
+    assert session_store.SessionStore(path).sessions["0x00000001"]["config"] == {"sf": 12}
+
+
+def test_remove_only_own_session(tmp_path):
+    store = session_store.SessionStore(str(tmp_path / "sessions.journal"))
+    store.checkpoint(node("0x00000001", 0x05))
+    store.remove("0x00000001", sessionid=0x04)
+    assert "0x00000001" in store.sessions
+    store.remove("0x00000001", sessionid=0x05)
+    assert "0x00000001" not in store.sessions
+    store.close()
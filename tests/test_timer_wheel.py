@@ -0,0 +1,55 @@
+import timer_wheel as tw
+
+
+def wheel():
+    w = tw.TimerWheel(resolution=0.01)
+    w.origin = 0.0
+    return w
+
+
+def schedule_at(w, tick, callback, *args):
+    """Timer expiring at tick, independent of wall clock"""
+    timer = tw.Timer(callback, args)
+    timer.expires = tick
+    with w.lock:
+        w.armed += 1
+        w._insert(timer)
+    return timer
+
+
+def test_timers_cascade_from_higher_levels():
+    w = wheel()
+    fired = []
+    ticks = [1, 63, 64, 65, 4095, 4096, 4097, 300000]
+    for tick in ticks:
+        schedule_at(w, tick, fired.append, tick)
+    assert len(w) == len(ticks)
+
+    for tick in ticks:
+        #nothing fires before its tick, timer fires on its tick
+        w.advance((tick - 1) * w.resolution + w.resolution / 2)
+        assert tick not in fired
+        w.advance(tick * w.resolution + w.resolution / 2)
+        assert fired[-1] == tick
+    assert fired == ticks
+    assert len(w) == 0
+
+
+def test_cancel_and_rearm():
+    w = tw.TimerWheel(resolution=0.01)
+    fired = []
+    timer = w.schedule(0.05, fired.append, 1)
+    w.cancel(timer)
+    assert not timer.armed and len(w) == 0
+    w.rearm(timer, 0.02)
+    assert timer.armed
+    w.advance(w.origin + 10.0)
+    assert fired == [1] and not timer.armed
+
+
+def test_timer_never_fires_early():
+    w = tw.TimerWheel(resolution=0.05)
+    fired = []
+    w.schedule(0.12, fired.append, 1)
+    w.advance(w.origin + 0.1)
+    assert not fired
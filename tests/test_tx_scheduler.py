@@ -0,0 +1,80 @@
+import packet_forwarder as pf
+import radio_packet
+import tx_scheduler
+
+#one sub-band with 1 s of airtime per hour
+SUBBANDS = [("test", 868.0, 868.6, 1.0 / 3600)]
+
+
+def test_tx_queue_stays_bounded_while_budget_is_exhausted():
+    queue = pf.TxQueue()
+    scheduler = tx_scheduler.DutyCycleScheduler(queue, lambda frame: 0.5, subbands=SUBBANDS, max_defer=7200.0)
+    now = 0.0
+    for _ in range(2):
+        queue.put(radio_packet.FFTChunkRequest())
+        frame = scheduler.next_frame(868.5, now)
+        assert frame is not None
+        scheduler.tx_started(frame, 868.5, now)
+
+    #join storm, no frame fits into budget
+    for i in range(200):
+        frame = radio_packet.JoinReply() if i % 10 == 0 else radio_packet.FFTChunkRequest()
+        queue.put(frame)
+        assert scheduler.next_frame(868.5, now) is None
+        assert len(queue) <= pf.TX_QUEUE_CAPACITY
+    assert scheduler.next_eligible == now + 3600.0
+    assert queue.dropped == 200 - pf.TX_QUEUE_CAPACITY - 1
+    #deferred head frame + queue
+    kept = [scheduler.head[0]] + [entry[2] for entry in queue.items]
+    assert sum(isinstance(frame, radio_packet.JoinReply) for frame in kept) == 20
+
+    #budget is back after window
+    assert scheduler.next_frame(868.5, now + 3600.0) is kept[0]
+
+
+def test_frame_over_budget_is_dropped():
+    queue = pf.TxQueue()
+    scheduler = tx_scheduler.DutyCycleScheduler(queue, lambda frame: 2.0, subbands=SUBBANDS)
+    queue.put(radio_packet.JoinReply())
+    assert scheduler.next_frame(868.5, 0.0) is None
+    assert scheduler.subbands[0].dropped == 1
+    assert not scheduler.has_pending()
+
+
+def test_frame_dropped_before_tx_does_not_use_budget():
+    queue = pf.TxQueue()
+    scheduler = tx_scheduler.DutyCycleScheduler(queue, lambda frame: 0.75, subbands=SUBBANDS)
+    queue.put(radio_packet.JoinReply())
+    queue.put(radio_packet.JoinReply())
+    #first frame is dropped by listen before talk, it never goes on air
+    assert scheduler.next_frame(868.5, 0.0) is not None
+    frame = scheduler.next_frame(868.5, 1.0)
+    assert frame is not None
+    scheduler.tx_started(frame, 868.5, 1.0)
+    assert scheduler.subbands[0].used == 0.75
+    assert scheduler.subbands[0].sent == 1
+
+
+def test_frames_go_ahead_of_deferred_frame():
+    queue = pf.TxQueue()
+    airtimes = {radio_packet.FFTChunkRequest: 0.6, radio_packet.JoinReply: 0.25, radio_packet.ConfigReply: 0.25}
+    scheduler = tx_scheduler.DutyCycleScheduler(queue, lambda frame: airtimes[type(frame)], subbands=SUBBANDS,
+                                                max_defer=7200.0)
+    for _ in range(2):
+        queue.put(radio_packet.FFTChunkRequest())
+    frame = scheduler.next_frame(868.5, 0.0)
+    scheduler.tx_started(frame, 868.5, 0.0)
+
+    #deferred FFT request does not block cheaper reply
+    join_reply = radio_packet.JoinReply()
+    queue.put(join_reply)
+    assert scheduler.next_frame(868.5, 1.0) is join_reply
+    assert scheduler.subbands[0].deferred == 1
+    scheduler.tx_started(join_reply, 868.5, 1.0)
+
+    #budget is back, reply of higher priority is sent before deferred frame
+    config_reply = radio_packet.ConfigReply()
+    queue.put(config_reply)
+    assert scheduler.next_frame(868.5, 2.0) is None
+    assert scheduler.next_frame(868.5, 3600.0) is config_reply
+    assert isinstance(scheduler.next_frame(868.5, 3600.0), radio_packet.FFTChunkRequest)
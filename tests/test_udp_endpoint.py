@@ -0,0 +1,105 @@
+import json
+import socket
+import time
+import types
+
+import pytest
+
+import json_packet as jp
+import udp_endpoint
+import worker_pool
+
+
+class FakeNode:
+    name = "fake node"
+
+    def __init__(self):
+        self.received = []
+        self.params = types.SimpleNamespace(idloranode=1)
+        self.cntNet = 0
+        self.cntNetErr = 0
+
+    def put(self, packet):
+        self.received.append(packet)
+
+
+@pytest.fixture
+def endpoint():
+    pool = worker_pool.WorkerPool(threads=1)
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0), server=server.getsockname(), batch=False)
+    endpoint.nodered = server
+    yield endpoint
+    endpoint.close()
+    pool.stop()
+    server.close()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+def test_unregister_keeps_route_of_rejoined_node(endpoint):
+    old, new = FakeNode(), FakeNode()
+    endpoint.register("0x00000001", old)
+    endpoint.register("0x00000001", new)
+    endpoint.unregister("0x00000001", old)
+    assert endpoint.routes["0x00000001"] is new
+
+    reset = {"cmd": jp.ResetNodeHard.CMD, "data": {"address": "0x00000001", "idloranode": 1}}
+    endpoint.nodered.sendto(json.dumps(reset).encode(), endpoint.socket.getsockname())
+    assert wait_for(lambda: new.received)
+    assert isinstance(new.received[0], jp.ResetNodeHard)
+    assert not old.received
+
+    endpoint.unregister("0x00000001", new)
+    assert "0x00000001" not in endpoint.routes
+
+
+def test_reply_is_routed_by_corrid_and_acks_done(endpoint):
+    node = FakeNode()
+    acks = []
+    endpoint.send(node, jp.NodeinfoRequest("0x00000001"))
+    endpoint.send(None, jp.StatusinfoBatchPostRequest([{"idloranode": 1}]), acks.append)
+    for _ in range(2):
+        data, address = endpoint.nodered.recvfrom(65535)
+        request = json.loads(data)
+        cmd = 0x01 if request["cmd"] == jp.NodeinfoRequest.CMD else 0x06
+        reply = {"cmd": cmd, "corrid": request["corrid"], "data": {"address": "0x00000001", "sessionid": "0x01"}}
+        endpoint.nodered.sendto(json.dumps(reply).encode(), address)
+    assert wait_for(lambda: node.received and acks)
+    assert isinstance(node.received[0], jp.NodeInfoReply)
+    assert acks == [True]
+    assert not endpoint.pending
+
+
+def test_status_posts_are_not_batched_by_default():
+    pool = worker_pool.WorkerPool(threads=1)
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(("127.0.0.1", 0))
+    server.settimeout(2.0)
+    endpoint = udp_endpoint.NodeRedEndpoint(pool, bind=("127.0.0.1", 0), server=server.getsockname())
+    try:
+        assert endpoint.batcher is None
+        endpoint.send(None, jp.StatusinfoPostRequest(1))
+        data = json.loads(server.recv(2048))
+        assert data["cmd"] == jp.StatusinfoPostRequest.CMD
+        assert data["topic"] == "postData"
+    finally:
+        endpoint.close()
+        pool.stop()
+        server.close()
+
+
+def test_batch_ack_without_data_is_accepted(endpoint):
+    acks = []
+    endpoint.send(None, jp.StatusinfoBatchPostRequest([{"idloranode": 1}]), acks.append)
+    data, address = endpoint.nodered.recvfrom(65535)
+    endpoint.nodered.sendto(json.dumps({"cmd": 0x06, "corrid": json.loads(data)["corrid"]}).encode(), address)
+    assert wait_for(lambda: acks)
+    assert acks == [True]
+    assert endpoint.stats["invalid"] == 0
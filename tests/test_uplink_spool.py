@@ -0,0 +1,146 @@
+import os
+import time
+
+import pytest
+
+import udp_endpoint
+import uplink_batcher
+import uplink_spool
+import worker_pool
+
+
+def spool_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(uplink_spool.SEGMENT_SUFFIX))
+
+
+def test_torn_last_line_is_ignored_after_restart(tmp_path):
+    spool = uplink_spool.UplinkSpool(str(tmp_path))
+    spool.append([{"n": 1}])
+    spool.append([{"n": 2}])
+    spool.close()
+    with open(os.path.join(str(tmp_path), spool_files(str(tmp_path))[-1]), "ab") as f:
+        f.write(b'[{"n":3')
+
+    restored = uplink_spool.UplinkSpool(str(tmp_path))
+    assert len(restored) == 2
+    assert restored.pop()[1] == [{"n": 1}]
+    assert restored.pop()[1] == [{"n": 2}]
+    assert restored.pop() is None
+    #appends go to new segment, torn line is never read
+    restored.append([{"n": 4}])
+    assert restored.pop()[1] == [{"n": 4}]
+    restored.close()
+
+
+def test_segment_is_deleted_when_all_batches_released(tmp_path):
+    spool = uplink_spool.UplinkSpool(str(tmp_path), segment_bytes=64)
+    for n in range(6):
+        spool.append([{"n": n, "pad": "x" * 16}])
+    segments = spool_files(str(tmp_path))
+    assert len(segments) > 2
+
+    number, records, attempts = spool.pop()
+    assert records[0]["n"] == 0
+    assert attempts == 0
+    #read but not released batch keeps its segment (replayed after restart)
+    assert spool_files(str(tmp_path))[0] == segments[0]
+    spool.release(number)
+    assert segments[0] not in spool_files(str(tmp_path))
+    spool.close()
+
+
+def test_oldest_batches_are_evicted_when_full(tmp_path):
+    spool = uplink_spool.UplinkSpool(str(tmp_path), segment_bytes=64, max_bytes=256)
+    for n in range(40):
+        spool.append([{"n": n, "pad": "x" * 16}])
+    assert spool.size <= 256
+    assert spool.evicted > 0
+    assert len(spool) + spool.evicted == 40
+
+    received = []
+    while True:
+        entry = spool.pop()
+        if entry is None:
+            break
+        received.append(entry[1][0]["n"])
+        spool.release(entry[0])
+    #newest batches are kept, in order
+    assert received == list(range(40 - len(received), 40))
+    spool.close()
+
+
+@pytest.fixture
+def pool():
+    pool = worker_pool.WorkerPool(threads=1)
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def test_spool_is_attached_to_existing_endpoint(tmp_path, pool, monkeypatch):
+    monkeypatch.setattr(udp_endpoint, "_shared_endpoint", None)
+    monkeypatch.setattr(udp_endpoint, "SERVER_PORT", 9)
+    monkeypatch.setattr(uplink_batcher, "BATCH_ENABLED", True)
+    endpoint = udp_endpoint.shared_endpoint(pool)
+    try:
+        assert endpoint.batcher.spool is None
+        spool = uplink_spool.UplinkSpool(str(tmp_path))
+        assert udp_endpoint.shared_endpoint(pool, spool) is endpoint
+        assert endpoint.batcher.spool is spool
+
+        #second spool is not silently swapped in
+        other = uplink_spool.UplinkSpool(str(tmp_path / "other"))
+        assert not endpoint.attach_spool(other)
+        assert endpoint.batcher.spool is spool
+    finally:
+        endpoint.close()
+
+
+def test_attached_spool_of_previous_run_is_replayed(tmp_path, pool):
+    spool = uplink_spool.UplinkSpool(str(tmp_path))
+    spool.append([{"n": 1}])
+    sent = []
+    batcher = uplink_batcher.StatusBatcher(pool, lambda records, done: (sent.append(records), done(True)))
+    assert batcher.attach_spool(spool)
+
+    deadline = time.monotonic() + 2.0
+    while not sent and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sent == [[{"n": 1}]]
+    assert len(spool) == 0
+    spool.close()
+
+
+def test_unacknowledged_batch_is_dropped_after_max_attempts(tmp_path, pool, monkeypatch):
+    monkeypatch.setattr(uplink_batcher, "PROBE_INTERVAL", 0.01)
+    monkeypatch.setattr(uplink_batcher, "PROBE_MAX_INTERVAL", 0.02)
+    monkeypatch.setattr(uplink_batcher, "MAX_ATTEMPTS", 3)
+    spool = uplink_spool.UplinkSpool(str(tmp_path))
+    sent = []
+    batcher = uplink_batcher.StatusBatcher(pool, lambda records, done: (sent.append(records), done(False)),
+                                           max_records=1, spool=spool)
+    batcher.put({"n": 1})
+
+    deadline = time.monotonic() + 2.0
+    while not batcher.dropped and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert batcher.dropped == 1
+    assert sent == [[{"n": 1}]] * 3
+    assert len(spool) == 0
+    spool.close()
+
+
+def test_batch_failing_to_send_is_spooled(tmp_path, pool):
+    spool = uplink_spool.UplinkSpool(str(tmp_path))
+
+    def send(records, done):
+        raise OSError("network is unreachable")
+    batcher = uplink_batcher.StatusBatcher(pool, send, max_records=1, max_in_flight=1, spool=spool)
+    for n in range(3):
+        batcher.add(time.monotonic(), {"n": n})
+    assert batcher.in_flight == 0
+    assert batcher.failed == 1
+    assert len(spool) == 3
+    pool.timers.cancel(batcher.replay_timer)
+    spool.close()
@@ -0,0 +1,131 @@
+"""
+\file       timer_wheel.py
+\author     Ladislav Stefka
+\brief      Hierarchical timer wheel on monotonic clock
+            - LEVELS wheels of SLOTS slots, level 0 slot is one tick (resolution), timer lives in one slot set
+            - schedule, cancel and re-arm are O(1), timers of higher level cascade down when lower wheel wraps
+            - advance(now) fires expired timers, cost depends on ticks elapsed and timers fired, not on armed timers
+\copyright
+"""
+
+import logging
+import math
+import threading
+import time
+
+TIMER_RESOLUTION = 0.05
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+LEVELS = 4
+
+
+class Timer:
+    """Armed timer, callback(*args) is called by thread advancing the wheel"""
+
+    __slots__ = ("callback", "args", "expires", "slot")
+
+    def __init__(self, callback, args):
+        self.callback = callback
+        self.args = args
+        self.expires = None     #tick
+        self.slot = None        #set holding timer, None if not armed
+
+    @property
+    def armed(self):
+        return self.slot is not None
+
+
+class TimerWheel:
+
+    def __init__(self, resolution=TIMER_RESOLUTION):
+        self.resolution = resolution
+        self.lock = threading.Lock()
+        self.wheels = [[set() for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self.origin = time.monotonic()
+        self.current = 0        #ticks processed
+        self.armed = 0
+        self.fired = 0
+
+    def _tick(self, now):
+        return int((now - self.origin) / self.resolution)
+
+    def _insert(self, timer):
+        delta = timer.expires - self.current
+        if delta < 0:
+            timer.expires = self.current
+            delta = 0
+        for level in range(LEVELS):
+            if delta < 1 << (SLOT_BITS * (level + 1)) or level == LEVELS - 1:
+                break
+        #beyond range of wheels -> last slot reachable on top level, re-inserted when cascaded
+        expires = min(timer.expires, self.current + (1 << (SLOT_BITS * LEVELS)) - 1)
+        timer.slot = self.wheels[level][(expires >> (SLOT_BITS * level)) & SLOT_MASK]
+        timer.slot.add(timer)
+
+    def schedule(self, delay, callback, *args):
+        """New timer firing in delay seconds"""
+        timer = Timer(callback, args)
+        self.rearm(timer, delay)
+        return timer
+
+    def rearm(self, timer, delay):
+        """(Re)arms timer to fire in delay seconds from now"""
+        #rounded up, timer never fires earlier than delay
+        expires = math.ceil((time.monotonic() - self.origin + delay) / self.resolution)
+        with self.lock:
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+            else:
+                self.armed += 1
+            timer.expires = expires
+            self._insert(timer)
+
+    def cancel(self, timer):
+        with self.lock:
+            if timer.slot is not None:
+                timer.slot.discard(timer)
+                timer.slot = None
+                self.armed -= 1
+
+    def _cascade(self, level):
+        """Moves timers of current slot of level to lower levels, returns True when this level wrapped too"""
+        index = (self.current >> (SLOT_BITS * level)) & SLOT_MASK
+        slot = self.wheels[level][index]
+        timers = list(slot)
+        slot.clear()
+        for timer in timers:
+            self._insert(timer)
+        return index == 0
+
+    def advance(self, now=None):
+        """Fires timers expired till now, returns number of fired timers"""
+        target = self._tick(time.monotonic() if now is None else now)
+        fired = []
+        with self.lock:
+            while self.current <= target:
+                if self.current & SLOT_MASK == 0:
+                    level = 1
+                    while level < LEVELS and self._cascade(level):
+                        level += 1
+                slot = self.wheels[0][self.current & SLOT_MASK]
+                for timer in slot:
+                    timer.slot = None
+                fired.extend(slot)
+                self.armed -= len(slot)
+                slot.clear()
+                self.current += 1
+        for timer in fired:
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                logging.exception("Timer callback %s failed", timer.callback)
+        self.fired += len(fired)
+        return len(fired)
+
+    def next_deadline(self):
+        """Monotonic time of next tick to process"""
+        return self.origin + self.current * self.resolution
+
+    def __len__(self):
+        return self.armed
@@ -5,8 +5,17 @@
 \copyright
 """
 
+import sys
 from array import array
 
+try:
+    import numpy as np
+except ImportError:     #numpy is optional, typed arrays fall back to array.array
+    np = None
+
+#array.array typecode -> little endian numpy dtype
+LE_DTYPES = {"B": "u1", "H": "<u2", "I": "<u4", "Q": "<u8", "f": "<f4", "d": "<f8"}
+
 def to_uint8t(b):
     return b & 0xFF
 
@@ -19,3 +28,46 @@ def write_data_to_file(data, file, dtype):
     float_array = array(dtype, data)
     float_array.tofile(f)
     f.close()
+
+
+def typed_array(buffer, typecode, count, offset=0):
+    """count little endian values of typecode from buffer at offset, without per-element unpacking
+        numpy.ndarray viewing buffer (zero copy, read only for bytes) if numpy is available, array.array otherwise"""
+    if np is not None:
+        return np.frombuffer(buffer, dtype=LE_DTYPES[typecode], count=count, offset=offset)
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    if end > len(buffer):
+        raise ValueError("buffer is smaller than requested array")
+    values.frombytes(memoryview(buffer)[offset:end])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class LatencyStat:
+    """Running statistic of latencies in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, latency):
+        self.count += 1
+        self.total += latency
+        if self.min is None or latency < self.min:
+            self.min = latency
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def __str__(self):
+        if not self.count:
+            return "n=0"
+        return "n={} mean={:.3f} ms min={:.3f} ms max={:.3f} ms".format(
+            self.count, self.mean * 1e3, self.min * 1e3, self.max * 1e3)
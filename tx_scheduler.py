@@ -0,0 +1,167 @@
+"""
+\file       tx_scheduler.py
+\author     Ladislav Stefka
+\brief      Duty-cycle aware scheduler of radio downlinks
+            - tracks airtime budget per sub-band in sliding window (EU868 1 hour)
+            - defers frames that would exceed budget, drops frames that would wait too long
+            - airtime is charged when frame goes on air (tx_started), not when frame is handed to radio
+              (frame dropped by listen before talk does not use budget)
+            - only the frame about to be sent is taken from TX queue, deferred frames stay in the bounded queue
+            - frames of higher priority and frames fitting into budget go ahead of deferred frame
+\copyright
+"""
+
+import logging
+import time
+from collections import deque
+from queue import Empty
+
+
+#EU868 sub-bands (ETSI EN 300 220): low MHz, high MHz, duty cycle
+EU868_SUBBANDS = [
+    ("h1.2", 863.0, 865.0, 0.001),
+    ("h1.3", 865.0, 868.0, 0.01),
+    ("h1.4", 868.0, 868.6, 0.01),
+    ("h1.5", 868.7, 869.2, 0.001),
+    ("h1.6", 869.4, 869.65, 0.1),
+    ("h1.7", 869.7, 870.0, 0.01),
+]
+
+DUTY_CYCLE_WINDOW = 3600.0
+
+
+class SubBand:
+    """Airtime budget of one sub-band in sliding window"""
+
+    def __init__(self, name, low, high, duty_cycle, window=DUTY_CYCLE_WINDOW):
+        self.name = name
+        self.low = low
+        self.high = high
+        self.duty_cycle = duty_cycle
+        self.window = window
+        self.budget = duty_cycle * window
+        self.used = 0.0
+        self.history = deque()      #(start time, airtime)
+
+        self.sent = 0
+        self.deferred = 0
+        self.dropped = 0
+
+    def contains(self, freq):
+        return self.low <= freq < self.high
+
+    def _expire(self, now):
+        while self.history and self.history[0][0] + self.window <= now:
+            self.used -= self.history.popleft()[1]
+
+    def wait_time(self, airtime, now):
+        """Seconds until airtime fits into budget, None if it never fits"""
+        if airtime > self.budget:
+            return None
+        self._expire(now)
+        excess = self.used + airtime - self.budget
+        if excess <= 0:
+            return 0.0
+        for start, used in self.history:
+            excess -= used
+            if excess <= 0:
+                return start + self.window - now
+        return None
+
+    def record(self, airtime, now):
+        self.history.append((now, airtime))
+        self.used += airtime
+        self.sent += 1
+
+    def report(self, now=None):
+        self._expire(time.monotonic() if now is None else now)
+        return dict(
+            used=self.used,
+            budget=self.budget,
+            usage=self.used / self.budget if self.budget else 0.0,
+            sent=self.sent,
+            deferred=self.deferred,
+            dropped=self.dropped,
+        )
+
+
+class DutyCycleScheduler:
+    """Drains radio TX queue, frames are released only when sub-band airtime budget allows it
+
+    :param tx_queue: queue filled by node workers
+    :param airtime: callable(frame) -> time on air in seconds
+    :param max_defer: frames that would wait longer than max_defer seconds are dropped
+    """
+
+    def __init__(self, tx_queue, airtime, subbands=EU868_SUBBANDS, window=DUTY_CYCLE_WINDOW, max_defer=60.0):
+        self.tx_queue = tx_queue
+        self.airtime = airtime
+        self.subbands = [SubBand(*sb, window=window) for sb in subbands]
+        self.max_defer = max_defer
+        self.head = None            #[frame, airtime, deferred] of frame taken from tx_queue, not yet sent
+        self.next_eligible = None
+
+    def subband(self, freq):
+        for sb in self.subbands:
+            if sb.contains(freq):
+                return sb
+        raise ValueError("Frequency {} MHz is not in any sub-band".format(freq))
+
+    def has_pending(self):
+        return self.head is not None or not self.tx_queue.empty()
+
+    def next_frame(self, freq, now=None):
+        """Returns frame that may be sent now on freq or None (next_eligible is set if frame is deferred)
+
+        Airtime of frame is charged by tx_started, one downlink is in progress at a time
+        (budget cannot be promised to two frames).
+        """
+        now = time.monotonic() if now is None else now
+        sb = self.subband(freq)
+        self.next_eligible = None
+        rank = self.tx_queue.priority or (lambda frame: 0)
+
+        while True:
+            if self.head is None:
+                try:
+                    self.head = [self.tx_queue.get_nowait(), None, False]
+                except Empty:
+                    return None
+            entry = self.head
+            frame = entry[0]
+            if entry[1] is None:
+                entry[1] = self.airtime(frame)
+            airtime = entry[1]
+
+            wait = sb.wait_time(airtime, now)
+            if wait is None or wait > self.max_defer:
+                self.head = None
+                sb.dropped += 1
+                logging.warning("Radio packet %s dropped, airtime %.3f s exceeds %s duty cycle budget (%.1f/%.1f s)",
+                                frame.getName(), airtime, sb.name, sb.used, sb.budget)
+                continue
+
+            if wait > 0 and not entry[2]:
+                entry[2] = True
+                sb.deferred += 1
+                logging.info("Radio packet %s deferred by %.1f s, %s duty cycle budget", frame.getName(), wait, sb.name)
+
+            #queued frame that may be sent now goes first if it has higher priority or head has to wait
+            head_rank = rank(frame)
+            ahead = self.tx_queue.take(lambda queued: (wait > 0 or rank(queued) > head_rank) and
+                                       sb.wait_time(self.airtime(queued), now) == 0)
+            if ahead is not None:
+                return ahead
+            if wait == 0:
+                self.head = None
+                return frame
+            self.next_eligible = now + wait
+            return None
+
+    def tx_started(self, frame, freq, now=None):
+        """Frame returned by next_frame is on air, its airtime is charged to sub-band budget"""
+        self.subband(freq).record(self.airtime(frame), time.monotonic() if now is None else now)
+
+    def report(self):
+        now = time.monotonic()
+        return {sb.name: sb.report(now) for sb in self.subbands if sb.sent or sb.dropped or sb.deferred}
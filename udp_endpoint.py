@@ -0,0 +1,213 @@
+"""
+\file       udp_endpoint.py
+\author     Ladislav Stefka
+\brief      Gateway UDP endpoint to Node-RED server shared by all LoRa node workers
+            - one socket bound to Params.CFG_DEFAULT_PORT, read by worker pool I/O thread
+            - requests expecting reply (JsonPacket.REPLY) get correlation id "corrid", Node-RED echoes it in reply
+              {"cmd": .., "corrid": .., "data": {..}}, reply is routed to the owning node by one dict lookup
+            - replies missing for REQUEST_TIMEOUT are re-sent REQUEST_RETRIES times, then dropped
+              (timer of pool timer wheel per request, cancelled by reply)
+            - packets without corrid (reset commands) are routed by node address
+            - node info and config replies are cached (nodered_cache.py), cached request is answered at once
+            - status info posts of all nodes are batched (uplink_batcher.py) when Node-RED flow handles batches
+              (uplink_batcher.BATCH_ENABLED), one datagram per batch,
+              sender of request without node learns about reply / timeout by done(acked) callback,
+              batches not acknowledged are spooled to disk (uplink_spool.py) and replayed later
+\copyright
+"""
+
+import itertools
+import json
+import logging
+import socket
+import threading
+
+import json_packet as jp
+import params as prm
+import nodered_cache
+import uplink_batcher
+
+SERVER_IP = "127.0.0.1"
+SERVER_PORT = 12344
+
+REQUEST_TIMEOUT = 5.0
+REQUEST_RETRIES = 2
+
+
+class NodeRedEndpoint:
+    """UDP endpoint owning the socket to Node-RED, nodes send through send(node, packet)"""
+
+    def __init__(self, pool, bind=("127.0.0.1", prm.Params.CFG_DEFAULT_PORT), server=(SERVER_IP, SERVER_PORT),
+                 timeout=REQUEST_TIMEOUT, retries=REQUEST_RETRIES, cache=None, batch=False, spool=None):
+        self.server = server
+        self.timeout = timeout
+        self.retries = retries
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(bind)
+
+        self.lock = threading.Lock()
+        self.corrids = itertools.count(1)
+        self.pending = {}           #corrid -> [node (None for prefetch), packet data, attempt, timer, cache key, done]
+        self.routes = {}            #node address -> node
+        self.cache = cache if cache is not None else nodered_cache.NodeRedCache()
+        self.batcher = uplink_batcher.StatusBatcher(pool, uplink_batcher.udp_sender(self), spool=spool) if batch else None
+
+        self.stats = dict(sent=0, replies=0, retries=0, timeouts=0, unroutable=0, invalid=0)
+
+        self.pool = pool
+        pool.add_reader(self.socket, self.receiver)
+
+    def attach_spool(self, spool):
+        """Spools status batches not acknowledged by Node-RED, returns False when spool is not used"""
+        if self.batcher is None:
+            logging.error("Node-RED endpoint does not batch status posts, spool %s is not used", spool.directory)
+            return False
+        return self.batcher.attach_spool(spool)
+
+    def close(self):
+        self.pool.remove_reader(self.socket)
+        with self.lock:
+            for entry in self.pending.values():
+                self.pool.timers.cancel(entry[3])
+            self.pending.clear()
+        self.socket.close()
+
+    def register(self, address, node):
+        """Node receives packets without corrid addressed to it"""
+        with self.lock:
+            self.routes[address] = node
+
+    def unregister(self, address, node):
+        """Drops route of address if it is route of node (not of worker of rejoined node)"""
+        with self.lock:
+            if self.routes.get(address) is node:
+                del self.routes[address]
+
+    def send(self, node, packet, done=None):
+        """Sends packet of node, done(acked) is called when reply arrives or request times out"""
+        if self.batcher is not None and isinstance(packet, jp.StatusinfoPostRequest):
+            record = dict(packet.__dict__)
+            del record["cmd"]
+            self.batcher.put(record)
+            return
+        key = self.cache.key(packet)
+        if key is not None and node is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                node.put(jp.JsonPacket(cached))
+                return
+        reply = getattr(packet, "REPLY", None) is not None
+        if reply:
+            packet.corrid = next(self.corrids)
+        data = json.dumps(packet.__dict__).encode('ascii')
+        if reply:
+            with self.lock:
+                timer = self.pool.timers.schedule(self.timeout, self.expire, packet.corrid)
+                self.pending[packet.corrid] = [node, data, 0, timer, key, done]
+        try:
+            self.send_raw(data)
+        except OSError:
+            #sender learns about failure from exception, not from done
+            if reply:
+                with self.lock:
+                    self.pending.pop(packet.corrid, None)
+                    self.pool.timers.cancel(timer)
+            raise
+
+    def prefetch(self, addresses=(), idloranodes=()):
+        """Fills cache with node info and config of known nodes"""
+        for address in addresses:
+            self.send(None, jp.NodeinfoRequest(address))
+        for idloranode in idloranodes:
+            self.send(None, jp.ConfigRequest(idloranode))
+
+    def send_raw(self, data):
+        self.stats['sent'] += 1
+        self.socket.sendto(data, self.server)
+
+    def receiver(self):
+        """Reads one datagram (pool I/O thread) and puts JSON packet to inbox of its node"""
+        packet = self.socket.recvfrom(2048)
+        try:
+            data = json.loads(packet[0].decode())
+            corrid = data.get("corrid")
+            rec = jp.JsonPacket(data)
+        except (ValueError, KeyError, NameError, AttributeError, TypeError):
+            logging.error("Invalid JSON from Node-RED: %s", packet[0])
+            self.stats['invalid'] += 1
+            return
+
+        done = None
+        with self.lock:
+            if corrid is not None:
+                entry = self.pending.pop(corrid, None)
+                node = None
+                if entry is not None:
+                    node = entry[0]
+                    self.pool.timers.cancel(entry[3])
+                    if entry[4] is not None:
+                        self.cache.put(entry[4], data)
+                    #prefetch or batch reply, no node is waiting for it
+                    if node is None:
+                        self.stats['replies'] += 1
+                        if entry[5] is None:
+                            return
+                        done = entry[5]
+            else:
+                fields = data.get("data", {})
+                address = data.get("address", fields.get("address"))
+                node = self.routes.get(address)
+                if isinstance(rec, (jp.ResetNodeConfig, jp.ResetNodeHard)):
+                    idloranode = fields.get("idloranode", node.params.idloranode if node is not None else None)
+                    self.cache.invalidate(address, idloranode, config_only=isinstance(rec, jp.ResetNodeConfig))
+        if done is not None:
+            done(True)
+            return
+        if node is None:
+            logging.warning("Json packet %s (corrid %s) has no node, late reply or unknown address", rec.getName(), corrid)
+            self.stats['unroutable'] += 1
+            return
+        self.stats['replies'] += 1
+        node.cntNet += 1
+        node.put(rec)
+
+    def expire(self, corrid):
+        """Request timer expired, re-sends request or drops it after retries (pool I/O thread)"""
+        with self.lock:
+            entry = self.pending.get(corrid)
+            if entry is None:
+                return
+            if entry[2] >= self.retries:
+                del self.pending[corrid]
+                self.stats['timeouts'] += 1
+                if entry[0] is not None:
+                    entry[0].cntNetErr += 1
+                logging.error("%s: no reply from Node-RED to request %d",
+                              entry[0].name if entry[0] is not None else "prefetch", corrid)
+                timed_out = True
+            else:
+                entry[2] += 1
+                self.stats['retries'] += 1
+                self.pool.timers.rearm(entry[3], self.timeout)
+                timed_out = False
+        if not timed_out:
+            self.send_raw(entry[1])
+        elif entry[5] is not None:
+            entry[5](False)
+
+    def report(self):
+        return dict(self.stats, in_flight=len(self.pending), routes=len(self.routes), cache=self.cache.report(),
+                    batcher=self.batcher.report() if self.batcher is not None else None)
+
+
+_shared_endpoint = None
+
+
+def shared_endpoint(pool, spool=None):
+    """Endpoint used by all node workers of gateway, created on first use, spool (if given) is attached to it"""
+    global _shared_endpoint
+    if _shared_endpoint is None:
+        _shared_endpoint = NodeRedEndpoint(pool, batch=uplink_batcher.BATCH_ENABLED, spool=spool)
+    elif spool is not None:
+        _shared_endpoint.attach_spool(spool)
+    return _shared_endpoint
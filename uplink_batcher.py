@@ -0,0 +1,293 @@
+"""
+\file       uplink_batcher.py
+\author     Ladislav Stefka
+\brief      Batching of status info posts of all nodes to Node-RED
+            - records are coalesced into batches of at most max_records records / max_bytes JSON bytes
+            - batch is flushed when full or max_delay seconds after its first record (timer of pool timer wheel)
+            - batch is sent by send(records) callable - one UDP datagram (StatusinfoBatchPostRequest) or one HTTP POST
+            - runs on worker pool as actor (inbox, run), flush never runs on pool I/O thread
+            - metrics: batches, records, batch size, latency added by batching, flush reasons
+            - with disk spool (uplink_spool.py): batch is spooled when Node-RED is down (batch not acknowledged)
+              or slow (max_in_flight batches wait for ACK), spooled batches are replayed oldest first at
+              REPLAY_BURST batches per REPLAY_INTERVAL, while Node-RED is down one batch probes it per PROBE_INTERVAL
+              (doubled by every failed probe up to PROBE_MAX_INTERVAL), batch is dropped after MAX_ATTEMPTS
+              sends without ACK (Node-RED flow not acknowledging batches does not get them again and again)
+\copyright
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import Counter
+from queue import Empty
+
+import bounded_queue as bq
+import http_client
+import json_packet as jp
+import tools
+
+#Node-RED flow handles batches (StatusinfoBatchPostRequest "postDataBatch" acknowledged by StatusinfoBatchACK,
+#statusinfo_batch URL), False -> one StatusinfoPostRequest datagram / HTTP POST per status info
+BATCH_ENABLED = False
+
+BATCH_MAX_RECORDS = 16
+BATCH_MAX_DELAY = 0.2
+BATCH_MAX_BYTES = 8192
+INBOX_CAPACITY = 1024
+
+BATCH_MAX_IN_FLIGHT = 4
+REPLAY_INTERVAL = 0.05
+REPLAY_BURST = 4
+PROBE_INTERVAL = 2.0
+PROBE_MAX_INTERVAL = 60.0
+MAX_ATTEMPTS = 8
+
+#inbox messages of flush and replay timers
+FLUSH = object()
+REPLAY = object()
+
+
+def udp_sender(endpoint):
+    """Batch as one StatusinfoBatchPostRequest datagram through Node-RED endpoint, acknowledged by StatusinfoBatchACK"""
+    return lambda records, done: endpoint.send(None, jp.StatusinfoBatchPostRequest(records), done)
+
+
+def http_sender(url):
+    """Batch as one HTTP POST of JSON list of records, posted by shared HTTP client (batcher does not wait)"""
+    def send(records, done):
+        def sent(future):
+            #failures are logged by client
+            if future.exception() is None:
+                logging.debug("Batch of %d records was sent to node-red server %s",
+                              len(records), (future.result().status_code, future.result().reason))
+            done(future.exception() is None)
+        http_client.shared_client().post(url, json=records).add_done_callback(sent)
+    return send
+
+
+class StatusBatcher:
+    """Coalesces status records (dicts) of all nodes, put(record) is called by node workers"""
+
+    def __init__(self, pool, send, max_records=BATCH_MAX_RECORDS, max_delay=BATCH_MAX_DELAY,
+                 max_bytes=BATCH_MAX_BYTES, spool=None, max_in_flight=BATCH_MAX_IN_FLIGHT, name="STATUS_BATCHER"):
+        self.pool = pool
+        self.send = send
+        self.max_records = max_records
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.spool = None
+        self.max_in_flight = max_in_flight
+        self.name = name
+
+        #pool actor interface
+        self.inbox = bq.BoundedQueue(INBOX_CAPACITY, bq.PRIORITY,
+                                     priority=lambda message: message is FLUSH or message is REPLAY,
+                                     name="status batcher inbox")
+        self.scheduled = False
+
+        self.records = []
+        self.times = []             #put time of records in batch
+        self.size = 2               #JSON bytes of records list
+        self.timer = None
+        self.deadline = None
+
+        #delivery state, updated by done callbacks (pool I/O thread, HTTP client threads)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.online = True
+        self.probe_interval = PROBE_INTERVAL
+        self.replay_timer = None
+        self.acked = 0
+        self.failed = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+        if spool is not None:
+            self.attach_spool(spool)
+
+        self.batches = 0
+        self.sent_records = 0
+        self.max_batch = 0
+        self.latency = tools.LatencyStat()
+        self.reasons = Counter()
+
+    def attach_spool(self, spool):
+        """Spools batches to spool from now on, returns False when batcher already has another spool"""
+        with self.lock:
+            if self.spool is spool:
+                return True
+            if self.spool is not None:
+                logging.error("%s: already spools to %s, spool %s is not used",
+                              self.name, self.spool.directory, spool.directory)
+                return False
+            self.spool = spool
+            if len(spool) and self.replay_timer is None:
+                #batches spooled by previous run
+                self.replay_timer = self.pool.timers.schedule(REPLAY_INTERVAL, self.put_replay)
+        return True
+
+    def put(self, record):
+        if self.inbox.put((time.monotonic(), record)):
+            self.pool.schedule(self)
+
+    def run(self, max_batch):
+        processed = 0
+        while processed < max_batch:
+            try:
+                message = self.inbox.get_nowait()
+            except Empty:
+                break
+            processed += 1
+            if message is FLUSH:
+                self.on_timer()
+            elif message is REPLAY:
+                self.replay()
+            else:
+                self.add(*message)
+        return processed
+
+    def add(self, put_time, record):
+        size = len(json.dumps(record)) + 1
+        if self.records and self.size + size > self.max_bytes:
+            self.flush("bytes")
+        self.records.append(record)
+        self.times.append(put_time)
+        self.size += size
+        if len(self.records) >= self.max_records:
+            self.flush("records")
+        elif len(self.records) == 1:
+            self.deadline = time.monotonic() + self.max_delay
+            if self.timer is None:
+                self.timer = self.pool.timers.schedule(self.max_delay, self.put_flush)
+            else:
+                self.pool.timers.rearm(self.timer, self.max_delay)
+
+    def on_timer(self):
+        if not self.records:
+            return
+        #timer of previous batch flushed by size
+        remaining = self.deadline - time.monotonic()
+        if remaining > 0:
+            self.pool.timers.rearm(self.timer, remaining)
+            return
+        self.flush("time")
+
+    def put_flush(self):
+        """Flush timer callback (pool I/O thread), flush itself runs on pool thread"""
+        if self.inbox.put(FLUSH):
+            self.pool.schedule(self)
+
+    def flush(self, reason):
+        records, times = self.records, self.times
+        self.records, self.times, self.size = [], [], 2
+        if self.timer is not None:
+            self.pool.timers.cancel(self.timer)
+        now = time.monotonic()
+        for put_time in times:
+            self.latency.record(now - put_time)
+        self.batches += 1
+        self.sent_records += len(records)
+        self.max_batch = max(self.max_batch, len(records))
+        self.reasons[reason] += 1
+        if self.spool is not None:
+            with self.lock:
+                #spooled batches go first, Node-RED gets records in order
+                divert = not self.online or self.in_flight >= self.max_in_flight or len(self.spool)
+            if divert:
+                self.to_spool(records)
+                return
+        self.transmit(records)
+
+    def transmit(self, records, segment=None, attempts=0):
+        with self.lock:
+            self.in_flight += 1
+        try:
+            self.send(records, lambda acked: self.on_sent(records, segment, attempts, acked))
+        except Exception:
+            logging.exception("%s: batch of %d status records was not sent", self.name, len(records))
+            self.on_sent(records, segment, attempts, False)
+
+    def on_sent(self, records, segment, attempts, acked):
+        """Batch sent attempts times before was acknowledged by Node-RED or not (pool I/O thread, HTTP client thread)"""
+        with self.lock:
+            self.in_flight -= 1
+            if acked:
+                self.acked += 1
+                if not self.online:
+                    logging.info("%s: Node-RED is back, replaying %d spooled batches",
+                                 self.name, len(self.spool) if self.spool is not None else 0)
+                self.online = True
+                self.probe_interval = PROBE_INTERVAL
+            else:
+                self.failed += 1
+                if self.online and self.spool is not None:
+                    logging.warning("%s: Node-RED does not acknowledge batches, spooling to %s",
+                                    self.name, self.spool.directory)
+                elif segment is not None:
+                    #probe failed
+                    self.probe_interval = min(2 * self.probe_interval, PROBE_MAX_INTERVAL)
+                self.online = False
+        if self.spool is None:
+            return
+        if not acked:
+            if attempts + 1 >= MAX_ATTEMPTS:
+                with self.lock:
+                    self.dropped += 1
+                logging.error("%s: batch of %d status records dropped, not acknowledged after %d sends",
+                              self.name, len(records), attempts + 1)
+            else:
+                self.to_spool(records, attempts + 1)
+        if segment is not None:
+            self.spool.release(segment)
+
+    def to_spool(self, records, attempts=0):
+        self.spool.append(records, attempts)
+        with self.lock:
+            self.spooled += 1
+            delay = REPLAY_INTERVAL if self.online else self.probe_interval
+            if self.replay_timer is None:
+                self.replay_timer = self.pool.timers.schedule(delay, self.put_replay)
+            elif not self.replay_timer.armed:
+                self.pool.timers.rearm(self.replay_timer, delay)
+
+    def put_replay(self):
+        """Replay timer callback (pool I/O thread)"""
+        if self.inbox.put(REPLAY):
+            self.pool.schedule(self)
+
+    def replay(self):
+        """Sends oldest spooled batches, REPLAY_BURST while Node-RED is up, one probe while it is down"""
+        self.spool.sync()
+        with self.lock:
+            burst = REPLAY_BURST if self.online else 1
+            room = self.max_in_flight - self.in_flight
+        for _ in range(min(burst, room)):
+            entry = self.spool.pop()
+            if entry is None:
+                break
+            with self.lock:
+                self.replayed += 1
+            self.transmit(entry[1], entry[0], entry[2])
+        with self.lock:
+            if len(self.spool):
+                self.pool.timers.rearm(self.replay_timer, REPLAY_INTERVAL if self.online else self.probe_interval)
+
+    def report(self):
+        report = dict(depth=len(self.records), batches=self.batches, records=self.sent_records,
+                      mean_batch=self.sent_records / self.batches if self.batches else None, max_batch=self.max_batch,
+                      added_latency=str(self.latency), reasons=dict(self.reasons))
+        if self.spool is not None:
+            report.update(online=self.online, in_flight=self.in_flight, acked=self.acked, failed=self.failed,
+                          spooled=self.spooled, replayed=self.replayed, dropped=self.dropped, spool=self.spool.report())
+        return report
+
+
+_http_batchers = {}
+
+
+def shared_http_batcher(pool, url):
+    """HTTP batcher of all node workers posting to url"""
+    if url not in _http_batchers:
+        _http_batchers[url] = StatusBatcher(pool, http_sender(url), name="HTTP_BATCHER")
+    return _http_batchers[url]
@@ -0,0 +1,197 @@
+"""
+\file       uplink_spool.py
+\author     Ladislav Stefka
+\brief      Store-and-forward disk spool of status batches for Node-RED outages
+            - append-only segment files of JSON lines (one batch of records with its send attempts per line)
+              in spool directory
+            - appends are fsynced in groups (every FSYNC_BATCHES batches or FSYNC_INTERVAL seconds)
+            - size of spool is bounded by max_bytes, oldest segment is evicted first
+            - batches are read oldest first, segment is deleted when all its batches were read and released
+              (delivery is at least once, batches of not deleted segment are replayed again after restart)
+            - torn last line (crash while writing) is ignored
+\copyright
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+SPOOL_DIR = "spool"
+SEGMENT_BYTES = 1 << 20
+SPOOL_MAX_BYTES = 64 << 20
+FSYNC_BATCHES = 32
+FSYNC_INTERVAL = 1.0
+
+SEGMENT_SUFFIX = ".seg"
+
+
+class Segment:
+    """Segment file, read position and number of read batches not yet released"""
+
+    def __init__(self, number, path, size=0):
+        self.number = number
+        self.path = path
+        self.size = size
+        self.offset = 0
+        self.outstanding = 0
+
+
+class UplinkSpool:
+    """Thread safe FIFO of batches (lists of records) on disk"""
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SEGMENT_BYTES, max_bytes=SPOOL_MAX_BYTES,
+                 fsync_batches=FSYNC_BATCHES, fsync_interval=FSYNC_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_batches = fsync_batches
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = []          #oldest first, last one is written
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SEGMENT_SUFFIX):
+                path = os.path.join(directory, name)
+                self.segments.append(Segment(int(name[:-len(SEGMENT_SUFFIX)]), path, os.path.getsize(path)))
+        self.size = sum(segment.size for segment in self.segments)
+        self.batches = sum(self._count(segment) for segment in self.segments)
+        self.file = None
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+        self.appended = 0
+        self.read = 0
+        self.evicted = 0
+        self.fsyncs = 0
+        if self.batches:
+            logging.info("Spool %s: %d batches (%d bytes) from previous run", directory, self.batches, self.size)
+
+    @staticmethod
+    def _count(segment):
+        with open(segment.path, "rb") as f:
+            return sum(1 for line in f if line.endswith(b"\n"))
+
+    def _open_segment(self):
+        number = self.segments[-1].number + 1 if self.segments else 0
+        segment = Segment(number, os.path.join(self.directory, "{:010d}{}".format(number, SEGMENT_SUFFIX)))
+        self.segments.append(segment)
+        self.file = open(segment.path, "ab")
+        if len(self.segments) > 1:
+            self._release(self.segments[-2])
+        return segment
+
+    def _sync(self):
+        if self.file is not None and self.unsynced:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+        self.unsynced = 0
+        self.synced = time.monotonic()
+
+    def _close_segment(self):
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+            self.file = None
+
+    def _delete(self, segment):
+        if segment is self.segments[-1]:
+            self._close_segment()
+        self.segments.remove(segment)
+        self.size -= segment.size
+        os.remove(segment.path)
+
+    def append(self, records, attempts=0):
+        """Stores batch sent attempts times already, oldest segments are evicted when spool is full"""
+        line = (json.dumps(dict(attempts=attempts, records=records), separators=(",", ":")) + "\n").encode()
+        with self.lock:
+            segment = self.segments[-1] if self.file is not None else None
+            if segment is None or segment.size + len(line) > self.segment_bytes:
+                self._close_segment()
+                segment = self._open_segment()
+            self.file.write(line)
+            segment.size += len(line)
+            self.size += len(line)
+            self.batches += 1
+            self.appended += 1
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_batches or time.monotonic() - self.synced >= self.fsync_interval:
+                self._sync()
+            while self.size > self.max_bytes and len(self.segments) > 1:
+                self._evict(self.segments[0])
+
+    def _evict(self, segment):
+        if segment.offset < segment.size:
+            with open(segment.path, "rb") as f:
+                f.seek(segment.offset)
+                lost = sum(1 for line in f if line.endswith(b"\n"))
+            self.batches -= lost
+            self.evicted += lost
+            logging.warning("Spool %s full (%d bytes), %d oldest batches evicted", self.directory, self.max_bytes, lost)
+        self._delete(segment)
+
+    def pop(self):
+        """Oldest unread batch as (segment number, records, attempts) or None
+
+        release(segment number) after batch was delivered (or spooled again)
+        """
+        with self.lock:
+            for segment in self.segments:
+                if segment.offset >= segment.size:
+                    continue
+                if segment is self.segments[-1] and self.file is not None:
+                    self.file.flush()
+                with open(segment.path, "rb") as f:
+                    f.seek(segment.offset)
+                    line = f.readline()
+                if not line.endswith(b"\n"):
+                    logging.warning("Spool segment %s: last line is not complete, ignored", segment.path)
+                    self.size -= segment.size - segment.offset
+                    segment.size = segment.offset
+                    self._release(segment)
+                    continue
+                segment.offset += len(line)
+                self.batches -= 1
+                self.read += 1
+                try:
+                    batch = json.loads(line)
+                    records, attempts = batch["records"], batch["attempts"]
+                except (ValueError, KeyError, TypeError):
+                    logging.error("Spool segment %s: invalid batch ignored", segment.path)
+                    self._release(segment)
+                    continue
+                segment.outstanding += 1
+                return segment.number, records, attempts
+            return None
+
+    def release(self, number):
+        """Batch read from segment number was delivered (or spooled again)"""
+        with self.lock:
+            for segment in self.segments:
+                if segment.number == number:
+                    segment.outstanding -= 1
+                    self._release(segment)
+                    break
+
+    def _release(self, segment):
+        #segment being written is kept, it is deleted when replaced by next one
+        if not segment.outstanding and segment.offset >= segment.size and segment is not self.segments[-1]:
+            self._delete(segment)
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+
+    def __len__(self):
+        return self.batches
+
+    def report(self):
+        return dict(batches=self.batches, bytes=self.size, segments=len(self.segments), appended=self.appended,
+                    read=self.read, evicted=self.evicted, fsyncs=self.fsyncs)
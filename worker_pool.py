@@ -0,0 +1,137 @@
+"""
+\file       worker_pool.py
+\author     Ladislav Stefka
+\brief      Shared pool of threads driving LoRa node state machines
+            - fixed number of threads regardless of number of nodes, node is processed by one thread at a time
+            - node is scheduled when its inbox gets a message (radio packet, JSON packet, timer)
+            - one I/O thread polls sockets (selectors, e.g. Node-RED UDP endpoint) and advances shared timer wheel
+              (timer_wheel.py), idle nodes cost nothing
+\copyright
+"""
+
+import logging
+import selectors
+import threading
+import time
+from queue import Queue
+
+import timer_wheel
+
+POOL_THREADS = 4
+#messages processed by node before its thread is given to other nodes
+NODE_BATCH = 16
+
+
+class WorkerPool:
+    """Fixed size pool of threads running node state machines
+
+    Node interface: inbox (sized queue, bounded_queue.py), scheduled (flag owned by pool), run(max_batch) - process messages from inbox
+    """
+
+    def __init__(self, threads=POOL_THREADS, resolution=timer_wheel.TIMER_RESOLUTION):
+        self.size = threads
+        #timer callbacks run on I/O thread, they should only put message to node inbox
+        self.timers = timer_wheel.TimerWheel(resolution)
+        self.run_queue = Queue()
+        self.lock = threading.Lock()
+        self.nodes = set()
+        self.selector = selectors.DefaultSelector()
+        self.threads = []
+        self.running = False
+        self.processed = 0
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        for i in range(self.size):
+            self.threads.append(threading.Thread(target=self._worker, name="NODE_POOL_{}".format(i), daemon=True))
+        self.threads.append(threading.Thread(target=self._io, name="NODE_POOL_IO", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        for _ in range(self.size):
+            self.run_queue.put(None)
+        for thread in self.threads:
+            thread.join(1.0)
+        self.threads = []
+
+    def add(self, node):
+        with self.lock:
+            self.nodes.add(node)
+        self.start()
+        if node.inbox:
+            self.schedule(node)
+
+    def remove(self, node):
+        with self.lock:
+            self.nodes.discard(node)
+
+    def add_reader(self, sock, handler):
+        """handler() is called by I/O thread when sock is readable"""
+        self.selector.register(sock, selectors.EVENT_READ, handler)
+        self.start()
+
+    def remove_reader(self, sock):
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def schedule(self, node):
+        """Node is put to run queue only once, until its inbox is empty"""
+        with self.lock:
+            if node.scheduled:
+                return
+            node.scheduled = True
+        self.run_queue.put(node)
+
+    def _worker(self):
+        while True:
+            node = self.run_queue.get()
+            if node is None:
+                return
+            processed = 0
+            try:
+                processed = node.run(NODE_BATCH)
+            except Exception:
+                logging.exception("%s: node state machine failed", node.name)
+            with self.lock:
+                self.processed += processed
+                node.scheduled = bool(node.inbox)
+                requeue = node.scheduled
+            if requeue:
+                self.run_queue.put(node)
+
+    def _io(self):
+        while self.running:
+            for key, _ in self.selector.select(max(0.0, self.timers.next_deadline() - time.monotonic())):
+                try:
+                    key.data()
+                except Exception:
+                    logging.exception("Socket reader failed")
+            self.timers.advance()
+
+    def report(self):
+        return dict(
+            nodes=len(self.nodes),
+            pool_threads=len(self.threads),
+            process_threads=threading.active_count(),
+            processed=self.processed,
+            timers=len(self.timers),
+            timers_fired=self.timers.fired,
+        )
+
+
+_shared_pool = None
+
+
+def shared_pool():
+    """Pool used by all node workers of gateway"""
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = WorkerPool()
+    return _shared_pool